@@ -1,10 +1,9 @@
-from mistralai.client import MistralClient
-import os
+from src.llm_gateway import get_gateway
 
 class MistralWorkoutAdvisor:
     def __init__(self):
         # Make sure to set MISTRAL_API_KEY in your environment variables
-        self.client = MistralClient(api_key=os.getenv('MISTRAL_API_KEY'))
+        self.gateway = get_gateway()
         
     def generate_advice(self, workout_data, research_findings):
         messages = [
@@ -19,16 +18,16 @@ class MistralWorkoutAdvisor:
         ]
         
         try:
-            response = self.client.chat.complete(
-                model="mistral-tiny",
-                messages=messages,
+            response = self.gateway.complete(
+                'advice',
+                messages,
                 temperature=0.7,
                 max_tokens=300
             )
-            if not response or not response.choices:
+            if not response:
                 print("No response from Mistral API")
                 return "Unable to generate AI recommendations at this time."
-            return response.choices[0].message.content
+            return response
         except Exception as e:
             print(f"Error generating Mistral advice: {str(e)}")
             return "Unable to generate AI recommendations at this time."
@@ -1,6 +1,8 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+import click
 from flask_cors import CORS
 import os
+import hmac
 from dotenv import load_dotenv
 from elasticsearch import Elasticsearch
 from data.dataLoader import make_index
@@ -9,7 +11,14 @@ from firebase_admin import credentials, auth
 from src.workout_generator import generate_workout_plan
 from src.workout_history import get_workout_history, save_workout_history, clear_workout_history
 from functools import wraps
-from src.chat import prompt_llm
+from src.chat import prompt_llm, stream_answer, embedding as chat_embedding
+from src.fallback_pools import get_fallback_pools
+from src.precomputed_tips import precomputed_tips
+from src.deadline import parse_deadline_header
+from src.sse import format_sse, stream_events
+from src.jobs import JOB_TIMEOUT, JOB_DEADLINE_MARGIN, JOB_MAX_WAIT, QueueFull, get_job_queue
+from src.llm_metrics import llm_metrics
+from src.llm_gateway import get_gateway
 
 # Load environment variables from .env file
 load_dotenv()
@@ -30,9 +39,22 @@ ELASTICSEARCH_USER = os.getenv("ELASTICSEARCH_USER")
 ELASTICSEARCH_PASSWORD = os.getenv("ELASTICSEARCH_PASSWORD")
 ELASTICSEARCH_API_KEY = os.getenv("ELASTICSEARCH_API_KEY")
 
+# /metrics/llm is internal: it is only served when a token is configured, to callers sending it
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
 # Initialize Elasticsearch client
 es = Elasticsearch("http://elasticsearch:9200")
 
+# Load the in-memory exercise catalog up front so the first /query doesn't pay for it.
+# The fallback exercise pools are built from it with either catalog backend.
+try:
+    get_fallback_pools()
+except Exception as e:
+    print(f"Error loading exercise catalog: {str(e)}")
+
+# Load the precomputed tips sidecar file, if `flask precompute-tips` has written one
+precomputed_tips.load()
+
 # Initialize Flask app
 app = Flask(__name__)
 
@@ -44,7 +66,7 @@ def add_cors(f):
             resp = app.make_response("")
             resp.headers['Access-Control-Allow-Origin'] = 'http://localhost:3000'
             resp.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-            resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Accept'
+            resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Accept, X-Request-Deadline-Ms'
             resp.headers['Access-Control-Allow-Credentials'] = 'true'
             return resp
         
@@ -69,7 +91,7 @@ def add_cors(f):
             
         resp.headers['Access-Control-Allow-Origin'] = 'http://localhost:3000'
         resp.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-        resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Accept'
+        resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Accept, X-Request-Deadline-Ms'
         resp.headers['Access-Control-Allow-Credentials'] = 'true'
         
         return resp
@@ -80,7 +102,7 @@ def add_cors(f):
 def add_cors_headers(response):
     # Always add these headers to every response
     response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization, Accept')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization, Accept, X-Request-Deadline-Ms')
     response.headers.add('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
     response.headers.add('Access-Control-Allow-Credentials', 'true')
     return response
@@ -363,8 +385,9 @@ def query():
         if not query_text:
             return jsonify({'status': 'error', 'message': 'No query provided'}), 400
 
-        # Generate workout plan
-        workout_plan = generate_workout_plan(query_text)
+        # Generate workout plan within the client's deadline (or the server default)
+        deadline = parse_deadline_header(request.headers.get('X-Request-Deadline-Ms'))
+        workout_plan = generate_workout_plan(query_text, deadline=deadline)
         
         # Save to history
         uid = decoded_token['uid']
@@ -378,6 +401,102 @@ def query():
         print(f"Error generating workout: {str(e)}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
     
+@app.route("/query/stream", methods=['POST'])
+def query_stream():
+    """Like /query, but streams the plan as Server-Sent Events while it is generated"""
+    decoded_token = verify_token()
+    if not decoded_token:
+        return jsonify({'status': 'error', 'message': 'Invalid or missing token'}), 401
+
+    data = request.get_json()
+    query_text = data.get('query')
+    if not query_text:
+        return jsonify({'status': 'error', 'message': 'No query provided'}), 400
+
+    deadline = parse_deadline_header(request.headers.get('X-Request-Deadline-Ms'))
+    uid = decoded_token['uid']
+
+    def produce(emit):
+        workout_plan = generate_workout_plan(query_text, deadline=deadline, on_event=emit)
+
+        # The final event carries the same plan that is saved to history
+        history_id = save_workout_history(uid, workout_plan, query_text)
+        emit('complete', {
+            'status': 'success',
+            'workout_plan': workout_plan,
+            'history_id': history_id
+        })
+
+    return Response(stream_events(produce), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
+@app.route("/jobs/query", methods=['POST'])
+def submit_query_job():
+    """Queue a workout plan for background generation and return its job id right away"""
+    decoded_token = verify_token()
+    if not decoded_token:
+        return jsonify({'status': 'error', 'message': 'Invalid or missing token'}), 401
+
+    data = request.get_json()
+    query_text = data.get('query')
+    if not query_text:
+        return jsonify({'status': 'error', 'message': 'No query provided'}), 400
+
+    uid = decoded_token['uid']
+    # Keep the generator's own deadline well inside the job timeout, leaving room for its overrun and the history save
+    deadline = min(parse_deadline_header(request.headers.get('X-Request-Deadline-Ms')),
+                   max(1.0, JOB_TIMEOUT - JOB_DEADLINE_MARGIN))
+
+    def save_plan(workout_plan):
+        # Runs only for plans that finished within the job timeout
+        history_id = save_workout_history(uid, workout_plan, query_text)
+        return {'workout_plan': workout_plan, 'history_id': history_id}
+
+    try:
+        job = get_job_queue().submit(lambda: generate_workout_plan(query_text, deadline=deadline),
+                                     owner=uid, persist=save_plan)
+    except QueueFull as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+
+    return jsonify({
+        'status': 'success',
+        'job_id': job.id,
+        'job_status': job.status,
+        'status_url': f"/jobs/{job.id}"
+    }), 202
+
+@app.route("/jobs/<job_id>", methods=['GET'])
+def query_job_status(job_id):
+    """Status of a plan job. With ?wait=<seconds>, long-polls until the job finishes."""
+    decoded_token = verify_token()
+    if not decoded_token:
+        return jsonify({'status': 'error', 'message': 'Invalid or missing token'}), 401
+
+    job = get_job_queue().get(job_id, owner=decoded_token['uid'])
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0), JOB_MAX_WAIT)
+    except ValueError:
+        wait = 0
+    if wait and not job.done:
+        job.wait(wait)
+
+    return jsonify({'status': 'success', 'job': job.to_dict()})
+
+@app.route("/metrics/llm", methods=['GET'])
+def llm_metrics_report():
+    # Rolling per-stage LLM latency, token, outcome and cache statistics for this worker, plus query embedding cache stats
+    if not METRICS_TOKEN:
+        return jsonify({'status': 'error', 'message': 'Not found'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Metrics-Token', '').encode(), METRICS_TOKEN.encode()):
+        return jsonify({'status': 'error', 'message': 'Invalid or missing metrics token'}), 401
+    report = llm_metrics.snapshot()
+    report['rate_limiter'] = get_gateway().limiter.stats()
+    report['embedding_cache'] = chat_embedding.stats()
+    return jsonify(report)
+
 @app.route('/chat',methods=["POST"])
 def ask_question():
     if request.method != "POST":
@@ -391,7 +510,34 @@ def ask_question():
         answer = prompt_llm(query,session_id)  
         return jsonify({"response":answer}), 200
     except Exception as e:
-        return jsonify({"error":e}), 500
+        return jsonify({"error":str(e)}), 500
+
+@app.route('/chat/stream',methods=["POST"])
+def ask_question_stream():
+    data = request.get_json()
+    if not data or "query" not in data or "session_id" not in data:
+        return jsonify({"error":"Invalid request"}), 400
+    query = data["query"]
+    session_id = data["session_id"]
+
+    def generate():
+        # Relays answer tokens as they arrive, then the complete answer
+        chunks = stream_answer(query,session_id)
+        answer = []
+        try:
+            for chunk in chunks:
+                answer.append(chunk)
+                yield format_sse('token',{'text':chunk})
+            yield format_sse('complete',{'response':''.join(answer)})
+        except Exception as e:
+            print(f"Error streaming chat answer: {str(e)}")
+            yield format_sse('error',{'status':'error','message':str(e)})
+        finally:
+            # Also runs when the client disconnects and the server closes this generator, cancelling the LLM request
+            chunks.close()
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.cli.command()
 def reindex():
@@ -400,6 +546,15 @@ def reindex():
     make_index()
     print('Done')
 
+@app.cli.command('precompute-tips')
+@click.option('--llm', is_flag=True, help='Also generate LLM tips for exercises that have none.')
+@click.option('--rate', type=float, default=None, help='Maximum LLM calls per second.')
+@click.option('--restart', is_flag=True, help='Ignore tips stored by a previous run.')
+def precompute_tips_command(llm, rate, restart):
+    from src.precomputed_tips import PRECOMPUTE_TIPS_RATE, precompute_tips
+    precompute_tips(use_llm=llm, rate=PRECOMPUTE_TIPS_RATE if rate is None else rate, restart=restart)
+    print('Done')
+
 @app.cli.command()
 def check():
     es = Elasticsearch(ELASTICSEARCH_URL,basic_auth=[ELASTICSEARCH_USER,ELASTICSEARCH_PASSWORD],api_key=ELASTICSEARCH_API_KEY,ca_certs='cert.crt')
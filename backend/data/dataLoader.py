@@ -1,6 +1,8 @@
 import json
 import csv
 import os
+import sys
+import time
 from dotenv import load_dotenv
 from elasticsearch import Elasticsearch
 from langchain.docstore.document import Document
@@ -145,12 +147,29 @@ def make_index():
         es.indices.refresh(index='workout_history')
         print("Indexed sample workouts as fallback")
         print("Created workout_history index")
+    
+    # Stamp the generation only once every document is indexed and visible: it lets running
+    # servers notice the reindex and rebuild their in-memory exercise catalog, so stamping
+    # earlier would let them load a partial index as the new generation
+    es.indices.put_mapping(index='workouts', meta={'generation': int(time.time() * 1000)})
 
 def get_embedding_model():
     '''Initalizes the HuggingFace embedding model'''
     embedding = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
     return embedding
 
+def finalize_rag_index(es, index, embedding):
+    """
+    Stamp a freshly built RAG index with a generation and precompute the split muscle
+    results that chat serves from memory; servers drop their copy once the generations
+    no longer match
+    """
+    from src.workout_splits import materialize_split_results
+    generation = int(time.time() * 1000)
+    es.indices.put_mapping(index=index, meta={'generation': generation})
+    materialize_split_results(es, embedding, generation)
+    print('RAG index created successfully')
+
 def make_rag_index():
     """Create and populate the RAG-enabled index with comprehensive workout data"""
     embedding = HuggingFaceEmbeddings(
@@ -188,7 +207,8 @@ def make_rag_index():
         index_name='workouts_rag',
         embedding=embedding
     )
-    print('RAG index created successfully')
+
+    finalize_rag_index(es_connection, 'workouts_rag', embedding)
 
 def new_rag_index():
     """Create and populate the RAG-enabled index with comprehensive workout data"""
@@ -239,7 +259,10 @@ def new_rag_index():
         index_name='workouts_rag',
         embedding=embedding
     )
-    print('RAG index created successfully')
+
+    finalize_rag_index(es_connection, 'workouts_rag', embedding)
 
 if __name__ == "__main__":
+    # Make the src package importable when run as a script
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
     new_rag_index()
\ No newline at end of file
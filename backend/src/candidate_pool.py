@@ -0,0 +1,62 @@
+from collections import defaultdict
+
+class CandidatePool:
+    """
+    Candidate exercises for a plan, keyed by their Elasticsearch/catalog id.
+    Adding, dedup and "already used" checks are O(1) dictionary/set lookups
+    instead of comparing workout dicts against lists. Iteration is by inclusion
+    score, highest first, keeping insertion order between equal scores.
+    """
+
+    def __init__(self):
+        self.workouts = {}  # doc_id -> workout, in insertion order
+        self.scores = {}
+        self.used = set()
+        self._ordered = None
+
+    def __len__(self):
+        return len(self.workouts)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.workouts
+
+    def __iter__(self):
+        """Workouts in score order"""
+        return (self.workouts[doc_id] for doc_id in self.ordered_ids())
+
+    def add(self, doc_id, workout, score):
+        """Add a workout unless its id is already in the pool. Returns whether it was added."""
+        if doc_id in self.workouts:
+            return False
+        workout['inclusion_score'] = score
+        self.workouts[doc_id] = workout
+        self.scores[doc_id] = score
+        self._ordered = None
+        return True
+
+    def get(self, doc_id):
+        return self.workouts.get(doc_id)
+
+    def score(self, doc_id):
+        return self.scores.get(doc_id, 0)
+
+    def ordered_ids(self, doc_ids=None):
+        """Ids sorted by score (the whole pool, or just doc_ids)"""
+        if doc_ids is not None:
+            return sorted(doc_ids, key=self.score, reverse=True)
+        if self._ordered is None:
+            self._ordered = sorted(self.workouts, key=self.score, reverse=True)
+        return self._ordered
+
+    def by_body_part(self, doc_ids=None):
+        """Ids grouped by the workouts' BodyPart, in the order given (score order for the whole pool)"""
+        groups = defaultdict(list)
+        for doc_id in self.ordered_ids() if doc_ids is None else doc_ids:
+            groups[self.workouts[doc_id].get('BodyPart', 'General')].append(doc_id)
+        return groups
+
+    def mark_used(self, doc_ids):
+        self.used.update(doc_ids)
+
+    def is_used(self, doc_id):
+        return doc_id in self.used
@@ -0,0 +1,266 @@
+import os
+import re
+import json
+import math
+import time
+import threading
+from collections import defaultdict
+from elasticsearch import Elasticsearch
+
+# 'memory' serves plan retrieval from the in-process catalog, 'elasticsearch' sends every query to ES
+CATALOG_BACKEND = os.getenv("CATALOG_BACKEND", "memory")
+CATALOG_REFRESH_INTERVAL = float(os.getenv("CATALOG_REFRESH_INTERVAL", "30"))  # Seconds between change checks
+CATALOG_FILE = os.getenv("FILE", 'data/exerciseData.json')
+CATALOG_INDEX = 'workouts'
+ELASTICSEARCH_URL = os.getenv("ELASTICSEARCH_URL", "http://elasticsearch:9200")
+
+KEYWORD_FIELDS = ('Type', 'Equipment', 'Level', 'BodyPart')
+TEXT_FIELDS = ('Title', 'Description')
+
+def tokenize(text):
+    """Lowercase word tokens, roughly what the ES standard analyzer produces"""
+    return re.findall(r'\w+', str(text or '').lower())
+
+class UnsupportedQuery(ValueError):
+    """Raised for query shapes the in-memory catalog doesn't implement"""
+
+class ExerciseCatalog:
+    """
+    Immutable snapshot of the exercise catalog with inverted indexes by
+    Equipment, BodyPart, Level and Type and a token index over Title and
+    Description. A reload builds a new instance instead of mutating this one.
+    """
+
+    def __init__(self, documents, generation=None, source=''):
+        # documents: list of (doc_id, source_dict)
+        self.generation = generation
+        self.source = source
+        self.ids = tuple(doc_id for doc_id, _ in documents)
+        self.documents = tuple(dict(doc) for _, doc in documents)
+        self._position = {doc_id: pos for pos, doc_id in enumerate(self.ids)}
+
+        keyword_index = {field: defaultdict(list) for field in KEYWORD_FIELDS}
+        token_index = {field: defaultdict(list) for field in TEXT_FIELDS}
+        for pos, doc in enumerate(self.documents):
+            for field in KEYWORD_FIELDS:
+                keyword_index[field][doc.get(field, '')].append(pos)
+            for field in TEXT_FIELDS:
+                for token in set(tokenize(doc.get(field, ''))):
+                    token_index[field][token].append(pos)
+
+        self.keyword_index = {field: {value: tuple(positions) for value, positions in index.items()}
+                              for field, index in keyword_index.items()}
+        self.token_index = {field: {token: tuple(positions) for token, positions in index.items()}
+                            for field, index in token_index.items()}
+
+        # Inverse document frequency per field/token, so rare words weigh more (like BM25)
+        total = len(self.documents)
+        self.idf = {
+            field: {token: math.log(1 + (total - len(positions) + 0.5) / (len(positions) + 0.5))
+                    for token, positions in index.items()}
+            for field, index in self.token_index.items()
+        }
+
+    def __len__(self):
+        return len(self.documents)
+
+    def get(self, doc_id):
+        pos = self._position.get(doc_id)
+        return dict(self.documents[pos]) if pos is not None else None
+
+    def values(self, field):
+        """Distinct values of a keyword field"""
+        return list(self.keyword_index[field].keys())
+
+    def with_value(self, field, value):
+        """Copies of all documents whose keyword field equals value, as (doc_id, doc) pairs"""
+        return [(self.ids[pos], dict(self.documents[pos])) for pos in self.keyword_index[field].get(value, ())]
+
+    def _match_scores(self, clause):
+        """Score contributions of a single {'match': {field: query}} clause as {position: score}"""
+        if 'match' not in clause or len(clause['match']) != 1:
+            raise UnsupportedQuery(f"Unsupported clause: {clause}")
+        (field, spec), = clause['match'].items()
+        if isinstance(spec, dict):
+            query, boost = spec.get('query', ''), spec.get('boost', 1)
+        else:
+            query, boost = spec, 1
+
+        scores = defaultdict(float)
+        if field in KEYWORD_FIELDS:
+            # Keyword fields only match the exact value
+            for pos in self.keyword_index[field].get(str(query), ()):
+                scores[pos] += boost
+        elif field in TEXT_FIELDS:
+            postings, idf = self.token_index[field], self.idf[field]
+            for token in set(tokenize(query)):
+                for pos in postings.get(token, ()):
+                    scores[pos] += boost * idf[token]
+        else:
+            raise UnsupportedQuery(f"Unknown field: {field}")
+        return scores
+
+    def search(self, body):
+        """
+        Run a bool query of match clauses (the subset used by the workout
+        generator) and return ES-shaped hits. Each hit's _source is a copy,
+        so callers may annotate it freely.
+        """
+        size = body.get('size', 10)
+        query = body.get('query', {})
+        if set(query.keys()) != {'bool'}:
+            raise UnsupportedQuery(f"Unsupported query: {query}")
+        bool_query = query['bool']
+        if set(bool_query.keys()) - {'must', 'should', 'minimum_should_match'}:
+            raise UnsupportedQuery(f"Unsupported bool query: {bool_query}")
+
+        must = bool_query.get('must', [])
+        should = bool_query.get('should', [])
+        minimum_should_match = bool_query.get('minimum_should_match', 0 if must else 1)
+
+        candidates = None
+        scores = defaultdict(float)
+        for clause in must:
+            clause_scores = self._match_scores(clause)
+            candidates = set(clause_scores) if candidates is None else candidates & set(clause_scores)
+            for pos, score in clause_scores.items():
+                scores[pos] += score
+
+        matched_should = defaultdict(int)
+        for clause in should:
+            for pos, score in self._match_scores(clause).items():
+                if candidates is None or pos in candidates:
+                    scores[pos] += score
+                    matched_should[pos] += 1
+
+        if candidates is None:
+            candidates = set(matched_should)
+        results = [pos for pos in candidates if matched_should[pos] >= minimum_should_match]
+        results.sort(key=lambda pos: (-scores[pos], pos))
+
+        return {'hits': {'hits': [
+            {'_id': self.ids[pos], '_score': scores[pos], '_source': dict(self.documents[pos])}
+            for pos in results[:size]
+        ]}}
+
+def get_index_generation(es, index=CATALOG_INDEX):
+    """Generation stamp that make_index writes into the index mapping's _meta (None if missing)"""
+    mapping = es.indices.get_mapping(index=index)
+    return mapping[index]['mappings'].get('_meta', {}).get('generation')
+
+def load_catalog_from_es(es, index=CATALOG_INDEX):
+    """
+    Build a catalog from every document in the workouts index. Raises if the index
+    isn't stamped with a generation yet (a reindex is still loading) or is empty.
+    """
+    generation = get_index_generation(es, index)
+    if generation is None:
+        raise RuntimeError(f"Index {index} has no generation stamp, it is still being built")
+    result = es.search(index=index, query={'match_all': {}}, size=10000)
+    documents = [(hit['_id'], hit['_source']) for hit in result['hits']['hits']]
+    if not documents:
+        raise RuntimeError(f"Index {index} has no exercises")
+    return ExerciseCatalog(documents, generation=generation, source='elasticsearch')
+
+def load_catalog_from_file(path=CATALOG_FILE):
+    """Build a catalog from the raw dataset, formatted the same way make_index indexes it"""
+    with open(path, 'rt') as file:
+        workouts = json.loads(file.read())
+    documents = []
+    for row, workout in enumerate(workouts):
+        documents.append((f"file-{workout.get('id', row)}", {
+            "Title": workout.get('Title', ''),
+            "Description": workout.get('Desc', ''),
+            "Type": workout.get('Type', ''),
+            "Equipment": workout.get('Equipment', ''),
+            "Level": workout.get('Level', ''),
+            "BodyPart": workout.get('BodyPart', '')
+        }))
+    return ExerciseCatalog(documents, generation=f"file:{os.path.getmtime(path)}", source='file')
+
+_catalog = None
+_catalog_lock = threading.Lock()
+_load_lock = threading.Lock()
+_last_check = 0.0
+_refreshing = False
+_reload_listeners = []
+
+def add_reload_listener(callback):
+    """Call callback(catalog) every time a new catalog snapshot is swapped in"""
+    _reload_listeners.append(callback)
+
+def _es_client():
+    return Elasticsearch(ELASTICSEARCH_URL)
+
+def load_catalog(previous=None):
+    """
+    Load the catalog from Elasticsearch. If that fails, `previous` is kept when it
+    came from Elasticsearch (the index may be mid-reindex); otherwise the catalog
+    falls back to the dataset file.
+    """
+    try:
+        return load_catalog_from_es(_es_client())
+    except Exception as e:
+        if previous is not None and previous.source == 'elasticsearch':
+            print(f"Could not reload exercise catalog from Elasticsearch, keeping generation {previous.generation}: {str(e)}")
+            return previous
+        print(f"Could not load exercise catalog from Elasticsearch, using {CATALOG_FILE}: {str(e)}")
+        return load_catalog_from_file()
+
+def reload_catalog():
+    """Build a new catalog and swap it in atomically. Readers keep whichever snapshot they already hold."""
+    global _catalog
+    catalog = load_catalog(_catalog)
+    if catalog is _catalog:
+        return catalog
+    with _catalog_lock:
+        _catalog = catalog
+    print(f"Loaded exercise catalog: {len(catalog)} exercises from {catalog.source} (generation {catalog.generation})")
+    for callback in _reload_listeners:
+        try:
+            callback(catalog)
+        except Exception as e:
+            print(f"Error in exercise catalog reload listener: {str(e)}")
+    return catalog
+
+def _catalog_changed(catalog):
+    if catalog.source == 'file':
+        # Switch to ES once it is reachable with a stamped index, or pick up an edited dataset file
+        try:
+            if get_index_generation(_es_client()) is not None:
+                return True
+        except Exception:
+            pass
+        return f"file:{os.path.getmtime(CATALOG_FILE)}" != catalog.generation
+    return get_index_generation(_es_client()) != catalog.generation
+
+def _refresh_if_changed():
+    global _refreshing
+    try:
+        if _catalog_changed(_catalog):
+            reload_catalog()
+    except Exception as e:
+        print(f"Error checking exercise catalog for changes: {str(e)}")
+    finally:
+        _refreshing = False
+
+def get_catalog():
+    """
+    Return the current catalog snapshot, loading it on first use. Change checks
+    run in the background at most every CATALOG_REFRESH_INTERVAL seconds.
+    """
+    global _last_check, _refreshing
+    if _catalog is None:
+        with _load_lock:
+            if _catalog is None:
+                reload_catalog()
+                _last_check = time.monotonic()
+        return _catalog
+
+    if time.monotonic() - _last_check > CATALOG_REFRESH_INTERVAL and not _refreshing:
+        with _catalog_lock:
+            if not _refreshing:
+                _refreshing = True
+                _last_check = time.monotonic()
+                threading.Thread(target=_refresh_if_changed, daemon=True, name="catalog-refresh").start()
+    return _catalog
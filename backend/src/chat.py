@@ -3,14 +3,20 @@ import sys
 from dotenv import load_dotenv
 from elasticsearch import Elasticsearch
 from langchain_elasticsearch import ElasticsearchStore
-from langchain_mistralai import ChatMistralAI
-from fuzzywuzzy import process
-from jinja2 import Template
 from langchain_elasticsearch import ElasticsearchChatMessageHistory
+from langchain_core.documents import Document
+from mistralai.models.chat_completion import ChatMessage
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 sys.path.append(f"{basedir}/../")
 from data.dataLoader import get_embedding_model
+from src.llm_gateway import get_gateway
+from src.intent_cache import canonicalize_query
+from src.single_flight import SingleFlight, SingleFlightTimeout
+from src.llm_metrics import llm_metrics
+from src.prompt_registry import render_prompt, pack_documents, warm_templates
+from src.embedding_cache import CachedEmbeddings
+from src.workout_splits import RAG_INDEX, SPLIT_DOCUMENTS_PER_MUSCLE, SPLIT_MUSCLES, SplitResults, get_workout_split, search_muscles, split_muscles
 
 
 load_dotenv()
@@ -24,108 +30,98 @@ if not MISTRAL_API_KEY:
     sys.exit("Please put the Mistral API key in the .env file!")
 
 es = Elasticsearch(ELASTICSEARCH_URL)
-doc_store = ElasticsearchStore(es_connection=es,index_name='workouts_rag',embedding=get_embedding_model())
+#Query vectors are cached, so repeated questions and split muscles skip the model
+embedding = CachedEmbeddings(get_embedding_model(),symmetric=True)
+embedding.prewarm(SPLIT_MUSCLES)
+doc_store = ElasticsearchStore(es_connection=es,index_name=RAG_INDEX,embedding=embedding)
+split_results = SplitResults(es)
 
-llm = ChatMistralAI(model_name="mistral-small-latest",api_key=MISTRAL_API_KEY)
+llm = get_gateway()
+warm_templates()
+chat_flight = SingleFlight('chat')
 
 def prompt_llm(question:str,session_id:int):
     '''Prompts the LLM and Elasticsearch with the users question and returns a response'''
+    # Identical questions asked at the same time share one answer. Chat history isn't used yet,
+    # so the answer only depends on the question; the key needs the session_id once it is.
+    try:
+        return chat_flight.do(canonicalize_query(question),lambda: answer_question(question,session_id))
+    except SingleFlightTimeout as e:
+        #The identical question in flight is stuck, so answer this one separately
+        print(f"{str(e)}, answering separately")
+        return answer_question(question,session_id)
+
+def build_rag_prompt(question:str)->str:
+    '''Retrieves documents for the question and renders the RAG prompt'''
     #Get chat history
     #chat_history = get_chat_history('workouts_rag',session_id)
     #if(len(chat_history.messages) > 0):
-        #with open("./src/templates/condensed_question.txt") as file:
-            #condensed_template = file.read()
-        #question = Template(condensed_template).render(chat_history) #Condense chat history down to one question to reduce input size
+        #question = render_prompt('condensed_question.txt',**chat_history) #Condense chat history down to one question to reduce input size
 
 
-    documents = []
+    results = []
     workout_split = get_workout_split(question)
     if workout_split:
-        split_days = workout_split["days"]
-        for day,muscle_groups in split_days.items():
-            for muscle in muscle_groups:
-                documents.extend(doc_store.similarity_search(muscle,k=20))
+        #Days that train the same muscle share its search results
+        results.extend(search_split_documents(workout_split["days"]).values())
     else:
-        documents.extend(doc_store.similarity_search(question,k=3))
-        
-    with open("./src/templates/rag_prompt.txt") as file:
-        template = file.read()
-    template = Template(template)
+        results.append(doc_store.similarity_search(question,k=3))
 
-    full_rag_question = template.render(question=question,documents=documents,workout_split=workout_split)
+    #Deduplicate, trim and project the documents to fit the prompt's token budget
+    documents = pack_documents(results)
 
-    answer = llm.invoke(full_rag_question)
-    print(answer.content)
+    return render_prompt('rag_prompt.txt',question=question,documents=documents,workout_split=workout_split)
+
+def answer_question(question:str,session_id:int):
+    '''Retrieves documents for the question and asks the LLM to answer it'''
+    full_rag_question = build_rag_prompt(question)
+
+    try:
+        answer = llm.complete('chat',[ChatMessage(role="user",content=full_rag_question)])
+    except Exception:
+        llm_metrics.record_outcome('chat','error')
+        raise
+    llm_metrics.record_outcome('chat','success')
+    print(answer)
 
     #chat_history.add_user_message(question)
     #chat_history.add_ai_message(answer)
 
-    return answer.content
+    return answer
+
+def stream_answer(question:str,session_id:int):
+    '''Yields the answer in chunks as the LLM generates it. Closing the generator cancels the LLM request.'''
+    full_rag_question = build_rag_prompt(question)
+
+    chunks = llm.stream('chat',[ChatMessage(role="user",content=full_rag_question)])
+    try:
+        for chunk in chunks:
+            yield chunk
+    except GeneratorExit:
+        llm_metrics.record_outcome('chat','cancelled')
+        raise
+    except Exception:
+        llm_metrics.record_outcome('chat','error')
+        raise
+    finally:
+        chunks.close()
+    llm_metrics.record_outcome('chat','success')
+
+def search_split_documents(split_days:dict)->dict:
+    '''Documents for each distinct muscle in a split by rank, precomputed at indexing time when available'''
+    muscles = split_muscles(split_days)
+    results = split_results.get(muscles)
+    if results is None:
+        try:
+            results = search_muscles(es,embedding,muscles)
+        except Exception as e:
+            print(f"Error running batched split search, searching per muscle: {str(e)}")
+            return {muscle:doc_store.similarity_search(muscle,k=SPLIT_DOCUMENTS_PER_MUSCLE) for muscle in muscles}
+    return {muscle:[Document(page_content=document['text'],metadata=document['metadata']) for document in documents]
+            for muscle,documents in results.items()}
 
 def get_chat_history(index_name:str,session_id:int):
     return ElasticsearchChatMessageHistory(es_connection=es,index=index_name,session_id=session_id)
 
 
-def get_workout_split(question:str)->dict:
-    '''Gets the muscle groups trained each day in a named workout split'''
-    WORKOUT_SPLITS = {
-        "arnold": {
-            "name": "Arnold Split",
-            "days": {
-                "Day 1": ["Chest", "Back"],
-                "Day 2": ["Shoulders", "Bicep","Tricep"],
-                "Day 3": ["Legs"],
-                "Day 4": ["Chest", "Back"],
-                "Day 5": ["Shoulders","Bicep","Tricep"],
-                "Day 6": ["Legs"]
-            }
-        },
-        "push pull legs": {
-            "name": "Push Pull Legs",
-            "days": {
-                "Day 1": ["Chest", "Shoulders", "Triceps"],
-                "Day 2": ["Back", "Biceps"],
-                "Day 3": ["Legs"],
-                "Day 4": ["Chest", "Shoulders", "Triceps"],
-                "Day 5": ["Back", "Biceps"],
-                "Day 6": ["Legs"]
-            }
-        },
-        "upper lower": {
-            "name": "Upper Lower Split",
-            "days": {
-                "Day 1": ["Chest","Shoulders","Bicep","Tricep","Back"],
-                "Day 2": ["Legs","Hips"],
-                "Day 3": ["Chest","Shoulders","Bicep","Tricep","Back"],
-                "Day 4": ["Legs","Hips"]
-            }
-        },
-        "full body": {
-            "name": "Full Body",
-            "days": {
-                "Day 1": ["Chest","Shoulders","Bicep","Tricep","Back","Legs"],
-                "Day 2": ["Chest","Shoulders","Bicep","Tricep","Back","Legs"],
-                "Day 3": ["Chest","Shoulders","Bicep","Tricep","Back","Legs"]
-            }
-        },
-        "bro":{
-            "name": "Bro Split",
-            "days": {
-                "Day 1": ["Chest"],
-                "Day 2:": ["Back"],
-                "Day 3:": ["Shoulders"],
-                "Day 4:": ["Arms"],
-                "Day 5:": ["Legs"]
-            }
-        }
-    }
-
-    splits = list(WORKOUT_SPLITS.keys())
-    match,score = process.extractOne(question,splits)
-
-    if score > 80:
-        return WORKOUT_SPLITS[match]
-    else:
-        return None
-    
 #prompt_llm("Give me an workout plan using the push pull legs split")
\ No newline at end of file
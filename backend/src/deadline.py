@@ -0,0 +1,69 @@
+import os
+import time
+import threading
+
+PLAN_DEADLINE_SECONDS = float(os.getenv("PLAN_DEADLINE_SECONDS", "25"))  # Default budget for a /query request
+DEADLINE_MIN_STAGE_SECONDS = float(os.getenv("DEADLINE_MIN_STAGE_SECONDS", "0.5"))  # Don't start an AI stage with less
+
+class Deadline:
+    """
+    Wall-clock budget for one request, plus a record of the stages that were
+    degraded: replaced by their rule-based path or skipped to stay within it,
+    or because their AI call failed.
+    """
+
+    def __init__(self, seconds=PLAN_DEADLINE_SECONDS):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.degraded = []
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def budget(self, share=1.0, reserve=0.0):
+        """Seconds a stage may use: `share` of what's left after holding back `reserve`"""
+        return max(0.0, self.remaining() - reserve) * share
+
+    def degrade(self, stage, reason):
+        with self._lock:
+            if stage not in self.degraded:
+                self.degraded.append(stage)
+        print(f"Degraded stage {stage}: {reason}")
+
+def parse_deadline_header(value, default=PLAN_DEADLINE_SECONDS):
+    """Seconds from a deadline header given in milliseconds, or the default if missing or invalid"""
+    try:
+        seconds = float(value) / 1000
+        return seconds if seconds > 0 else default
+    except (TypeError, ValueError):
+        return default
+
+def run_within(deadline, stage, budget, func, fallback):
+    """
+    Run func() but give up after `budget` seconds and return fallback() instead,
+    recording the stage as degraded. The abandoned call finishes in the
+    background; func must not mutate shared state after returning its result.
+    """
+    if budget < DEADLINE_MIN_STAGE_SECONDS:
+        deadline.degrade(stage, f"only {budget:.2f}s of budget left")
+        return fallback()
+
+    outcome = {}
+    finished = threading.Event()
+
+    def target():
+        try:
+            outcome['result'] = func()
+        except Exception as e:
+            outcome['error'] = e
+        finally:
+            finished.set()
+
+    threading.Thread(target=target, daemon=True, name=f"deadline-{stage}").start()
+    if not finished.wait(budget):
+        deadline.degrade(stage, f"exceeded its {budget:.2f}s budget")
+        return fallback()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
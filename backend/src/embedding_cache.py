@@ -0,0 +1,124 @@
+import os
+import sys
+import struct
+import hashlib
+from array import array
+from langchain_core.embeddings import Embeddings
+from src.cache import TieredCache
+
+EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float32")  # float32, or float16 for half the space
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "10000"))
+EMBEDDING_CACHE_PERSIST = os.getenv("EMBEDDING_CACHE_PERSIST", "true").lower() == "true"
+
+def normalize_text(text):
+    """Collapse whitespace; the tokenizer ignores it, so the embedding doesn't change"""
+    return ' '.join(str(text).split())
+
+class CachedEmbeddings(Embeddings):
+    """
+    Caches the vectors of a LangChain embedding model, keyed by model id and
+    normalized text. Vectors are stored as packed float32 (or float16) bytes in
+    an in-process LRU with an optional SQLite tier shared by the workers on the
+    node. With `symmetric` (models that embed queries and documents the same
+    way, like sentence-transformers) embed_query and embed_documents share entries.
+    """
+
+    def __init__(self, embedding, model_id=None, dtype=EMBEDDING_CACHE_DTYPE, symmetric=False,
+                 max_entries=EMBEDDING_CACHE_MAX_ENTRIES, persist=EMBEDDING_CACHE_PERSIST):
+        if dtype not in ('float32', 'float16'):
+            raise ValueError(f"Unsupported embedding cache dtype: {dtype}")
+        self.embedding = embedding
+        self.model_id = model_id or getattr(embedding, 'model_name', None) or type(embedding).__name__
+        self.dtype = dtype
+        self.symmetric = symmetric
+        self.hits = 0
+        self.misses = 0
+        # Values are already bytes, so both tiers store them as they are
+        self.cache = TieredCache('embeddings', max_entries=max_entries, persist=persist,
+                                 disk_max_entries=max_entries * 10, dumps=bytes, loads=bytes)
+
+    def _key(self, text, kind):
+        kind = 'text' if self.symmetric else kind
+        payload = '\0'.join([self.model_id, self.dtype, kind, normalize_text(text)])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _encode(self, vector):
+        if self.dtype == 'float16':
+            return struct.pack(f'<{len(vector)}e', *vector)
+        values = array('f', vector)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values.tobytes()
+
+    def _decode(self, blob):
+        if self.dtype == 'float16':
+            return list(struct.unpack(f'<{len(blob) // 2}e', blob))
+        values = array('f')
+        values.frombytes(blob)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values.tolist()
+
+    def _lookup(self, key):
+        blob = self.cache.get(key)
+        if blob is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._decode(blob)
+
+    def _store(self, key, vector):
+        # Return the stored precision, so hits and misses give the same vectors
+        blob = self._encode(vector)
+        self.cache.set(key, blob)
+        return self._decode(blob)
+
+    def embed_documents(self, texts):
+        """Embed texts, running the model once (in one batch) for the distinct texts not cached"""
+        vectors = [None] * len(texts)
+        missing = {}  # key -> positions
+        for index, text in enumerate(texts):
+            key = self._key(text, 'document')
+            if key in missing:
+                missing[key].append(index)
+                continue
+            vector = self._lookup(key)
+            if vector is None:
+                missing[key] = [index]
+            else:
+                vectors[index] = vector
+
+        if missing:
+            computed = self.embedding.embed_documents([texts[positions[0]] for positions in missing.values()])
+            for (key, positions), vector in zip(missing.items(), computed):
+                vector = self._store(key, vector)
+                for index in positions:
+                    vectors[index] = list(vector)
+        return vectors
+
+    def embed_query(self, text):
+        key = self._key(text, 'query')
+        vector = self._lookup(key)
+        if vector is None:
+            vector = self._store(key, self.embedding.embed_query(text))
+        return vector
+
+    def prewarm(self, texts):
+        """Embed the texts now so later requests for them are cache hits"""
+        texts = list(dict.fromkeys(texts))
+        try:
+            self.embed_documents(texts)
+            print(f"Prewarmed embedding cache with {len(texts)} texts ({self.stats()})")
+        except Exception as e:
+            print(f"Error prewarming embedding cache: {str(e)}")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'model': self.model_id,
+            'dtype': self.dtype,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'cache': self.cache.stats()
+        }
@@ -0,0 +1,130 @@
+import os
+import json
+import threading
+from src.cache import LRUCache
+from src.catalog import add_reload_listener, get_catalog
+
+FALLBACK_POOL_MAX_EXTRA = int(os.getenv("FALLBACK_POOL_MAX_EXTRA", "256"))  # Body-part combinations kept beyond the precomputed ones
+
+# Common exercises searched by name when the constraints leave too few matches
+BASIC_EXERCISES = ["push up", "squat", "lunge", "plank", "crunch", "mountain climber",
+                   "jumping jack", "burpee", "sit up", "pull up", "dip"]
+
+def plan_fallback_queries(params):
+    """
+    Relaxed queries for when the primary search finds too few exercises, as
+    (kind, inclusion_score, body) in priority order: a bodyweight search (for
+    bodyweight requests), then a search per common exercise name.
+    """
+    preferred_body_parts = params['preferred_body_parts']
+    queries = []
+
+    if 'Body Only' in params['preferred_equipment'] or params['no_equipment_only']:
+        # Use a dedicated bodyweight exercise search
+        bodyweight_query = {
+            "size": 200,
+            "query": {
+                "bool": {
+                    "must": [
+                        {"match": {"Equipment": "Body Only"}}
+                    ]
+                }
+            }
+        }
+
+        # Add body parts if specified
+        if preferred_body_parts:
+            bodyweight_query["query"]["bool"]["should"] = [{"match": {"BodyPart": part}} for part in preferred_body_parts]
+
+        queries.append(('bodyweight', 5, bodyweight_query))  # Lower priority than direct matches
+
+    # Final fallback - search for common bodyweight exercises by name
+    for exercise_name in BASIC_EXERCISES:
+        queries.append(('basic', 3, {  # Even lower priority
+            "size": 5,
+            "query": {
+                "bool": {
+                    "should": [
+                        {"match": {"Title": {"query": exercise_name, "boost": 3}}},
+                        {"match": {"Description": {"query": exercise_name, "boost": 1}}}
+                    ],
+                    "minimum_should_match": 1
+                }
+            }
+        }))
+
+    return queries
+
+def _query_key(body):
+    return json.dumps(body, sort_keys=True)
+
+class FallbackPools:
+    """
+    Fallback query results evaluated once against a catalog snapshot and
+    stamped with its generation. The name searches and the bodyweight search
+    for every single body part (with and without the bodyweight tier) are
+    precomputed; other body-part combinations are computed in memory on first
+    use. Serving a fallback never touches Elasticsearch.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.generation = catalog.generation
+        self._precomputed = {}
+        self._extra = LRUCache(max_entries=FALLBACK_POOL_MAX_EXTRA)
+
+        body_part_options = [[]] + [[part] for part in catalog.values('BodyPart') if part]
+        for equipment_class in (['Body Only'], []):
+            for body_parts in body_part_options:
+                params = {'preferred_body_parts': body_parts, 'preferred_equipment': equipment_class,
+                          'no_equipment_only': False}
+                for _, _, body in plan_fallback_queries(params):
+                    key = _query_key(body)
+                    if key not in self._precomputed:
+                        self._precomputed[key] = self._evaluate(body)
+
+    def __len__(self):
+        return len(self._precomputed) + len(self._extra)
+
+    def _evaluate(self, body):
+        hits = self.catalog.search(body)['hits']['hits']
+        return tuple((hit['_id'], hit['_score'], hit['_source']) for hit in hits)
+
+    def search(self, body):
+        """ES-shaped result for a fallback query. Each hit's _source is a fresh copy."""
+        key = _query_key(body)
+        hits = self._precomputed.get(key)
+        if hits is None:
+            hits = self._extra.get(key)
+            if hits is None:
+                hits = self._evaluate(body)
+                self._extra.set(key, hits)
+        return {'hits': {'hits': [{'_id': doc_id, '_score': score, '_source': dict(source)}
+                                  for doc_id, score, source in hits]}}
+
+    def search_all(self, bodies):
+        return [self.search(body) for body in bodies]
+
+_pools = None
+_pools_lock = threading.Lock()
+
+def rebuild_fallback_pools(catalog):
+    """Precompute the fallback pools for a catalog snapshot and swap them in"""
+    global _pools
+    pools = FallbackPools(catalog)
+    with _pools_lock:
+        _pools = pools
+    print(f"Built fallback exercise pools: {len(pools)} queries (generation {pools.generation})")
+    return pools
+
+def get_fallback_pools(catalog=None):
+    """Fallback pools matching the given (or current) catalog snapshot, building them if needed"""
+    if catalog is None:
+        catalog = get_catalog()
+    pools = _pools
+    if pools is None or pools.catalog is not catalog:
+        pools = rebuild_fallback_pools(catalog)
+    return pools
+
+# Rebuild whenever the catalog is reloaded (startup, reindex)
+add_reload_listener(rebuild_fallback_pools)
@@ -0,0 +1,68 @@
+import os
+import re
+import hashlib
+from src.cache import TieredCache
+
+INTENT_CACHE_VERSION = "2"  # Bump whenever the intent or customization prompts change
+
+NUMBER_WORDS = {
+    'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5',
+    'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10',
+    'eleven': '11', 'twelve': '12', 'fifteen': '15', 'twenty': '20', 'thirty': '30',
+    'forty': '40', 'forty five': '45', 'fifty': '50', 'sixty': '60', 'ninety': '90'
+}
+_NUMBER_WORDS_PATTERN = re.compile(
+    r'\b(' + '|'.join(sorted((re.escape(word) for word in NUMBER_WORDS), key=len, reverse=True)) + r')\b'
+)
+
+def canonicalize_query(text):
+    """
+    Fold case, punctuation and whitespace, so "3 Days per week, dumbbells ONLY!"
+    and "3 days per week dumbbells only" share a cache or single-flight key.
+    """
+    text = str(text or '').lower()
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return re.sub(r'[\s_]+', ' ', text).strip()
+
+def normalize_numbers(text):
+    """
+    Spell numbers as digits in a canonical query ("three days" and "03 days" -> "3 days").
+    Only used for the intent cache key, where the parsed intent is the same either way.
+    """
+    text = _NUMBER_WORDS_PATTERN.sub(lambda match: NUMBER_WORDS[match.group(1)], text)
+    # Strip leading zeros ("03 days" -> "3 days")
+    return re.sub(r'\b0+(\d)', r'\1', text)
+
+class IntentCache:
+    """
+    Cache for the LLM-parsed parts of a query (the structured AI intent and the
+    customization text), keyed by the canonical query, the kind of result and the
+    model. None is a valid cached value (e.g. "no customization requested").
+    """
+
+    def __init__(self, max_entries=10000, ttl=7 * 24 * 3600, persist=True):
+        self.cache = TieredCache('query_intent', max_entries=max_entries, ttl=ttl, persist=persist,
+                                 disk_max_entries=max_entries * 10)
+
+    def _key(self, kind, query_text, model):
+        payload = f"{INTENT_CACHE_VERSION}|{kind}|{model}|{normalize_numbers(canonicalize_query(query_text))}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, kind, query_text, model=''):
+        """Return (hit, value)"""
+        entry = self.cache.get(self._key(kind, query_text, model))
+        if entry is None:
+            return False, None
+        return True, entry['value']
+
+    def set(self, kind, query_text, value, model=''):
+        self.cache.set(self._key(kind, query_text, model), {'value': value})
+
+    def stats(self):
+        return self.cache.stats()
+
+intent_cache = IntentCache(
+    max_entries=int(os.getenv("INTENT_CACHE_MAX_ENTRIES", "10000")),
+    ttl=float(os.getenv("INTENT_CACHE_TTL", str(7 * 24 * 3600))),
+    persist=os.getenv("INTENT_CACHE_PERSIST", "true").lower() == "true"
+)
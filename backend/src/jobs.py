@@ -0,0 +1,196 @@
+import os
+import time
+import uuid
+import queue
+import threading
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))  # Background workers running jobs
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))  # Jobs waiting beyond this are rejected
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "60"))  # Seconds a job may run before it is marked timed out
+JOB_DEADLINE_MARGIN = float(os.getenv("JOB_DEADLINE_MARGIN", "10"))  # Part of the timeout kept free beyond a job's own deadline
+JOB_MAX_ABANDONED = int(os.getenv("JOB_MAX_ABANDONED", "8"))  # Timed-out jobs still running before workers stop taking new ones
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "600"))  # How long finished jobs are kept
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))  # Longest long-poll a client may ask for
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+class Job:
+    """A unit of background work and its outcome"""
+
+    def __init__(self, func, owner=None, persist=None):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.owner = owner
+        self.persist = persist
+        self.status = 'queued'  # queued -> running -> succeeded | failed | timed_out
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def finish(self, status, result=None, error=None):
+        """Record the outcome. Only the first call counts (a late result after a timeout is dropped)."""
+        with self._lock:
+            if self.done:
+                return
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        job = {
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+        if self.status == 'succeeded':
+            job['result'] = self.result
+        elif self.error:
+            job['error'] = self.error
+        return job
+
+class JobQueue:
+    """
+    In-process job queue with a fixed pool of worker threads. The queue depth
+    is bounded, each job gets a timeout, and finished jobs are kept for
+    `retention` seconds so clients can collect the result.
+
+    A job that times out is abandoned but its thread can't be killed, so at most
+    `max_abandoned` of them may still be running; past that, workers wait for
+    one to end before starting the next job.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE, timeout=JOB_TIMEOUT,
+                 retention=JOB_RETENTION_SECONDS, max_abandoned=JOB_MAX_ABANDONED):
+        self.workers = workers
+        self.timeout = timeout
+        self.retention = retention
+        self.abandoned = 0
+        self._helpers = threading.BoundedSemaphore(workers + max_abandoned)
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _start_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, daemon=True, name=f"job-worker-{i}")
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        self._helpers.acquire()
+        job.status = 'running'
+        job.started_at = time.time()
+        outcome = {}
+        finished = threading.Event()
+
+        def target():
+            try:
+                outcome['result'] = job.func()
+            except Exception as e:
+                outcome['error'] = e
+            finally:
+                finished.set()
+                self._helpers.release()
+
+        # Run in a helper thread so a hung job only costs its timeout, not the worker
+        threading.Thread(target=target, daemon=True, name=f"job-{job.id[:8]}").start()
+        if not finished.wait(self.timeout):
+            print(f"Job {job.id} timed out after {self.timeout}s")
+            self.abandoned += 1
+            job.finish('timed_out', error=f"Job did not finish within {self.timeout:g} seconds")
+            return
+
+        try:
+            if 'error' in outcome:
+                raise outcome['error']
+            # Side effects run here, only for results that arrived in time
+            result = job.persist(outcome['result']) if job.persist else outcome['result']
+            job.finish('succeeded', result=result)
+        except Exception as e:
+            print(f"Job {job.id} failed: {str(e)}")
+            job.finish('failed', error=str(e))
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.done and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def submit(self, func, owner=None, persist=None):
+        """
+        Queue func() to run in the background. Returns the Job, or raises QueueFull.
+        If given, persist(result) runs once func() returns in time and its return
+        value becomes the job's result; a timed-out job's result is dropped unpersisted.
+        """
+        self._start_workers()
+        self._prune()
+        job = Job(func, owner, persist)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFull(f"Job queue is full ({self._queue.maxsize} jobs waiting)") from None
+        return job
+
+    def get(self, job_id, owner=None):
+        """The job with this id (None if unknown, expired or owned by someone else)"""
+        self._prune()
+        job = self._jobs.get(job_id)
+        if job is None or (owner is not None and job.owner != owner):
+            return None
+        return job
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            'queued': self._queue.qsize(),
+            'workers': self.workers,
+            'abandoned': self.abandoned,
+            'jobs': {status: statuses.count(status) for status in set(statuses)}
+        }
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """Return the process-wide job queue"""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue()
+    return _job_queue
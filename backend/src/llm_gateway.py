@@ -0,0 +1,261 @@
+import os
+import time
+import asyncio
+import threading
+import weakref
+from mistralai.client import MistralClient
+from mistralai.async_client import MistralAsyncClient
+from mistralai.exceptions import MistralAPIStatusException
+from mistralai.models.chat_completion import ChatMessage
+from src.rate_limiter import LLM_RATE_LIMIT_MAX_WAIT, RateLimited, RateLimiter, estimate_tokens, llm_priority, retry_delay
+from src.llm_metrics import llm_metrics
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))  # Default seconds per request
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))  # Retries after a 429 or 5xx response
+# The Mistral client takes its timeout at construction, so pooled clients are kept per model and
+# timeout tier; a call's timeout is rounded up to the next tier to keep the pool small.
+CLIENT_TIMEOUT_TIERS = (2, 5, 10, 20, 30, 60, 120)
+
+# Which model serves each kind of call. Override with LLM_MODEL_<PURPOSE>, e.g. LLM_MODEL_TIPS.
+DEFAULT_MODEL_ROUTES = {
+    'tips': 'mistral-tiny',
+    'intent': 'mistral-tiny',
+    'customization_intent': 'mistral-tiny',
+    'customization': 'mistral-small-latest',
+    'enhancement': 'mistral-small-latest',
+    'advice': 'mistral-tiny',
+    'chat': 'mistral-small-latest'
+}
+DEFAULT_MODEL = os.getenv("LLM_DEFAULT_MODEL", "mistral-tiny")
+
+def client_timeout(timeout):
+    """The timeout tier a call's client uses: the smallest tier that is at least `timeout`"""
+    for tier in CLIENT_TIMEOUT_TIERS:
+        if timeout <= tier:
+            return tier
+    return CLIENT_TIMEOUT_TIERS[-1]
+
+async def _next_chunk(chunks):
+    # anext() is only a builtin from Python 3.10
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+def _to_message(message):
+    if isinstance(message, ChatMessage):
+        return message
+    return ChatMessage(role=message['role'], content=message['content'])
+
+class LLMGateway:
+    """
+    Single entry point for LLM calls. Keeps one long-lived (keep-alive) Mistral
+    client per model and timeout tier, and routes each call to a model by purpose.
+    Calls wait for rate limit budget first, and 429/5xx responses are retried
+    with backoff (honoring Retry-After) while the call's timeout allows.
+    """
+
+    def __init__(self, routes=None, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES, limiter=None):
+        self.routes = dict(DEFAULT_MODEL_ROUTES)
+        for purpose in self.routes:
+            override = os.getenv(f"LLM_MODEL_{purpose.upper()}")
+            if override:
+                self.routes[purpose] = override
+        self.routes.update(routes or {})
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.limiter = limiter or RateLimiter()
+        self._clients = {}
+        self._async_clients = weakref.WeakKeyDictionary()  # event loop -> {(model, timeout): client}
+        self._lock = threading.Lock()
+
+    @property
+    def api_key(self):
+        # Read lazily so a .env loaded after import is still picked up
+        return os.environ.get("MISTRAL_API_KEY")
+
+    def is_available(self):
+        return bool(self.api_key)
+
+    def model_for(self, purpose):
+        return self.routes.get(purpose, DEFAULT_MODEL)
+
+    def _client(self, model, timeout):
+        timeout = client_timeout(timeout)
+        key = (model, timeout)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    # Retries are handled here, so the client only retries failed connections
+                    client = MistralClient(api_key=self.api_key, timeout=timeout, max_retries=1)
+                    self._clients[key] = client
+        return client
+
+    def _async_client(self, model, timeout):
+        # httpx async clients are bound to the event loop they were first used on
+        loop = asyncio.get_running_loop()
+        timeout = client_timeout(timeout)
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get((model, timeout))
+            if client is None:
+                client = MistralAsyncClient(api_key=self.api_key, timeout=timeout, max_retries=1)
+                clients[(model, timeout)] = client
+        return client
+
+    def _request(self, purpose, messages, model, timeout):
+        if not self.is_available():
+            raise RuntimeError("MISTRAL_API_KEY is not set")
+        model = model or self.model_for(purpose)
+        timeout = timeout or self.timeout
+        return model, timeout, [_to_message(message) for message in messages]
+
+    def _max_wait(self, started, timeout):
+        # Background calls wait as long as it takes; interactive calls only within their timeout
+        if llm_priority.get() == 'background':
+            return None
+        return max(0.0, min(LLM_RATE_LIMIT_MAX_WAIT, timeout) - (time.monotonic() - started))
+
+    def _retry_delay(self, error, attempt, started, timeout):
+        """Seconds to wait before retrying a call that got a 429 or 5xx, or re-raise the error"""
+        delay = retry_delay(error, attempt)
+        if error.http_status == 429:
+            self.limiter.cooldown(delay)
+        out_of_time = llm_priority.get() != 'background' and time.monotonic() - started + delay > timeout
+        if attempt > self.max_retries or out_of_time:
+            raise error
+        print(f"Mistral returned {error.http_status}, retry {attempt} in {delay:.1f}s")
+        return delay
+
+    def _record(self, purpose, model, started, estimated, usage=None, error=None):
+        """Record a finished call in the metrics and correct the rate limiter's token estimate"""
+        if error is None:
+            status = 'ok'
+            self.limiter.record_usage(estimated, usage.total_tokens if usage else None)
+        elif isinstance(error, RateLimited):
+            status = 'rate_limited'
+        elif isinstance(error, GeneratorExit):
+            status = 'cancelled'
+        else:
+            status = 'error'
+        llm_metrics.record_call(purpose, model, time.monotonic() - started, usage, status)
+
+    def complete(self, purpose, messages, model=None, timeout=None, **kwargs):
+        """Run a chat completion and return the response text"""
+        model, timeout, messages = self._request(purpose, messages, model, timeout)
+        estimated = estimate_tokens(messages, kwargs.get('max_tokens'))
+        started = time.monotonic()
+        attempt = 0
+        try:
+            while True:
+                self.limiter.acquire(estimated, max_wait=self._max_wait(started, timeout))
+                try:
+                    response = self._client(model, timeout).chat(model=model, messages=messages, **kwargs)
+                    break
+                except MistralAPIStatusException as e:
+                    attempt += 1
+                    time.sleep(self._retry_delay(e, attempt, started, timeout))
+        except Exception as e:
+            self._record(purpose, model, started, estimated, error=e)
+            raise
+        self._record(purpose, model, started, estimated, response.usage)
+        return response.choices[0].message.content
+
+    def stream(self, purpose, messages, model=None, timeout=None, **kwargs):
+        """Yield the response text in chunks as they arrive"""
+        model, timeout, messages = self._request(purpose, messages, model, timeout)
+        estimated = estimate_tokens(messages, kwargs.get('max_tokens'))
+        started = time.monotonic()
+        attempt = 0
+        usage = None
+        chunks = None
+        try:
+            while True:
+                self.limiter.acquire(estimated, max_wait=self._max_wait(started, timeout))
+                chunks = self._client(model, timeout).chat_stream(model=model, messages=messages, **kwargs)
+                try:
+                    # Error responses surface on the first read, before anything has been yielded
+                    chunk = next(chunks, None)
+                    break
+                except MistralAPIStatusException as e:
+                    attempt += 1
+                    time.sleep(self._retry_delay(e, attempt, started, timeout))
+
+            while chunk is not None:
+                usage = chunk.usage or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                chunk = next(chunks, None)
+        except (Exception, GeneratorExit) as e:
+            # Closing the client's stream closes the HTTP response, which stops the generation upstream
+            if chunks is not None:
+                chunks.close()
+            self._record(purpose, model, started, estimated, usage, error=e)
+            raise
+        self._record(purpose, model, started, estimated, usage)
+
+    async def acomplete(self, purpose, messages, model=None, timeout=None, **kwargs):
+        """Async version of complete()"""
+        model, timeout, messages = self._request(purpose, messages, model, timeout)
+        estimated = estimate_tokens(messages, kwargs.get('max_tokens'))
+        started = time.monotonic()
+        attempt = 0
+        try:
+            while True:
+                await self.limiter.aacquire(estimated, max_wait=self._max_wait(started, timeout))
+                try:
+                    response = await self._async_client(model, timeout).chat(model=model, messages=messages, **kwargs)
+                    break
+                except MistralAPIStatusException as e:
+                    attempt += 1
+                    await asyncio.sleep(self._retry_delay(e, attempt, started, timeout))
+        except Exception as e:
+            self._record(purpose, model, started, estimated, error=e)
+            raise
+        self._record(purpose, model, started, estimated, response.usage)
+        return response.choices[0].message.content
+
+    async def astream(self, purpose, messages, model=None, timeout=None, **kwargs):
+        """Async version of stream()"""
+        model, timeout, messages = self._request(purpose, messages, model, timeout)
+        estimated = estimate_tokens(messages, kwargs.get('max_tokens'))
+        started = time.monotonic()
+        attempt = 0
+        usage = None
+        chunks = None
+        try:
+            while True:
+                await self.limiter.aacquire(estimated, max_wait=self._max_wait(started, timeout))
+                chunks = self._async_client(model, timeout).chat_stream(model=model, messages=messages, **kwargs)
+                try:
+                    chunk = await _next_chunk(chunks)
+                    break
+                except MistralAPIStatusException as e:
+                    attempt += 1
+                    await asyncio.sleep(self._retry_delay(e, attempt, started, timeout))
+
+            while chunk is not None:
+                usage = chunk.usage or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                chunk = await _next_chunk(chunks)
+        except (Exception, GeneratorExit) as e:
+            if chunks is not None:
+                await chunks.aclose()
+            self._record(purpose, model, started, estimated, usage, error=e)
+            raise
+        self._record(purpose, model, started, estimated, usage)
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+def get_gateway():
+    """Return the process-wide LLM gateway"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway()
+    return _gateway
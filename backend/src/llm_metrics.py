@@ -0,0 +1,176 @@
+import os
+import time
+import bisect
+import threading
+import contextvars
+from collections import Counter, deque
+from contextlib import contextmanager
+
+LLM_METRICS_WINDOW_SECONDS = float(os.getenv("LLM_METRICS_WINDOW_SECONDS", "900"))  # How far back snapshots look
+LLM_METRICS_SLOT_SECONDS = 60  # Granularity of the rolling window
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Stage tag for LLM calls made in this context; calls are tagged with their purpose otherwise
+llm_stage = contextvars.ContextVar('llm_stage', default=None)
+
+@contextmanager
+def stage(name):
+    """Tag the LLM calls made in this block with a pipeline stage"""
+    token = llm_stage.set(name)
+    try:
+        yield
+    finally:
+        llm_stage.reset(token)
+
+class RollingWindow:
+    """Per-slot aggregates covering the last `window` seconds"""
+
+    def __init__(self, new_slot, window=LLM_METRICS_WINDOW_SECONDS, slot=LLM_METRICS_SLOT_SECONDS):
+        self.new_slot = new_slot
+        self.window = window
+        self.slot = slot
+        self._slots = deque()  # (slot start, aggregate)
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._slots and self._slots[0][0] <= now - self.window:
+            self._slots.popleft()
+
+    def update(self, func):
+        now = time.time()
+        start = now - now % self.slot
+        with self._lock:
+            self._expire(now)
+            if not self._slots or self._slots[-1][0] != start:
+                self._slots.append((start, self.new_slot()))
+            func(self._slots[-1][1])
+
+    def slots(self):
+        with self._lock:
+            self._expire(time.time())
+            return [aggregate for _, aggregate in self._slots]
+
+class RollingHistogram:
+    """Bucketed distribution of recent values, with percentiles estimated from the buckets"""
+
+    def __init__(self, bounds, window=LLM_METRICS_WINDOW_SECONDS):
+        self.bounds = bounds
+        self.window = RollingWindow(lambda: {'buckets': [0] * (len(bounds) + 1), 'sum': 0.0, 'count': 0}, window)
+
+    def observe(self, value):
+        def add(slot):
+            slot['buckets'][bisect.bisect_left(self.bounds, value)] += 1
+            slot['sum'] += value
+            slot['count'] += 1
+        self.window.update(add)
+
+    def snapshot(self):
+        buckets = [0] * (len(self.bounds) + 1)
+        total, count = 0.0, 0
+        for slot in self.window.slots():
+            buckets = [a + b for a, b in zip(buckets, slot['buckets'])]
+            total += slot['sum']
+            count += slot['count']
+        snapshot = {
+            'count': count,
+            'sum': round(total, 2),
+            'mean': round(total / count, 2) if count else None,
+            'buckets': {str(bound): n for bound, n in zip(list(self.bounds) + ['+Inf'], buckets)}
+        }
+        for name, quantile in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            snapshot[name] = self._percentile(buckets, count, quantile)
+        return snapshot
+
+    def _percentile(self, buckets, count, quantile):
+        # Upper bound of the bucket holding the quantile (None when it falls in the overflow bucket)
+        if not count:
+            return None
+        rank = quantile * count
+        seen = 0
+        for bound, n in zip(self.bounds, buckets):
+            seen += n
+            if seen >= rank:
+                return bound
+        return None
+
+class RollingCounter:
+    """Counts of labels seen recently"""
+
+    def __init__(self, window=LLM_METRICS_WINDOW_SECONDS):
+        self.window = RollingWindow(Counter, window)
+
+    def add(self, label, count=1):
+        def add(slot):
+            slot[label] += count
+        self.window.update(add)
+
+    def snapshot(self):
+        total = Counter()
+        for slot in self.window.slots():
+            total.update(slot)
+        return dict(total)
+
+class StageMetrics:
+    def __init__(self):
+        self.latency_ms = RollingHistogram(LATENCY_BUCKETS_MS)
+        self.prompt_tokens = RollingHistogram(TOKEN_BUCKETS)
+        self.completion_tokens = RollingHistogram(TOKEN_BUCKETS)
+        self.calls = RollingCounter()  # Gateway status: ok, error, rate_limited
+        self.models = RollingCounter()
+        self.outcomes = RollingCounter()  # Caller's view: success, fallback, parse_failure, error
+        self.cache = RollingCounter()  # hit, miss, precomputed
+
+    def snapshot(self):
+        return {
+            'latency_ms': self.latency_ms.snapshot(),
+            'prompt_tokens': self.prompt_tokens.snapshot(),
+            'completion_tokens': self.completion_tokens.snapshot(),
+            'calls': self.calls.snapshot(),
+            'models': self.models.snapshot(),
+            'outcomes': self.outcomes.snapshot(),
+            'cache': self.cache.snapshot()
+        }
+
+class LLMMetrics:
+    """
+    Rolling per-stage statistics for LLM calls. The gateway records wall time,
+    token usage, model and status of every call; the functions that make the
+    calls record the outcome (used, fell back, unparseable) and cache status.
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def _stage(self, name):
+        metrics = self._stages.get(name)
+        if metrics is None:
+            with self._lock:
+                metrics = self._stages.setdefault(name, StageMetrics())
+        return metrics
+
+    def record_call(self, purpose, model, seconds, usage=None, status='ok'):
+        metrics = self._stage(llm_stage.get() or purpose)
+        metrics.latency_ms.observe(seconds * 1000)
+        metrics.calls.add(status)
+        metrics.models.add(model)
+        if usage is not None:
+            metrics.prompt_tokens.observe(usage.prompt_tokens)
+            metrics.completion_tokens.observe(usage.completion_tokens)
+
+    def record_outcome(self, stage_name, outcome, cache=None, count=1):
+        metrics = self._stage(stage_name)
+        metrics.outcomes.add(outcome, count)
+        if cache:
+            metrics.cache.add(cache, count)
+
+    def snapshot(self):
+        with self._lock:
+            stages = dict(self._stages)
+        return {
+            'window_seconds': LLM_METRICS_WINDOW_SECONDS,
+            'stages': {name: metrics.snapshot() for name, metrics in sorted(stages.items())}
+        }
+
+llm_metrics = LLMMetrics()
@@ -0,0 +1,194 @@
+import re
+from functools import lru_cache
+from collections import defaultdict
+from fuzzywuzzy import fuzz
+
+def preprocess_text(text):
+    """Preprocess text for better matching"""
+    # Convert to lowercase
+    text = text.lower()
+
+    # Replace multiple spaces with single space
+    text = re.sub(r'\s+', ' ', text)
+
+    # Remove punctuation
+    text = re.sub(r'[^\w\s]', ' ', text)
+
+    return text.strip()
+
+@lru_cache(maxsize=4096)
+def normalize_token(token):
+    """Fold simple plurals so 'dumbbells' matches 'dumbbell' and 'quads' matches 'quad'"""
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+def tokenize(text):
+    return [normalize_token(token) for token in preprocess_text(text).split()]
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class IntentMatch:
+    """Result of matching a query: equipment, exclusivity and body parts"""
+
+    def __init__(self, equipment, is_exclusive, no_equipment_only, body_parts):
+        self.equipment = equipment
+        self.is_exclusive = is_exclusive
+        self.no_equipment_only = no_equipment_only
+        self.body_parts = body_parts
+
+    def __repr__(self):
+        return (f"IntentMatch(equipment={self.equipment}, is_exclusive={self.is_exclusive}, "
+                f"no_equipment_only={self.no_equipment_only}, body_parts={self.body_parts})")
+
+class IntentMatcher:
+    """
+    Equipment and body-part matcher compiled once from the keyword tables.
+
+    Exact phrases (equipment names and synonyms, "no equipment" phrases, body-part
+    keywords and the "only"/"just" markers) go into a token-level trie, so a single
+    pass over the query finds every match on word boundaries, overlapping ones
+    included. Fuzzy matching only scores the terms that share a character trigram
+    with a phrase, instead of every term for every phrase.
+    """
+
+    EXCLUSIVE_MARKERS = ('only', 'just')
+
+    def __init__(self, equipment_mapping, body_part_keywords, no_equipment_phrases, fuzzy_threshold=80):
+        self.fuzzy_threshold = fuzzy_threshold
+        self._trie = {}
+
+        # Equipment terms, for both exact and fuzzy matching
+        self.term_to_equipment = {}
+        for equip_key, equip_data in equipment_mapping.items():
+            for term in [equip_key] + equip_data['synonyms']:
+                self.term_to_equipment[term] = equip_data['name']
+                self._add_phrase(term, ('equipment', equip_data['name']))
+
+        for keyword, part in body_part_keywords.items():
+            self._add_phrase(keyword, ('body_part', part))
+        for phrase in no_equipment_phrases:
+            self._add_phrase(phrase, ('no_equipment', 'Body Only'))
+        for marker in self.EXCLUSIVE_MARKERS:
+            self._add_phrase(marker, ('marker', marker))
+
+        # Character trigram index over the equipment terms for fuzzy candidates
+        self._terms = list(self.term_to_equipment.keys())
+        self._trigram_index = defaultdict(set)
+        for term_id, term in enumerate(self._terms):
+            for gram in trigrams(' '.join(sorted(preprocess_text(term).split()))):
+                self._trigram_index[gram].add(term_id)
+
+    def _add_phrase(self, phrase, payload):
+        tokens = tokenize(phrase)
+        node = self._trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node.setdefault(None, []).append(payload)
+
+    def _scan(self, tokens):
+        """All exact phrase matches as (start, end, kind, value), including overlapping ones"""
+        matches = []
+        root = self._trie
+        count = len(tokens)
+        for start, token in enumerate(tokens):
+            node = root.get(token)
+            end = start + 1
+            while node is not None:
+                for kind, value in node.get(None, ()):
+                    matches.append((start, end, kind, value))
+                if end >= count:
+                    break
+                node = node.get(tokens[end])
+                end += 1
+        return matches
+
+    def _fuzzy_phrase(self, phrase):
+        """Equipment names whose terms fuzzily match a phrase (top 3 above the threshold)"""
+        candidates = set()
+        for gram in trigrams(' '.join(sorted(phrase.split()))):
+            candidates |= self._trigram_index.get(gram, set())
+        scored = []
+        for term_id in candidates:
+            score = fuzz.token_sort_ratio(phrase, self._terms[term_id])
+            if score >= self.fuzzy_threshold:
+                scored.append((score, self._terms[term_id]))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [self.term_to_equipment[term] for _, term in scored[:3]]
+
+    def _fuzzy_matches(self, words):
+        """Fuzzy equipment matches for every 1-3 word phrase as (start, end, equipment)"""
+        matches = []
+        for n in range(1, 4):
+            for i in range(len(words) - n + 1):
+                for equipment in self._fuzzy_phrase(' '.join(words[i:i + n])):
+                    matches.append((i, i + n, equipment))
+        return matches
+
+    def match(self, text):
+        """Extract equipment, exclusivity, "no equipment" and body parts from text in one pass"""
+        words = preprocess_text(text).split()
+        tokens = [normalize_token(word) for word in words]
+        matches = self._scan(tokens)
+
+        body_parts = []
+        equipment_matches = []
+        markers = defaultdict(list)
+        no_equipment = False
+        for start, end, kind, value in matches:
+            if kind == 'body_part' and value not in body_parts:
+                body_parts.append(value)
+            elif kind == 'equipment':
+                equipment_matches.append((start, end, value))
+            elif kind == 'marker':
+                markers[value].append(start)
+            elif kind == 'no_equipment':
+                no_equipment = True
+
+        if no_equipment:
+            return IntentMatch(['Body Only'], True, True, body_parts)
+
+        # Drop equipment terms nested in a longer one ('bar' inside 'ez curl bar')
+        equipment_matches = [
+            (start, end, value) for start, end, value in equipment_matches
+            if not any(s <= start and end <= e and (e - s) > (end - start) for s, e, _ in equipment_matches)
+        ]
+
+        fuzzy_cache = []
+        def in_region(region_start, region_end):
+            # Exact matches inside the region, else fuzzy ones
+            found = [value for start, end, value in equipment_matches if start >= region_start and end <= region_end]
+            if not found:
+                if not fuzzy_cache:
+                    fuzzy_cache.append(self._fuzzy_matches(words))
+                found = [value for start, end, value in fuzzy_cache[0] if start >= region_start and end <= region_end]
+            return list(dict.fromkeys(found))
+
+        # "dumbbells only", "only dumbbells", "just dumbbells" mean exclusive equipment
+        regions = []
+        if markers['only'] and markers['only'][-1] > 0:
+            regions.append((0, markers['only'][-1]))
+        if markers['only']:
+            regions.append((markers['only'][0] + 1, len(tokens)))
+        if markers['just']:
+            regions.append((markers['just'][0] + 1, len(tokens)))
+        for region_start, region_end in regions:
+            if region_end > region_start:
+                equipment = in_region(region_start, region_end)
+                if equipment:
+                    return IntentMatch(equipment, True, False, body_parts)
+
+        # Any equipment mentioned at all
+        equipment = in_region(0, len(tokens))
+        return IntentMatch(equipment, len(equipment) > 0, False, body_parts)
+
+    def match_equipment(self, text):
+        """Equipment mentioned anywhere in text - exact matches first, fuzzy if there are none"""
+        words = preprocess_text(text).split()
+        tokens = [normalize_token(word) for word in words]
+        found = [value for _, _, kind, value in self._scan(tokens) if kind == 'equipment']
+        if not found:
+            found = [equipment for _, _, equipment in self._fuzzy_matches(words)]
+        return list(dict.fromkeys(found))
@@ -0,0 +1,96 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+PIPELINE_MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "4"))
+
+class Stage:
+    """
+    A named step of a pipeline. `func` is called with the results of `deps`
+    as positional arguments, in the order the dependencies are listed.
+    """
+
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, deps={list(self.deps)})"
+
+def validate_stages(stages, available=()):
+    """Check that stage names are unique, dependencies exist and there are no cycles"""
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name or stage.name in available:
+            raise ValueError(f"Duplicate stage name: {stage.name}")
+        by_name[stage.name] = stage
+
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name and dep not in available:
+                raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+
+    # Kahn's algorithm - anything left over is part of a cycle
+    resolved = set(available)
+    remaining = list(stages)
+    while remaining:
+        ready = [stage for stage in remaining if all(dep in resolved for dep in stage.deps)]
+        if not ready:
+            raise ValueError(f"Stage dependency cycle between: {[stage.name for stage in remaining]}")
+        for stage in ready:
+            resolved.add(stage.name)
+            remaining.remove(stage)
+
+def run_stages(stages, max_workers=PIPELINE_MAX_WORKERS, results=None):
+    """
+    Run a dependency graph of stages, starting each one as soon as all of its
+    dependencies have finished. `results` may pre-seed values for stages that
+    were computed elsewhere.
+
+    Returns (results, timings): stage name -> return value, and stage name ->
+    wall time in seconds (plus 'total'). The first stage exception is re-raised
+    and no further stages are started.
+    """
+    results = dict(results or {})
+    validate_stages(stages, available=results.keys())
+    timings = {}
+    pending = list(stages)
+    running = {}
+    started = time.perf_counter()
+
+    def timed(stage, args):
+        stage_start = time.perf_counter()
+        try:
+            return stage.func(*args)
+        finally:
+            timings[stage.name] = time.perf_counter() - stage_start
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline")
+    try:
+        while pending or running:
+            # Launch everything whose dependencies are satisfied
+            for stage in [s for s in pending if all(dep in results for dep in s.deps)]:
+                pending.remove(stage)
+                args = [results[dep] for dep in stage.deps]
+                running[executor.submit(timed, stage, args)] = stage
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                results[stage.name] = future.result()
+    finally:
+        # On failure, don't wait for stages that are still in flight
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    timings['total'] = time.perf_counter() - started
+    return results, timings
+
+def format_timings(timings):
+    """Render stage timings as a compact log line, slowest first"""
+    ordered = sorted(((name, seconds) for name, seconds in timings.items() if name != 'total'),
+                     key=lambda item: item[1], reverse=True)
+    parts = [f"{name}={seconds * 1000:.0f}ms" for name, seconds in ordered]
+    if 'total' in timings:
+        parts.append(f"total={timings['total'] * 1000:.0f}ms")
+    return ", ".join(parts)
@@ -0,0 +1,60 @@
+import os
+import copy
+import json
+import hashlib
+from src.cache import TieredCache
+from src.intent_cache import canonicalize_query
+
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "true").lower() == "true"
+PLAN_CACHE_VERSION = "1"  # Bump whenever plan generation changes in a way that should invalidate cached plans
+
+def plan_cache_key(params, customization_text, generation, llm_available=True):
+    """
+    Key for a finished plan: the canonical structured intent, the customization
+    text, the catalog generation (bumped by every reindex) and whether an LLM
+    was configured, so rule-based plans are never served once it is.
+    """
+    payload = json.dumps({
+        'version': PLAN_CACHE_VERSION,
+        'generation': generation,
+        'llm': llm_available,
+        'fitness_level': params['fitness_level'],
+        'days_per_week': params['days_per_week'],
+        'time_available': params['time_available'],
+        'equipment': sorted(params['preferred_equipment']),
+        'is_exclusive': params['is_exclusive'],
+        'no_equipment_only': params['no_equipment_only'],
+        'body_parts': sorted(params['preferred_body_parts']),
+        'customization': canonicalize_query(customization_text) if customization_text else None
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class PlanCache:
+    """
+    Cache of complete workout plans. Plans are stored and returned as deep
+    copies, so each caller (and each history write) gets its own document.
+    """
+
+    def __init__(self, max_entries=500, ttl=3600, persist=True, enabled=PLAN_CACHE_ENABLED):
+        self.enabled = enabled
+        self.cache = TieredCache('workout_plans', max_entries=max_entries, ttl=ttl, persist=persist,
+                                 disk_max_entries=max_entries * 10)
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        plan = self.cache.get(key)
+        return copy.deepcopy(plan) if plan is not None else None
+
+    def set(self, key, plan):
+        if self.enabled:
+            self.cache.set(key, copy.deepcopy(plan))
+
+    def stats(self):
+        return self.cache.stats()
+
+plan_cache = PlanCache(
+    max_entries=int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "500")),
+    ttl=float(os.getenv("PLAN_CACHE_TTL", "3600")),
+    persist=os.getenv("PLAN_CACHE_PERSIST", "true").lower() == "true"
+)
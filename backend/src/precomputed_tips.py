@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+PRECOMPUTED_TIPS_FILE = os.getenv("PRECOMPUTED_TIPS_FILE", "data/precomputed_tips.json")
+PRECOMPUTED_TIPS_CHECK_INTERVAL = float(os.getenv("PRECOMPUTED_TIPS_CHECK_INTERVAL", "60"))  # Seconds between file change checks
+PRECOMPUTE_TIPS_RATE = float(os.getenv("PRECOMPUTE_TIPS_RATE", "1"))  # LLM calls per second while precomputing
+PRECOMPUTE_TIPS_CHECKPOINT_EVERY = 100  # Exercises between checkpoint writes
+
+def exercise_content_key(exercise):
+    """Hash of the exercise fields a tip depends on, so tips survive reindexing unchanged exercises"""
+    fields = [exercise.get(field, '') for field in ('Title', 'Description', 'Type', 'Equipment', 'BodyPart', 'Level')]
+    return hashlib.sha256(json.dumps(fields, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def read_tips_file(path=PRECOMPUTED_TIPS_FILE):
+    """Entries of a precomputed tips file as {content_key: entry}, empty if it doesn't exist"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rt', encoding='utf-8') as file:
+        return json.load(file).get('tips', {})
+
+def write_tips_file(tips, path=PRECOMPUTED_TIPS_FILE):
+    """Write the tips file atomically, so readers and a resumed run never see a partial file"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wt', encoding='utf-8') as file:
+        json.dump({'version': 1, 'updated_at': time.time(), 'tips': tips}, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+class PrecomputedTips:
+    """
+    Read side of the precomputed tips sidecar file. Each entry holds the
+    rule-based tip and optionally an LLM tip with the model and prompt version
+    it was generated with. The file is loaded at startup (load()) and reloaded
+    when it changes.
+    """
+
+    def __init__(self, path=PRECOMPUTED_TIPS_FILE):
+        self.path = path
+        self.tips = {}
+        self._mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if time.monotonic() - self._last_check < PRECOMPUTED_TIPS_CHECK_INTERVAL and self._last_check:
+            return
+        with self._lock:
+            self._last_check = time.monotonic()
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                return
+            if mtime != self._mtime:
+                try:
+                    self.tips = read_tips_file(self.path)
+                    self._mtime = mtime
+                    print(f"Loaded {len(self.tips)} precomputed tips from {self.path}")
+                except Exception as e:
+                    print(f"Error loading precomputed tips: {str(e)}")
+
+    def load(self):
+        """Read the file now, so the first plan request doesn't pay for it"""
+        self._last_check = 0.0
+        self._refresh()
+        if self._mtime is None:
+            print(f"No precomputed tips at {self.path}, tips come from the cache and the LLM")
+
+    def get_ai_tip(self, exercise, model, prompt_version):
+        """The precomputed LLM tip, if one was generated with this model and prompt version"""
+        self._refresh()
+        entry = self.tips.get(exercise_content_key(exercise))
+        if entry and entry.get('ai_tip') and entry.get('ai_model') == model \
+                and entry.get('ai_prompt_version') == prompt_version:
+            return entry['ai_tip']
+        return None
+
+    def get_rule_tip(self, exercise):
+        self._refresh()
+        entry = self.tips.get(exercise_content_key(exercise))
+        return entry.get('rule_tip') if entry else None
+
+precomputed_tips = PrecomputedTips()
+
+def precompute_tips(use_llm=False, rate=PRECOMPUTE_TIPS_RATE, restart=False, path=PRECOMPUTED_TIPS_FILE):
+    """
+    Walk the exercise catalog and store tips for every exercise in the sidecar
+    file: always the rule-based tip, and with use_llm an LLM tip, in batches at
+    no more than `rate` calls per second. Progress is checkpointed to the file,
+    so an interrupted run picks up where it stopped unless `restart` is set.
+    """
+    from src.catalog import load_catalog
+    from src.llm_gateway import get_gateway
+    from src.rate_limiter import priority
+    from src.workout_generator import (AI_TIP_BATCH_SIZE, AI_TIP_PROMPT_VERSION, generate_ai_tip_batch,
+                                       generate_ai_tip_rule_based)
+
+    catalog = load_catalog()
+    tips = {} if restart else read_tips_file(path)
+    print(f"Precomputing tips for {len(catalog)} exercises ({len(tips)} already stored)")
+
+    exercises = {}
+    for exercise in catalog.documents:
+        exercises.setdefault(exercise_content_key(exercise), exercise)
+
+    for key, exercise in exercises.items():
+        entry = tips.setdefault(key, {'title': exercise.get('Title', '')})
+        if not entry.get('rule_tip'):
+            entry['rule_tip'] = generate_ai_tip_rule_based(exercise)
+    write_tips_file(tips, path)
+    print(f"Stored rule-based tips for {len(exercises)} exercises")
+
+    if not use_llm:
+        return tips
+
+    gateway = get_gateway()
+    if not gateway.is_available():
+        print("MISTRAL_API_KEY is not set, skipping LLM tips")
+        return tips
+    model = gateway.model_for('tips')
+
+    missing = [key for key in exercises
+               if not (tips[key].get('ai_tip') and tips[key].get('ai_model') == model
+                       and tips[key].get('ai_prompt_version') == AI_TIP_PROMPT_VERSION)]
+    print(f"Generating LLM tips for {len(missing)} exercises with {model}")
+
+    interval = 1.0 / rate if rate > 0 else 0
+    last_call = 0.0
+    done_since_checkpoint = 0
+    for start in range(0, len(missing), AI_TIP_BATCH_SIZE):
+        batch_keys = missing[start:start + AI_TIP_BATCH_SIZE]
+
+        # Stay under the configured request rate
+        wait = last_call + interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        last_call = time.monotonic()
+
+        # Background priority: only use rate limit budget that live traffic leaves free
+        with priority('background'):
+            batch_tips = generate_ai_tip_batch([exercises[key] for key in batch_keys])
+        for key, tip in zip(batch_keys, batch_tips):
+            if tip:
+                tips[key].update({'ai_tip': tip, 'ai_model': model, 'ai_prompt_version': AI_TIP_PROMPT_VERSION})
+
+        done_since_checkpoint += len(batch_keys)
+        if done_since_checkpoint >= PRECOMPUTE_TIPS_CHECKPOINT_EVERY:
+            write_tips_file(tips, path)
+            done_since_checkpoint = 0
+            print(f"Checkpoint: {start + len(batch_keys)}/{len(missing)} exercises processed")
+
+    write_tips_file(tips, path)
+    stored = sum(1 for entry in tips.values() if entry.get('ai_model') == model)
+    print(f"Stored LLM tips for {stored} of {len(exercises)} exercises")
+    return tips
@@ -0,0 +1,70 @@
+import os
+from jinja2 import Environment, FileSystemLoader
+
+PROMPT_TEMPLATE_DIR = os.getenv("PROMPT_TEMPLATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates'))
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "3000"))  # Tokens of documents per chat prompt
+# Document metadata the chat prompt needs; everything else from the index is left out
+RAG_DOCUMENT_FIELDS = [field.strip() for field in os.getenv(
+    "RAG_DOCUMENT_FIELDS", "Main_muscle,Target_Muscles,Equipment,Mechanics,Difficulty (1-5)").split(',') if field.strip()]
+DOCUMENT_OVERHEAD_TOKENS = 6  # Separators and labels around each document in the prompt
+
+# Templates are compiled on first use and cached; auto_reload recompiles a template when its file changes
+_environment = Environment(loader=FileSystemLoader(PROMPT_TEMPLATE_DIR), auto_reload=True)
+
+def get_template(name):
+    return _environment.get_template(name)
+
+def render_prompt(name, **context):
+    """Render the named template from the templates directory"""
+    return get_template(name).render(**context)
+
+def warm_templates():
+    """Compile every template up front so the first request doesn't pay for it"""
+    for name in _environment.list_templates():
+        try:
+            get_template(name)
+        except Exception as e:
+            print(f"Error compiling prompt template {name}: {str(e)}")
+
+def estimate_text_tokens(text):
+    """Rough token count, ~4 characters per token"""
+    return len(text) // 4 + 1
+
+def format_document_details(metadata, fields=None):
+    """The projected metadata of a document as 'Field: value; ...', skipping empty values"""
+    details = []
+    for field in fields or RAG_DOCUMENT_FIELDS:
+        value = str(metadata.get(field) or '').strip().rstrip(',').strip()
+        if value:
+            details.append(f"{field}: {value}")
+    return '; '.join(details)
+
+def pack_documents(result_lists, budget=RAG_CONTEXT_TOKEN_BUDGET, fields=None):
+    """
+    Fit retrieved documents into a token budget. `result_lists` holds one ranked
+    list of documents per search. Documents are deduplicated by name (keeping the
+    best rank), then admitted rank by rank across all lists, so when the budget
+    runs out the lowest-ranked documents of every search are the ones dropped.
+    Returns [{'name', 'details'}] in search order.
+    """
+    best = {}  # name -> (rank, list index, document)
+    for list_index, documents in enumerate(result_lists):
+        for rank, document in enumerate(documents):
+            name = document.page_content
+            if name not in best or rank < best[name][0]:
+                best[name] = (rank, list_index, document)
+
+    packed = {}
+    used = 0
+    for name, (rank, list_index, document) in sorted(best.items(), key=lambda item: item[1][:2]):
+        details = format_document_details(document.metadata, fields)
+        cost = estimate_text_tokens(name) + estimate_text_tokens(details) + DOCUMENT_OVERHEAD_TOKENS
+        if used + cost > budget:
+            break
+        used += cost
+        packed[name] = (list_index, rank, details)
+
+    total = sum(len(documents) for documents in result_lists)
+    print(f"Packed {len(packed)} of {len(best)} unique documents ({total} retrieved) into ~{used} tokens")
+    return [{'name': name, 'details': details}
+            for name, (_, _, details) in sorted(packed.items(), key=lambda item: item[1][:2])]
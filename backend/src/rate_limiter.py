@@ -0,0 +1,250 @@
+import os
+import time
+import random
+import asyncio
+import sqlite3
+import threading
+import contextvars
+from contextlib import contextmanager
+from src.cache import CACHE_DB_PATH
+
+LLM_RATE_LIMIT_RPS = float(os.getenv("LLM_RATE_LIMIT_RPS", "5"))  # Requests per second for the node, 0 disables
+LLM_RATE_LIMIT_BURST = float(os.getenv("LLM_RATE_LIMIT_BURST", "0"))  # Request burst size, defaults to one second's worth
+LLM_RATE_LIMIT_TPM = float(os.getenv("LLM_RATE_LIMIT_TPM", "500000"))  # Tokens per minute for the node, 0 disables
+LLM_RATE_LIMIT_SHARED = os.getenv("LLM_RATE_LIMIT_SHARED", "true").lower() == "true"  # Share budgets between workers
+LLM_RATE_LIMIT_MAX_WAIT = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT", "10"))  # Longest an interactive call queues
+LLM_BACKGROUND_RESERVE = float(os.getenv("LLM_BACKGROUND_RESERVE", "0.5"))  # Share of each budget background calls leave free
+LLM_ESTIMATED_COMPLETION_TOKENS = int(os.getenv("LLM_ESTIMATED_COMPLETION_TOKENS", "300"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))  # Seconds before the first retry
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+
+# 'interactive' calls serve a waiting user; 'background' calls (batch jobs, precomputation)
+# only use budget that interactive traffic leaves free.
+llm_priority = contextvars.ContextVar('llm_priority', default='interactive')
+
+class RateLimited(Exception):
+    """Raised when a call would have to wait longer than allowed for rate limit budget"""
+
+@contextmanager
+def priority(level):
+    """Run the LLM calls made in this block at the given priority"""
+    token = llm_priority.set(level)
+    try:
+        yield
+    finally:
+        llm_priority.reset(token)
+
+def estimate_tokens(messages, max_tokens=None):
+    """Rough token count for a request: ~4 characters per prompt token plus the expected completion"""
+    prompt_chars = sum(len(message.content or '') for message in messages)
+    return prompt_chars // 4 + (max_tokens or LLM_ESTIMATED_COMPLETION_TOKENS)
+
+def retry_delay(error, attempt):
+    """
+    Seconds to wait before retry number `attempt`: the server's Retry-After if
+    it sent one, otherwise exponential backoff with full jitter.
+    """
+    headers = {key.lower(): value for key, value in (getattr(error, 'headers', None) or {}).items()}
+    try:
+        if 'retry-after-ms' in headers:
+            retry_after = float(headers['retry-after-ms']) / 1000
+        else:
+            retry_after = float(headers['retry-after'])
+        # A little jitter so workers told the same Retry-After don't all come back at once
+        return retry_after + random.uniform(0, min(1.0, retry_after * 0.1))
+    except (KeyError, TypeError, ValueError):
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+class RateLimiter:
+    """
+    Token buckets for requests per second and tokens per minute. With `shared`
+    the bucket levels live in the node's SQLite cache file and are updated in
+    IMMEDIATE transactions, so every worker process draws from the same budget.
+    Background callers may only take budget above the reserved share, which
+    keeps headroom for interactive calls. A 429 puts the whole node into a
+    cooldown for the Retry-After period.
+    """
+
+    def __init__(self, rps=LLM_RATE_LIMIT_RPS, tpm=LLM_RATE_LIMIT_TPM, burst=LLM_RATE_LIMIT_BURST,
+                 background_reserve=LLM_BACKGROUND_RESERVE, shared=LLM_RATE_LIMIT_SHARED,
+                 path=CACHE_DB_PATH, name='mistral'):
+        self.name = name
+        self.background_reserve = background_reserve
+        self.buckets = {}  # bucket -> (capacity, refill per second)
+        if rps > 0:
+            self.buckets['requests'] = (burst or max(1.0, rps), rps)
+        if tpm > 0:
+            self.buckets['tokens'] = (tpm, tpm / 60.0)
+        self.waits = 0
+        self.rejections = 0
+        self.path = None
+        self._state = {}  # In-process levels: bucket -> (level, updated_at)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if shared and self.buckets:
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self.path = path
+                self._connection().execute("""
+                    CREATE TABLE IF NOT EXISTS rate_limits (
+                        name TEXT PRIMARY KEY,
+                        level REAL NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+            except Exception as e:
+                self.path = None
+                print(f"Could not share rate limits at {path}, limiting per worker: {str(e)}")
+
+    @property
+    def enabled(self):
+        return bool(self.buckets)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _update(self, func):
+        """Run func(levels) -> result on the current levels atomically; func may modify levels in place"""
+        if self.path is None:
+            with self._lock:
+                return func(self._state)
+
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            prefix = f"{self.name}:"
+            levels = {name[len(prefix):]: (level, updated_at) for name, level, updated_at in conn.execute(
+                "SELECT name, level, updated_at FROM rate_limits WHERE name LIKE ?", (f"{prefix}%",))}
+            before = dict(levels)
+            result = func(levels)
+            for bucket, value in levels.items():
+                if before.get(bucket) != value:
+                    conn.execute("INSERT OR REPLACE INTO rate_limits (name, level, updated_at) VALUES (?, ?, ?)",
+                                 (prefix + bucket, value[0], value[1]))
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _level(self, levels, bucket, now):
+        capacity, rate = self.buckets[bucket]
+        level, updated_at = levels.get(bucket, (capacity, now))
+        return min(capacity, level + (now - updated_at) * rate)
+
+    def try_acquire(self, tokens, level='interactive'):
+        """Take one request and `tokens` tokens if available. Returns 0, or the seconds to wait before trying again."""
+        def take(levels):
+            now = time.time()
+            cooldown_until = levels.get('cooldown', (0, 0))[0]
+            if cooldown_until > now:
+                return cooldown_until - now
+
+            amounts = {'requests': 1, 'tokens': tokens}
+            wait = 0.0
+            current = {}
+            for bucket, (capacity, rate) in self.buckets.items():
+                current[bucket] = self._level(levels, bucket, now)
+                amount = min(amounts[bucket], capacity)
+                # The reserve can't exceed what's left after this call, or background calls would never fit
+                floor = min(capacity * self.background_reserve, capacity - amount) if level == 'background' else 0.0
+                if current[bucket] - amount < floor:
+                    wait = max(wait, (floor + amount - current[bucket]) / rate)
+            if wait > 0:
+                return wait
+
+            for bucket, (capacity, rate) in self.buckets.items():
+                levels[bucket] = (current[bucket] - min(amounts[bucket], capacity), now)
+            return 0.0
+
+        try:
+            return self._update(take)
+        except Exception as e:
+            # Never fail a call because the limiter's store is unavailable
+            print(f"Error checking rate limit: {str(e)}")
+            return 0.0
+
+    def _next_wait(self, tokens, level, started, max_wait):
+        wait = self.try_acquire(tokens, level)
+        if wait <= 0:
+            return 0.0
+        if max_wait is not None and time.monotonic() - started + wait > max_wait:
+            self.rejections += 1
+            raise RateLimited(f"LLM rate limit: no budget within {max_wait:g} seconds")
+        # Background callers poll less often, so interactive callers get to freed budget first
+        poll = 1.0 if level == 'background' else 0.25
+        return min(wait, poll) + random.uniform(0, 0.05)
+
+    def acquire(self, tokens, level=None, max_wait=None):
+        """Block until the call fits in the budgets, or raise RateLimited after max_wait seconds"""
+        if not self.enabled:
+            return
+        level = level or llm_priority.get()
+        started = time.monotonic()
+        waited = False
+        while True:
+            wait = self._next_wait(tokens, level, started, max_wait)
+            if not wait:
+                return
+            if not waited:
+                self.waits += 1
+                waited = True
+            time.sleep(wait)
+
+    async def aacquire(self, tokens, level=None, max_wait=None):
+        """Async version of acquire()"""
+        if not self.enabled:
+            return
+        level = level or llm_priority.get()
+        started = time.monotonic()
+        waited = False
+        while True:
+            wait = self._next_wait(tokens, level, started, max_wait)
+            if not wait:
+                return
+            if not waited:
+                self.waits += 1
+                waited = True
+            await asyncio.sleep(wait)
+
+    def record_usage(self, estimated, actual):
+        """Correct the token bucket once the real usage of a call is known"""
+        if 'tokens' not in self.buckets or actual is None or actual == estimated:
+            return
+
+        def adjust(levels):
+            now = time.time()
+            capacity = self.buckets['tokens'][0]
+            levels['tokens'] = (max(-capacity, self._level(levels, 'tokens', now) - (actual - estimated)), now)
+
+        try:
+            self._update(adjust)
+        except Exception as e:
+            print(f"Error recording token usage: {str(e)}")
+
+    def cooldown(self, seconds):
+        """Hold back all calls on the node for `seconds` (after a 429)"""
+        def extend(levels):
+            until = time.time() + seconds
+            if levels.get('cooldown', (0, 0))[0] < until:
+                levels['cooldown'] = (until, time.time())
+
+        try:
+            self._update(extend)
+        except Exception as e:
+            print(f"Error recording rate limit cooldown: {str(e)}")
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'shared': self.path is not None,
+            'waits': self.waits,
+            'rejections': self.rejections
+        }
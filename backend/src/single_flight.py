@@ -0,0 +1,175 @@
+import os
+import copy
+import json
+import time
+import hashlib
+import threading
+from src.cache import SQLiteStore
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; only in-process coalescing works there
+    fcntl = None
+
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+SINGLE_FLIGHT_SHARED = os.getenv("SINGLE_FLIGHT_SHARED", "false").lower() == "true"  # Also coalesce across worker processes
+SINGLE_FLIGHT_LOCK_DIR = os.getenv("SINGLE_FLIGHT_LOCK_DIR", "cache/single_flight")
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", "60"))  # Longest a duplicate waits for the first caller
+SINGLE_FLIGHT_RESULT_TTL = 30  # Seconds a result stays readable by workers that waited on the lock
+SINGLE_FLIGHT_POLL_SECONDS = 0.05
+
+class SingleFlightTimeout(TimeoutError):
+    """Raised when a duplicate request gives up waiting for the one in flight"""
+
+class SingleFlightError(Exception):
+    """The first caller in another worker process failed; carries its error message"""
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller for a key runs the
+    function, and callers arriving while it is in flight wait for it and get a
+    copy of its result (or its exception). Nothing is kept once the call
+    finishes, so this only removes duplicate work during bursts.
+
+    With `shared`, the first caller in each worker also takes a per-key file
+    lock, so the same request in another worker process on the node waits for
+    it and reads the result from the shared SQLite store.
+    """
+
+    def __init__(self, namespace, shared=SINGLE_FLIGHT_SHARED, enabled=SINGLE_FLIGHT_ENABLED,
+                 lock_dir=SINGLE_FLIGHT_LOCK_DIR, result_ttl=SINGLE_FLIGHT_RESULT_TTL):
+        self.namespace = namespace
+        self.enabled = enabled
+        self.lock_dir = lock_dir
+        self.leaders = 0
+        self.coalesced = 0
+        self.store = None
+        self._calls = {}
+        self._lock = threading.Lock()
+        if enabled and shared:
+            if fcntl is None:
+                print(f"File locks unavailable, coalescing {namespace} requests within each worker only")
+            else:
+                try:
+                    os.makedirs(lock_dir, exist_ok=True)
+                    self.store = SQLiteStore(f"single_flight:{namespace}", ttl=result_ttl, max_entries=1000,
+                                             dumps=lambda value: json.dumps(value, default=str))
+                except Exception as e:
+                    print(f"Could not set up shared {namespace} coalescing, using in-process only: {str(e)}")
+
+    def do(self, key, func, timeout=SINGLE_FLIGHT_TIMEOUT):
+        """Return func(), sharing one execution between concurrent callers with the same key"""
+        if not self.enabled:
+            return func()
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            print(f"Identical {self.namespace} request in flight, waiting for its result")
+            if not call.done.wait(timeout):
+                raise SingleFlightTimeout(f"Identical {self.namespace} request did not finish within {timeout:g} seconds")
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        result = None
+        try:
+            result = self._run(key, func, timeout)
+            return result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                waiters = call.waiters
+            # Waiters copy from a snapshot, so the first caller is free to modify its result
+            if waiters and call.error is None:
+                call.result = copy.deepcopy(result)
+            call.done.set()
+
+    def _run(self, key, func, timeout):
+        if self.store is None:
+            return func()
+
+        store_key = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        lock_path = os.path.join(self.lock_dir, f"{self.namespace}-{store_key[:32]}.lock")
+        started_at = time.time()
+        with open(lock_path, 'a') as lock_file:
+            if not self._acquire(lock_file, timeout):
+                raise SingleFlightTimeout(f"Identical {self.namespace} request in another worker did not finish "
+                                          f"within {timeout:g} seconds")
+            try:
+                # Another worker may have finished this request while we waited for the lock
+                shared = self._read_shared(store_key, started_at)
+                if shared is not None:
+                    print(f"Identical {self.namespace} request finished in another worker, using its result")
+                    if 'error' in shared:
+                        raise SingleFlightError(shared['error'])
+                    return shared['result']
+
+                try:
+                    result = func()
+                except Exception as e:
+                    self._write_shared(store_key, {'error': str(e)})
+                    raise
+                self._write_shared(store_key, {'result': result})
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _acquire(self, lock_file, timeout):
+        if timeout is None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            return True
+        expires_at = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= expires_at:
+                    return False
+                time.sleep(SINGLE_FLIGHT_POLL_SECONDS)
+
+    def _read_shared(self, store_key, started_at):
+        try:
+            shared = self.store.get(store_key)
+        except Exception as e:
+            print(f"Error reading shared {self.namespace} result: {str(e)}")
+            return None
+        # Only results finished after this request arrived count as the same flight
+        if shared is None or shared['finished_at'] < started_at:
+            return None
+        return shared
+
+    def _write_shared(self, store_key, outcome):
+        try:
+            outcome['finished_at'] = time.time()
+            self.store.set(store_key, outcome)
+        except Exception as e:
+            print(f"Error writing shared {self.namespace} result: {str(e)}")
+
+    def stats(self):
+        return {
+            'namespace': self.namespace,
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'coalesced': self.coalesced,
+            'shared': self.store is not None
+        }
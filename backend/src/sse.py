@@ -0,0 +1,34 @@
+import json
+import queue
+import threading
+
+def format_sse(event, data):
+    """Encode one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def stream_events(producer):
+    """
+    Run producer(emit) in a background thread and yield the events it emits
+    as SSE messages. emit(event, data) serializes immediately, so later changes
+    to data don't affect events already sent. Ends when the producer returns.
+    """
+    events = queue.Queue()
+
+    def emit(event, data):
+        events.put(format_sse(event, data))
+
+    def run():
+        try:
+            producer(emit)
+        except Exception as e:
+            print(f"Error in event stream: {str(e)}")
+            emit('error', {'status': 'error', 'message': str(e)})
+        finally:
+            events.put(None)
+
+    threading.Thread(target=run, daemon=True, name="sse-producer").start()
+    while True:
+        message = events.get()
+        if message is None:
+            break
+        yield message
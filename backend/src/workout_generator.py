@@ -1,11 +1,28 @@
 from elasticsearch import Elasticsearch
 import os
 import re
+import json
+import math
+import time
+import hashlib
 from datetime import datetime
+from functools import lru_cache
 from collections import Counter, defaultdict
-from mistralai.client import MistralClient
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 from mistralai.models.chat_completion import ChatMessage
-from fuzzywuzzy import process, fuzz
+from src.cache import TieredCache
+from src.matcher import IntentMatcher
+from src.pipeline import Stage, run_stages, format_timings
+from src.llm_gateway import get_gateway
+from src.catalog import CATALOG_BACKEND, UnsupportedQuery, get_catalog
+from src.intent_cache import intent_cache, canonicalize_query
+from src.candidate_pool import CandidatePool
+from src.fallback_pools import plan_fallback_queries, get_fallback_pools
+from src.deadline import Deadline, PLAN_DEADLINE_SECONDS, DEADLINE_MIN_STAGE_SECONDS, run_within
+from src.plan_cache import plan_cache, plan_cache_key
+from src.precomputed_tips import precomputed_tips
+from src.llm_metrics import llm_metrics, stage
+from src.single_flight import SingleFlight, SingleFlightTimeout, SingleFlightError
 
 # Define comprehensive equipment mapping with synonyms and categories
 EQUIPMENT_MAPPING = {
@@ -37,6 +54,64 @@ REVERSE_EQUIPMENT_MAPPING = {}
 for key, data in EQUIPMENT_MAPPING.items():
     REVERSE_EQUIPMENT_MAPPING[data['name']] = key
 
+# Body part keywords (plurals are folded by the matcher, so 'quads' matches 'quad')
+BODY_PART_KEYWORDS = {
+    'leg': 'Legs', 'quad': 'Quadriceps', 'quadricep': 'Quadriceps', 'hamstring': 'Hamstrings',
+    'calf': 'Calves', 'calves': 'Calves',
+    'arm': 'Arms', 'bicep': 'Biceps', 'tricep': 'Triceps', 'shoulder': 'Shoulders', 'delt': 'Shoulders',
+    'chest': 'Chest', 'pec': 'Chest', 'pectoral': 'Chest',
+    'back': 'Back', 'lat': 'Back',
+    'core': 'Core', 'ab': 'Abdominals', 'abs': 'Abdominals', 'abdominal': 'Abdominals',
+    'glute': 'Glutes', 'butt': 'Glutes',
+    'full body': 'Full Body', 'total body': 'Full Body'
+}
+
+# Phrases that mean the user has no equipment at all
+NO_EQUIPMENT_PHRASES = [
+    'no equipment', 'body weight', 'bodyweight', 'body only', 
+    'without equipment', 'no weights', 'without weights', 
+    'calisthenics', 'just my body'
+]
+
+# Compiled once: exact phrase trie plus trigram index for fuzzy equipment matching
+INTENT_MATCHER = IntentMatcher(EQUIPMENT_MAPPING, BODY_PART_KEYWORDS, NO_EQUIPMENT_PHRASES)
+
+# Body-part substrings that make up each day focus of a split. Any other focus
+# (e.g. "Chest" in a body part split) matches body parts containing its own name.
+FOCUS_GROUPS = {
+    'Push': ["chest", "shoulder", "tricep"],
+    'Pull': ["back", "bicep"],
+    'Legs': ["leg", "quad", "hamstring", "glute", "calf"],
+    'Upper': ["chest", "back", "shoulder", "arm", "bicep", "tricep"],
+    'Lower': ["leg", "quad", "hamstring", "glute", "calf"]
+}
+FULL_BODY_PARTS = ["Chest", "Back", "Legs", "Shoulders", "Arms", "Core"]
+
+# AI coach tips are generated concurrently once exercises are selected
+AI_TIP_MAX_CONCURRENCY = int(os.getenv("AI_TIP_MAX_CONCURRENCY", "8"))  # Max tip requests in flight
+AI_TIP_TIMEOUT = float(os.getenv("AI_TIP_TIMEOUT", "10"))  # Seconds allowed per tip request
+AI_TIP_PROMPT_VERSION = "1"  # Bump whenever the tip prompt changes so cached tips are regenerated
+
+# 'batch' asks for the tips of many exercises in one LLM call, 'individual' makes one call per exercise
+AI_TIP_MODE = os.getenv("AI_TIP_MODE", "batch")
+AI_TIP_BATCH_SCOPE = os.getenv("AI_TIP_BATCH_SCOPE", "plan")  # 'plan' or 'day': which exercises share a call
+AI_TIP_BATCH_SIZE = int(os.getenv("AI_TIP_BATCH_SIZE", "30"))  # Max exercises per batched call
+AI_TIP_BATCH_TIMEOUT = float(os.getenv("AI_TIP_BATCH_TIMEOUT", "30"))  # Seconds allowed per batched call
+
+# Deadline budgeting: the intent calls may use this share of the remaining time, and the
+# post-draft AI stages leave this many seconds for assembling the response
+PLAN_INTENT_BUDGET_SHARE = float(os.getenv("PLAN_INTENT_BUDGET_SHARE", "0.4"))
+PLAN_DEADLINE_RESERVE_SECONDS = float(os.getenv("PLAN_DEADLINE_RESERVE_SECONDS", "0.5"))
+
+# Tips only depend on catalog fields, so they are cached across requests, workers and restarts
+tip_cache = TieredCache(
+    'ai_tips',
+    max_entries=int(os.getenv("TIP_CACHE_MAX_ENTRIES", "5000")),
+    ttl=float(os.getenv("TIP_CACHE_TTL", str(30 * 24 * 3600))),
+    persist=os.getenv("TIP_CACHE_PERSIST", "true").lower() == "true",
+    disk_max_entries=int(os.getenv("TIP_CACHE_DISK_MAX_ENTRIES", "50000"))
+)
+
 def extract_number(text, default=3):
     """Extract a number from text or return default"""
     numbers = re.findall(r'\b(\d+)\b', text)
@@ -46,125 +121,21 @@ def extract_number(text, default=3):
 
 def extract_body_parts(text):
     """Extract body parts from text"""
-    body_parts = set()
-    part_keywords = {
-        'leg': 'Legs', 'quad': 'Quadriceps', 'hamstring': 'Hamstrings', 'calf': 'Calves',
-        'arm': 'Arms', 'bicep': 'Biceps', 'tricep': 'Triceps', 'shoulder': 'Shoulders',
-        'chest': 'Chest', 'pec': 'Chest', 
-        'back': 'Back', 'lat': 'Back',
-        'core': 'Core', 'ab': 'Abdominals', 'abs': 'Abdominals',
-        'glute': 'Glutes', 'butt': 'Glutes',
-        'full body': 'Full Body', 'total body': 'Full Body'
-    }
-    
-    for keyword, part in part_keywords.items():
-        if keyword in text.lower():
-            body_parts.add(part)
-    
-    return list(body_parts)
-
-def preprocess_text(text):
-    """Preprocess text for better matching"""
-    # Convert to lowercase
-    text = text.lower()
-    
-    # Replace multiple spaces with single space
-    text = re.sub(r'\s+', ' ', text)
-    
-    # Remove punctuation
-    text = re.sub(r'[^\w\s]', ' ', text)
-    
-    return text.strip()
+    return INTENT_MATCHER.match(text).body_parts
 
 def fuzzy_match_equipment(text, threshold=80):
     """Use fuzzy matching to find equipment in text"""
-    matched_equipment = []
-    
-    # Text normalization
-    text = preprocess_text(text)
-    
-    # First check exact matches including synonyms
-    for equip_key, equip_data in EQUIPMENT_MAPPING.items():
-        # Check the main term
-        if equip_key in text:
-            matched_equipment.append(equip_data['name'])
-            continue
-            
-        # Check synonyms
-        for synonym in equip_data['synonyms']:
-            if synonym in text:
-                matched_equipment.append(equip_data['name'])
-                break
-    
-    # If no exact matches, try fuzzy matching
-    if not matched_equipment:
-        # Create a list of all equipment terms and their synonyms
-        all_terms = []
-        term_to_equipment = {}
-        
-        for equip_key, equip_data in EQUIPMENT_MAPPING.items():
-            all_terms.append(equip_key)
-            term_to_equipment[equip_key] = equip_data['name']
-            
-            for synonym in equip_data['synonyms']:
-                all_terms.append(synonym)
-                term_to_equipment[synonym] = equip_data['name']
-        
-        # Extract all words and phrases from the text (1-3 word combinations)
-        words = text.split()
-        phrases = [' '.join(words[i:i+n]) for n in range(1, 4) for i in range(len(words)-n+1)]
-        
-        # Try to match each phrase to equipment terms
-        for phrase in phrases:
-            matches = process.extractBests(phrase, all_terms, scorer=fuzz.token_sort_ratio, 
-                                          score_cutoff=threshold, limit=3)
-            for match, score in matches:
-                matched_equipment.append(term_to_equipment[match])
-    
-    # Return unique matches
-    return list(set(matched_equipment))
+    if threshold != INTENT_MATCHER.fuzzy_threshold:
+        return IntentMatcher(EQUIPMENT_MAPPING, BODY_PART_KEYWORDS, NO_EQUIPMENT_PHRASES, threshold).match_equipment(text)
+    return INTENT_MATCHER.match_equipment(text)
 
 def extract_equipment(text):
     """
     Extract equipment preferences from text with advanced matching
     Returns (equipment_list, is_exclusive, no_equipment)
     """
-    # Preprocess the text
-    text = preprocess_text(text)
-    
-    # Check for "no equipment" phrases
-    no_equipment_phrases = [
-        'no equipment', 'body weight', 'bodyweight', 'body only', 
-        'without equipment', 'no weights', 'without weights', 
-        'calisthenics', 'just my body'
-    ]
-    
-    for phrase in no_equipment_phrases:
-        if phrase in text:
-            return ['Body Only'], True, True
-    
-    # Check for "only" phrases that indicate exclusive equipment use
-    only_patterns = [
-        r'([\w\s]+)\s+only',        # "dumbbells only"
-        r'only\s+([\w\s]+)',        # "only dumbbells"
-        r'just\s+([\w\s]+)',        # "just dumbbells"
-        r'using\s+only\s+([\w\s]+)', # "using only dumbbells"
-        r'with\s+only\s+([\w\s]+)',  # "with only dumbbells"
-        r'have\s+only\s+([\w\s]+)',  # "have only dumbbells"
-        r'access\s+to\s+only\s+([\w\s]+)', # "access to only dumbbells"
-    ]
-    
-    for pattern in only_patterns:
-        match = re.search(pattern, text)
-        if match:
-            equipment_text = match.group(1).strip()
-            matched_equip = fuzzy_match_equipment(equipment_text)
-            if matched_equip:
-                return matched_equip, True, False
-    
-    # Use fuzzy matching for all equipment
-    matched_equipment = fuzzy_match_equipment(text)
-    return matched_equipment, len(matched_equipment) > 0, False
+    match = INTENT_MATCHER.match(text)
+    return match.equipment, match.is_exclusive, match.no_equipment_only
 
 def is_equipment_compatible(exercise_equipment, user_equipment, no_equipment_only=False):
     """
@@ -258,18 +229,17 @@ def generate_ai_tip_rule_based(exercise):
     
     return " ".join(selected_tips)
 
-def generate_ai_tip(exercise):
-    """Generate AI coach tips using Mistral AI if available, fallback to rule-based"""
-    try:
-        # Try to use Mistral API if credentials are available
-        api_key = os.environ.get("MISTRAL_API_KEY")
-        if not api_key:
-            return generate_ai_tip_rule_based(exercise)
-        
-        client = MistralClient(api_key=api_key)
-        
-        # Format exercise details for the prompt
-        exercise_details = f"""
+def tip_cache_key(exercise, model=None):
+    """Content hash of the exercise fields used in the tip prompt, plus model and prompt version"""
+    model = model or get_gateway().model_for('tips')
+    fields = [exercise.get(field, '') for field in ('Title', 'Description', 'Type', 'Equipment', 'BodyPart', 'Level')]
+    payload = json.dumps(fields + [model, AI_TIP_PROMPT_VERSION], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+AI_TIP_SYSTEM_PROMPT = "You are an expert fitness coach providing concise, specific advice for exercises. Focus on proper form, technique, and common mistakes to avoid. Keep your response under 40 words."
+
+def format_exercise_details(exercise):
+    return f"""
         Exercise: {exercise.get('Title', '')}
         Description: {exercise.get('Description', '')}
         Type: {exercise.get('Type', '')}
@@ -277,30 +247,254 @@ def generate_ai_tip(exercise):
         Body Part: {exercise.get('BodyPart', '')}
         Level: {exercise.get('Level', '')}
         """
+
+def trim_tip(ai_tip):
+    """Keep tips short: cut anything over 45 words down to its first two sentences"""
+    if len(ai_tip.split()) > 45:  # If more than 45 words
+        sentences = ai_tip.split('.')
+        ai_tip = '. '.join(sentences[:2]) + '.'
+    return ai_tip.strip()
+
+def report_fallback(deadline, stage, reason):
+    """Record that an AI stage fell back, so the plan isn't cached as if the AI had run"""
+    if deadline is not None:
+        deadline.degrade(stage, reason)
+
+def generate_ai_tip(exercise, timeout=AI_TIP_TIMEOUT, use_cache=True, fallback=True):
+    """
+    Generate AI coach tips using Mistral AI if available, fallback to rule-based.
+    With fallback=False, returns None instead of the rule-based tip when the AI tip fails.
+    """
+    try:
+        # Try to use Mistral API if credentials are available
+        gateway = get_gateway()
+        if not gateway.is_available():
+            return generate_ai_tip_rule_based(exercise) if fallback else None
+        
+        cache_key = tip_cache_key(exercise)
+        if use_cache:
+            cached_tip = tip_cache.get(cache_key)
+            if cached_tip:
+                llm_metrics.record_outcome('tips', 'success', cache='hit')
+                return cached_tip
         
         messages = [
-            ChatMessage(role="system", content="You are an expert fitness coach providing concise, specific advice for exercises. Focus on proper form, technique, and common mistakes to avoid. Keep your response under 40 words."),
-            ChatMessage(role="user", content=f"Give me 1-2 specific coaching tips for this exercise:\n{exercise_details}")
+            ChatMessage(role="system", content=AI_TIP_SYSTEM_PROMPT),
+            ChatMessage(role="user", content=f"Give me 1-2 specific coaching tips for this exercise:\n{format_exercise_details(exercise)}")
         ]
         
-        response = client.chat(
-            model="mistral-tiny",  # Use an appropriate model
-            messages=messages
-        )
+        content = gateway.complete('tips', messages, timeout=timeout)
         
-        ai_tip = response.choices[0].message.content
-        
-        # Ensure the tip isn't too long
-        if len(ai_tip.split()) > 45:  # If more than 45 words
-            sentences = ai_tip.split('.')
-            ai_tip = '. '.join(sentences[:2]) + '.'
-        
-        return ai_tip.strip()
+        ai_tip = trim_tip(content)
+        if ai_tip:
+            tip_cache.set(cache_key, ai_tip)
+        llm_metrics.record_outcome('tips', 'success' if ai_tip else 'parse_failure', cache='miss')
+        return ai_tip
     
     except Exception as e:
         print(f"Error generating AI tip with Mistral: {str(e)}")
+        llm_metrics.record_outcome('tips', 'fallback', cache='miss')
         # Fall back to rule-based tips
-        return generate_ai_tip_rule_based(exercise)
+        return generate_ai_tip_rule_based(exercise) if fallback else None
+
+def parse_batch_tips(content, count):
+    """
+    Map a batched tip response (a JSON array of {"index", "tip"} objects) back to
+    exercise positions. Returns a list of `count` tips, None where an entry is
+    missing or malformed.
+    """
+    tips = [None] * count
+    text = content.strip()
+    start, end = text.find('['), text.rfind(']')
+    if start == -1 or end <= start:
+        print("Batched tip response contained no JSON array")
+        return tips
+    try:
+        entries = json.loads(text[start:end + 1])
+    except ValueError as e:
+        print(f"Failed to parse batched tip response: {str(e)}")
+        return tips
+    
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        index, tip = entry.get('index'), entry.get('tip')
+        if isinstance(index, str) and index.isdigit():
+            index = int(index)
+        if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < count:
+            continue
+        if not isinstance(tip, str) or not tip.strip() or tips[index] is not None:
+            continue
+        tips[index] = trim_tip(tip)
+    return tips
+
+def generate_ai_tip_batch(exercises, timeout=AI_TIP_BATCH_TIMEOUT):
+    """
+    Generate tips for several exercises with a single LLM call. Returns one tip
+    per exercise, None for entries the response didn't cover (the caller falls
+    back to rule-based tips for those).
+    """
+    try:
+        gateway = get_gateway()
+        if not gateway.is_available():
+            return [None] * len(exercises)
+        
+        exercise_list = "\n".join(f"[{index}] {format_exercise_details(exercise)}" for index, exercise in enumerate(exercises))
+        prompt = f"""
+        Give 1-2 specific coaching tips for each of the following exercises.
+        
+        {exercise_list}
+        
+        Return ONLY a JSON array with one object per exercise and no explanation or other text:
+        [{{"index": <exercise number in brackets>, "tip": "<tip under 40 words>"}}]
+        """
+        
+        messages = [
+            ChatMessage(role="system", content=AI_TIP_SYSTEM_PROMPT),
+            ChatMessage(role="user", content=prompt)
+        ]
+        
+        # Batched calls are tracked apart from single-exercise tip calls
+        with stage('tips_batch'):
+            content = gateway.complete('tips', messages, timeout=timeout)
+        tips = parse_batch_tips(content, len(exercises))
+        
+        for exercise, tip in zip(exercises, tips):
+            if tip:
+                tip_cache.set(tip_cache_key(exercise), tip)
+        missing = tips.count(None)
+        if missing:
+            print(f"Batched tip response missing or malformed for {missing} of {len(exercises)} exercises")
+            llm_metrics.record_outcome('tips_batch', 'parse_failure', cache='miss', count=missing)
+        llm_metrics.record_outcome('tips_batch', 'success', cache='miss', count=len(exercises) - missing)
+        return tips
+    
+    except Exception as e:
+        print(f"Error generating batched AI tips: {str(e)}")
+        llm_metrics.record_outcome('tips_batch', 'fallback', cache='miss', count=len(exercises))
+        return [None] * len(exercises)
+
+def generate_ai_tips(exercises, max_concurrency=AI_TIP_MAX_CONCURRENCY, timeout=None, deadline=None,
+                    on_tip=None, mode=AI_TIP_MODE, group_of=None):
+    """
+    Fill in 'AI_Recommendations' for every exercise. In 'batch' mode the tips for
+    up to AI_TIP_BATCH_SIZE exercises (per group_of(exercise), e.g. per day) come
+    from one LLM call; in 'individual' mode each exercise gets its own call. At most
+    max_concurrency calls are in flight. Exercises whose tip fails, is malformed or
+    times out get the rule-based tip instead. With a deadline, waiting stops when
+    the budget runs out. on_tip(exercise, tip) is called as each tip is filled in.
+    """
+    if not exercises:
+        return exercises
+    
+    def finish(exercise, tip):
+        exercise['AI_Recommendations'] = tip
+        if on_tip:
+            on_tip(exercise, tip)
+    
+    # Without an LLM every exercise gets its rule-based tip, precomputed if available
+    gateway = get_gateway()
+    if not gateway.is_available():
+        for exercise in exercises:
+            finish(exercise, precomputed_tips.get_rule_tip(exercise) or generate_ai_tip_rule_based(exercise))
+        return exercises
+    
+    # Serve precomputed and cached tips directly and only send the misses to the LLM
+    model = gateway.model_for('tips')
+    pending = []
+    precomputed = 0
+    for exercise in exercises:
+        tip = precomputed_tips.get_ai_tip(exercise, model, AI_TIP_PROMPT_VERSION)
+        if tip:
+            precomputed += 1
+        else:
+            tip = tip_cache.get(tip_cache_key(exercise, model))
+        if tip:
+            finish(exercise, tip)
+        else:
+            pending.append(exercise)
+    cache_hits = len(exercises) - len(pending) - precomputed
+    print(f"AI tips: {precomputed} precomputed, {cache_hits} cache hits, {len(pending)} misses ({tip_cache.stats()})")
+    if precomputed:
+        llm_metrics.record_outcome('tips', 'success', cache='precomputed', count=precomputed)
+    if cache_hits:
+        llm_metrics.record_outcome('tips', 'success', cache='hit', count=cache_hits)
+    
+    if not pending:
+        return exercises
+    
+    if timeout is None:
+        timeout = AI_TIP_BATCH_TIMEOUT if mode == 'batch' else AI_TIP_TIMEOUT
+    
+    budget = None
+    if deadline is not None:
+        budget = deadline.budget(reserve=PLAN_DEADLINE_RESERVE_SECONDS)
+        if budget < DEADLINE_MIN_STAGE_SECONDS:
+            deadline.degrade('tips', f"only {budget:.2f}s of budget left")
+            for exercise in pending:
+                finish(exercise, generate_ai_tip_rule_based(exercise))
+            return exercises
+        timeout = min(timeout, llm_timeout(budget))
+    
+    # Split the work into calls: groups of exercises in batch mode, single exercises otherwise
+    if mode == 'batch':
+        groups = defaultdict(list)
+        for exercise in pending:
+            groups[group_of(exercise) if group_of else None].append(exercise)
+        batches = [group[i:i + AI_TIP_BATCH_SIZE] for group in groups.values()
+                   for i in range(0, len(group), AI_TIP_BATCH_SIZE)]
+    else:
+        batches = [[exercise] for exercise in pending]
+    
+    def run_batch(batch):
+        if mode == 'batch':
+            return generate_ai_tip_batch(batch, timeout)
+        return [generate_ai_tip(batch[0], timeout, False, fallback=False)]
+    
+    workers = max(1, min(max_concurrency, len(batches)))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ai-tip")
+    try:
+        futures = {executor.submit(run_batch, batch): batch for batch in batches}
+        
+        # Each worker runs its share of calls back to back, so allow one timeout per round
+        rounds = math.ceil(len(batches) / workers)
+        wait_time = timeout * rounds if budget is None else min(timeout * rounds, budget)
+        
+        # Fill tips in as they complete
+        done = set()
+        failed = 0
+        try:
+            for future in as_completed(futures, timeout=wait_time):
+                done.add(future)
+                batch = futures[future]
+                tips = [None] * len(batch)
+                try:
+                    tips = future.result()
+                except Exception as e:
+                    print(f"Error generating AI tips for {', '.join(ex.get('Title', '') for ex in batch)}: {str(e)}")
+                for exercise, tip in zip(batch, tips):
+                    if not tip:
+                        failed += 1
+                    finish(exercise, tip or generate_ai_tip_rule_based(exercise))
+        except FuturesTimeoutError:
+            pass
+        
+        if failed:
+            report_fallback(deadline, 'tips', f"{failed} AI tips failed, using rule-based tips")
+        
+        timed_out = [exercise for future, batch in futures.items() if future not in done for exercise in batch]
+        for exercise in timed_out:
+            finish(exercise, generate_ai_tip_rule_based(exercise))
+        
+        if timed_out:
+            print(f"{len(timed_out)} AI tips timed out, using rule-based tips")
+            if deadline is not None:
+                deadline.degrade('tips', f"{len(timed_out)} tips ran out of time")
+    finally:
+        # Don't hold up the response for requests that are still running
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    return exercises
 
 def alternate_exercises(exercise, preferred_equipment):
     """Generate alternative versions of exercises if equipment doesn't match"""
@@ -344,16 +538,26 @@ def alternate_exercises(exercise, preferred_equipment):
             
     return alt_exercises
 
-def generate_ai_workout_intent(query_text):
-    """Use AI to better understand the user's workout goals and constraints"""
+def generate_ai_workout_intent(query_text, return_cache_hit=False, timeout=None, deadline=None):
+    """
+    Use AI to better understand the user's workout goals and constraints.
+    Repeat phrasings are served from the intent cache. With return_cache_hit=True,
+    returns (intent, cache_hit). Failures are reported to `deadline` as degraded.
+    """
+    intent, cache_hit = None, False
     try:
-        api_key = os.environ.get("MISTRAL_API_KEY")
-        if not api_key:
+        gateway = get_gateway()
+        if not gateway.is_available():
             # Fall back to rule-based extraction if no API key
-            return None
+            return (None, False) if return_cache_hit else None
+        
+        model = gateway.model_for('intent')
+        cache_hit, intent = intent_cache.get('intent', query_text, model)
+        if cache_hit:
+            print("AI workout intent served from cache")
+            llm_metrics.record_outcome('intent', 'success', cache='hit')
+            return (intent, True) if return_cache_hit else intent
             
-        client = MistralClient(api_key=api_key)
-        
         prompt = f"""
         Analyze this workout request and extract the following information in JSON format:
         - goals: Primary fitness goals (e.g., strength, muscle gain, weight loss, endurance)
@@ -373,33 +577,37 @@ def generate_ai_workout_intent(query_text):
             ChatMessage(role="user", content=prompt)
         ]
         
-        response = client.chat(
-            model="mistral-tiny",
-            messages=messages
-        )
+        content = gateway.complete('intent', messages, timeout=timeout)
         
-        import json
         try:
-            result = json.loads(response.choices[0].message.content)
-            return result
+            intent = json.loads(content)
+            intent_cache.set('intent', query_text, intent, model)
+            llm_metrics.record_outcome('intent', 'success', cache='miss')
         except:
             print("Failed to parse AI workout intent response")
-            return None
+            llm_metrics.record_outcome('intent', 'parse_failure', cache='miss')
+            report_fallback(deadline, 'ai_intent', "unparseable response, using rule-based params")
+            intent = None
             
     except Exception as e:
         print(f"Error generating AI workout intent: {str(e)}")
-        return None
+        llm_metrics.record_outcome('intent', 'fallback', cache='miss')
+        report_fallback(deadline, 'ai_intent', str(e))
+        intent = None
+    
+    return (intent, cache_hit) if return_cache_hit else intent
 
-def ai_enhance_workout_plan(draft_plan, user_query):
-    """Use AI to enhance a draft workout plan with more personalized recommendations"""
+def request_workout_enhancement(draft_plan, user_query, timeout=None, deadline=None):
+    """
+    Ask the AI for improvements to a draft workout plan. Returns the parsed enhancements
+    or None. Failures are reported to `deadline` as degraded.
+    """
     try:
-        api_key = os.environ.get("MISTRAL_API_KEY")
-        if not api_key:
-            # Return original plan if no API key
-            return draft_plan
+        gateway = get_gateway()
+        if not gateway.is_available():
+            # Leave the original plan as is if no API key
+            return None
             
-        client = MistralClient(api_key=api_key)
-        
         # Prepare a condensed version of the draft plan
         days_overview = []
         for day in draft_plan.get('workout_days', []):
@@ -428,12 +636,12 @@ def ai_enhance_workout_plan(draft_plan, user_query):
         3. Progression plan - how the user should progress over time
         
         Return ONLY a JSON with these fields:
-        {
+        {{
             "exercise_ordering": [list of suggestions],
             "workout_structure": [list of suggestions],
             "progression_plan": [list of suggestions],
             "training_tips": [list of overall tips]
-        }
+        }}
         """
         
         messages = [
@@ -441,50 +649,75 @@ def ai_enhance_workout_plan(draft_plan, user_query):
             ChatMessage(role="user", content=prompt)
         ]
         
-        response = client.chat(
-            model="mistral-tiny",
-            messages=messages
-        )
+        content = gateway.complete('enhancement', messages, timeout=timeout)
         
         try:
-            enhancements = json.loads(response.choices[0].message.content)
-            
-            # Add the AI enhancements to the workout plan
-            draft_plan['ai_enhancements'] = enhancements
-            
-            # Apply some of the structural enhancements directly
-            if enhancements.get('workout_structure'):
-                for day in draft_plan.get('workout_days', []):
-                    structure_note = f"Coach's Note: {enhancements['workout_structure'][0]}" if enhancements['workout_structure'] else ""
-                    day['structure_note'] = structure_note
-            
-            # Add progression guidance
-            if enhancements.get('progression_plan'):
-                draft_plan['progression_guidance'] = enhancements['progression_plan']
-                
-            # Add overall training tips
-            if enhancements.get('training_tips'):
-                draft_plan['training_tips'] = enhancements['training_tips']
-                
-            return draft_plan
-            
+            enhancements = json.loads(content)
+            llm_metrics.record_outcome('enhancement', 'success')
+            return enhancements
         except Exception as inner_e:
             print(f"Failed to parse AI enhancements: {str(inner_e)}")
-            return draft_plan
+            llm_metrics.record_outcome('enhancement', 'parse_failure')
+            report_fallback(deadline, 'enhancement', "unparseable response")
+            return None
             
     except Exception as e:
         print(f"Error enhancing workout plan with AI: {str(e)}")
-        return draft_plan
+        llm_metrics.record_outcome('enhancement', 'fallback')
+        report_fallback(deadline, 'enhancement', str(e))
+        return None
 
-def extract_customization_intent(query_text):
-    """Use AI to extract specific customization instructions from the query"""
+def apply_workout_enhancement(draft_plan, enhancements):
+    """Merge AI enhancements into a workout plan"""
+    if not enhancements:
+        return draft_plan
+    
     try:
-        api_key = os.environ.get("MISTRAL_API_KEY")
-        if not api_key:
-            return None
+        # Add the AI enhancements to the workout plan
+        draft_plan['ai_enhancements'] = enhancements
+        
+        # Apply some of the structural enhancements directly
+        if enhancements.get('workout_structure'):
+            for day in draft_plan.get('workout_days', []):
+                structure_note = f"Coach's Note: {enhancements['workout_structure'][0]}" if enhancements['workout_structure'] else ""
+                day['structure_note'] = structure_note
+        
+        # Add progression guidance
+        if enhancements.get('progression_plan'):
+            draft_plan['progression_guidance'] = enhancements['progression_plan']
             
-        client = MistralClient(api_key=api_key)
+        # Add overall training tips
+        if enhancements.get('training_tips'):
+            draft_plan['training_tips'] = enhancements['training_tips']
+            
+    except Exception as e:
+        print(f"Failed to apply AI enhancements: {str(e)}")
         
+    return draft_plan
+
+def ai_enhance_workout_plan(draft_plan, user_query):
+    """Use AI to enhance a draft workout plan with more personalized recommendations"""
+    return apply_workout_enhancement(draft_plan, request_workout_enhancement(draft_plan, user_query))
+
+def extract_customization_intent(query_text, return_cache_hit=False, timeout=None, deadline=None):
+    """
+    Use AI to extract specific customization instructions from the query.
+    Repeat phrasings are served from the intent cache. With return_cache_hit=True,
+    returns (customization, cache_hit). Failures are reported to `deadline` as degraded.
+    """
+    customization, cache_hit = None, False
+    try:
+        gateway = get_gateway()
+        if not gateway.is_available():
+            return (None, False) if return_cache_hit else None
+        
+        model = gateway.model_for('customization_intent')
+        cache_hit, customization = intent_cache.get('customization', query_text, model)
+        if cache_hit:
+            print("Customization intent served from cache")
+            llm_metrics.record_outcome('customization_intent', 'success', cache='hit')
+            return (customization, True) if return_cache_hit else customization
+            
         prompt = f"""
         Extract any special customization instructions or specific workout modifications from this user query.
         
@@ -501,32 +734,35 @@ def extract_customization_intent(query_text):
             ChatMessage(role="user", content=prompt)
         ]
         
-        response = client.chat(
-            model="mistral-tiny",
-            messages=messages
-        )
+        content = gateway.complete('customization_intent', messages, timeout=timeout)
         
-        customization = response.choices[0].message.content.strip()
+        customization = content.strip()
         if customization.lower() == "none":
-            return None
-        return customization
+            customization = None
+        intent_cache.set('customization', query_text, customization, model)
+        llm_metrics.record_outcome('customization_intent', 'success', cache='miss')
         
     except Exception as e:
         print(f"Error extracting customization intent: {str(e)}")
-        return None
+        llm_metrics.record_outcome('customization_intent', 'fallback', cache='miss')
+        report_fallback(deadline, 'customization', str(e))
+        customization = None
+    
+    return (customization, cache_hit) if return_cache_hit else customization
 
-def apply_workout_customization(workout_plan, customization_text, user_query):
-    """Apply specific customization to a workout plan using AI"""
+def request_workout_customization(workout_plan, customization_text, user_query, timeout=None, deadline=None):
+    """
+    Ask the AI how to customize a workout plan. Returns the parsed modifications or
+    None. Failures are reported to `deadline` as degraded.
+    """
     if not customization_text:
-        return workout_plan
+        return None
         
     try:
-        api_key = os.environ.get("MISTRAL_API_KEY")
-        if not api_key:
-            return workout_plan
+        gateway = get_gateway()
+        if not gateway.is_available():
+            return None
             
-        client = MistralClient(api_key=api_key)
-        
         # Convert the workout plan to a simple format to reduce token usage
         simplified_plan = {
             "level": workout_plan.get("level", ""),
@@ -572,588 +808,830 @@ def apply_workout_customization(workout_plan, customization_text, user_query):
             ChatMessage(role="user", content=prompt)
         ]
         
-        response = client.chat(
-            model="mistral-tiny",
-            messages=messages
-        )
+        content = gateway.complete('customization', messages, timeout=timeout)
         
         try:
-            customizations = json.loads(response.choices[0].message.content)
-            
-            # Add the customization details to the plan
-            workout_plan["customization"] = {
-                "request": customization_text,
-                "modifications": customizations
-            }
-            
-            # If we have progression guidance from earlier enhancements, combine them
-            if workout_plan.get("progression_guidance") and customizations.get("structure_changes"):
-                workout_plan["progression_guidance"].extend(customizations.get("structure_changes", []))
-            
-            # Add special considerations as training tips
-            if customizations.get("special_considerations"):
-                if not workout_plan.get("training_tips"):
-                    workout_plan["training_tips"] = []
-                workout_plan["training_tips"].extend(customizations.get("special_considerations", []))
-            
-            # Update the plan overview to mention customization
-            if workout_plan.get("plan_overview"):
-                workout_plan["plan_overview"] += f" This plan has been customized: {customization_text}"
-                
-            return workout_plan
-            
+            customizations = json.loads(content)
+            llm_metrics.record_outcome('customization', 'success')
+            return customizations
         except Exception as inner_e:
             print(f"Failed to parse customization response: {str(inner_e)}")
-            return workout_plan
+            llm_metrics.record_outcome('customization', 'parse_failure')
+            report_fallback(deadline, 'customization_request', "unparseable response")
+            return None
             
     except Exception as e:
         print(f"Error applying customization: {str(e)}")
+        llm_metrics.record_outcome('customization', 'fallback')
+        report_fallback(deadline, 'customization_request', str(e))
+        return None
+
+def merge_workout_customization(workout_plan, customization_text, customizations):
+    """Merge AI customization recommendations into a workout plan"""
+    if not customization_text or not customizations:
         return workout_plan
+    
+    # Add the customization details to the plan
+    workout_plan["customization"] = {
+        "request": customization_text,
+        "modifications": customizations
+    }
+    
+    # If we have progression guidance from earlier enhancements, combine them
+    if workout_plan.get("progression_guidance") and customizations.get("structure_changes"):
+        workout_plan["progression_guidance"].extend(customizations.get("structure_changes", []))
+    
+    # Add special considerations as training tips
+    if customizations.get("special_considerations"):
+        if not workout_plan.get("training_tips"):
+            workout_plan["training_tips"] = []
+        workout_plan["training_tips"].extend(customizations.get("special_considerations", []))
+    
+    # Update the plan overview to mention customization
+    if workout_plan.get("plan_overview"):
+        workout_plan["plan_overview"] += f" This plan has been customized: {customization_text}"
+        
+    return workout_plan
+
+def apply_workout_customization(workout_plan, customization_text, user_query):
+    """Apply specific customization to a workout plan using AI"""
+    customizations = request_workout_customization(workout_plan, customization_text, user_query)
+    return merge_workout_customization(workout_plan, customization_text, customizations)
 
-def generate_workout_plan(query_text):
+def extract_rule_based_params(query_text):
+    """Extract plan parameters from the query without any AI assistance"""
+    fitness_level = "beginner"  # Default
+    if "intermediate" in query_text.lower():
+        fitness_level = "intermediate"
+    elif "advanced" in query_text.lower():
+        fitness_level = "advanced"
+    
+    days_per_week = 3  # Default
+    days_per_week_match = re.search(r'(\d+)\s*days\s*per\s*week', query_text)
+    if days_per_week_match:
+        days_per_week = int(days_per_week_match.group(1))
+    
+    time_available = 30  # Default
+    time_match = re.search(r'(\d+)\s*minutes', query_text)
+    if time_match:
+        time_available = int(time_match.group(1))
+    
+    # Equipment, exclusivity and body parts all come from a single matcher pass
+    match = INTENT_MATCHER.match(query_text)
+    
+    return {
+        'fitness_level': fitness_level,
+        'days_per_week': min(days_per_week, 6),  # Cap at 6 days
+        'time_available': time_available,
+        'preferred_body_parts': match.body_parts,
+        'preferred_equipment': match.equipment,
+        'is_exclusive': match.is_exclusive,
+        'no_equipment_only': match.no_equipment_only
+    }
+
+def resolve_workout_params(ai_intent, rule_params):
     """
-    Generate a workout plan based on the user's query using Elasticsearch and AI enhancements
+    Combine the AI intent (when available) with the rule-based parameters.
+    AI-detected values win; anything the AI didn't provide falls back to the rules.
     """
-    try:
-        # Extract any specific customization instructions
-        customization_text = extract_customization_intent(query_text)
-        if customization_text:
-            print(f"Detected customization request: {customization_text}")
-            
-        # Try to use AI to better understand the user's intent
-        ai_intent = generate_ai_workout_intent(query_text)
-        
-        # Initialize Elasticsearch client
-        es = Elasticsearch("http://elasticsearch:9200")
-        
-        # Extract key information from the query (with AI assistance if available)
-        fitness_level = "beginner"  # Default
-        if ai_intent and ai_intent.get('fitness_level'):
-            fitness_level = ai_intent.get('fitness_level')
-        elif "intermediate" in query_text.lower():
-            fitness_level = "intermediate"
-        elif "advanced" in query_text.lower():
-            fitness_level = "advanced"
-        
-        # Extract days per week from query
+    # Extract key information from the query (with AI assistance if available)
+    fitness_level = rule_params['fitness_level']
+    if ai_intent and ai_intent.get('fitness_level'):
+        fitness_level = ai_intent.get('fitness_level')
+    
+    # Extract days per week from query
+    days_per_week = rule_params['days_per_week']
+    if ai_intent and ai_intent.get('schedule_constraints'):
+        # Try to extract from AI intent
         days_per_week = 3  # Default
-        if ai_intent and ai_intent.get('schedule_constraints'):
-            # Try to extract from AI intent
-            try:
-                days_per_week = int(ai_intent.get('schedule_constraints'))
-            except:
-                pass
-        else:
-            # Fallback to regex extraction
-            days_per_week_pattern = r'(\d+)\s*days\s*per\s*week'
-            days_per_week_match = re.search(days_per_week_pattern, query_text)
-            if days_per_week_match:
-                days_per_week = int(days_per_week_match.group(1))
-        
-        days_per_week = min(days_per_week, 6)  # Cap at 6 days
-        
-        # Extract time available
+        try:
+            days_per_week = int(ai_intent.get('schedule_constraints'))
+        except:
+            pass
+    
+    days_per_week = min(days_per_week, 6)  # Cap at 6 days
+    
+    # Extract time available
+    time_available = rule_params['time_available']
+    if ai_intent and ai_intent.get('time_constraints'):
+        # Try to extract from AI intent
         time_available = 30  # Default
-        if ai_intent and ai_intent.get('time_constraints'):
-            # Try to extract from AI intent
-            try:
-                time_available = int(ai_intent.get('time_constraints'))
-            except:
-                pass
+        try:
+            time_available = int(ai_intent.get('time_constraints'))
+        except:
+            pass
+    
+    # Extract preferred body parts (with AI assistance if available)
+    preferred_body_parts = rule_params['preferred_body_parts']
+    if ai_intent and ai_intent.get('focus_areas'):
+        preferred_body_parts = ai_intent.get('focus_areas')
+    
+    # Extract equipment preferences with advanced matching
+    preferred_equipment = rule_params['preferred_equipment']
+    is_exclusive = rule_params['is_exclusive']
+    no_equipment_only = rule_params['no_equipment_only']
+    
+    if ai_intent and ai_intent.get('equipment_constraints'):
+        # Parse AI-detected equipment constraints
+        equipment_constraints = ai_intent.get('equipment_constraints')
+        
+        # Handle different return types (string or list)
+        if isinstance(equipment_constraints, list):
+            # Join the list into a single string for processing
+            equipment_constraints_text = ' '.join(equipment_constraints).lower()
         else:
-            # Fallback to regex extraction
-            time_pattern = r'(\d+)\s*minutes'
-            time_match = re.search(time_pattern, query_text)
-            if time_match:
-                time_available = int(time_match.group(1))
-        
-        # Extract preferred body parts (with AI assistance if available)
-        preferred_body_parts = []
-        if ai_intent and ai_intent.get('focus_areas'):
-            preferred_body_parts = ai_intent.get('focus_areas')
+            # It's likely a string, but make sure
+            equipment_constraints_text = str(equipment_constraints).lower()
+        
+        # Check for no equipment scenario
+        if any(phrase in equipment_constraints_text for phrase in ["no equipment", "bodyweight only", "calisthenics"]):
+            preferred_equipment = ['Body Only']
+            is_exclusive = True
+            no_equipment_only = True
         else:
-            preferred_body_parts = extract_body_parts(query_text)
-        
-        # Extract equipment preferences with advanced matching
-        preferred_equipment = []
-        is_exclusive = False
-        no_equipment_only = False
-        
-        if ai_intent and ai_intent.get('equipment_constraints'):
-            # Parse AI-detected equipment constraints
-            equipment_constraints = ai_intent.get('equipment_constraints')
-            
-            # Handle different return types (string or list)
-            if isinstance(equipment_constraints, list):
-                # Join the list into a single string for processing
-                equipment_constraints_text = ' '.join(equipment_constraints).lower()
-            else:
-                # It's likely a string, but make sure
-                equipment_constraints_text = str(equipment_constraints).lower()
+            # Extract equipment from AI analysis
+            detected_equipment = []
+            for equip_key, equip_data in EQUIPMENT_MAPPING.items():
+                if equip_key in equipment_constraints_text or any(syn in equipment_constraints_text for syn in equip_data['synonyms']):
+                    detected_equipment.append(equip_data['name'])
             
-            # Check for no equipment scenario
-            if any(phrase in equipment_constraints_text for phrase in ["no equipment", "bodyweight only", "calisthenics"]):
-                preferred_equipment = ['Body Only']
-                is_exclusive = True
-                no_equipment_only = True
-            else:
-                # Extract equipment from AI analysis
-                detected_equipment = []
-                for equip_key, equip_data in EQUIPMENT_MAPPING.items():
-                    if equip_key in equipment_constraints_text or any(syn in equipment_constraints_text for syn in equip_data['synonyms']):
-                        detected_equipment.append(equip_data['name'])
-                
-                if detected_equipment:
-                    preferred_equipment = detected_equipment
-                    is_exclusive = "only" in equipment_constraints_text or "just" in equipment_constraints_text
-                else:
-                    # Fallback to normal extraction
-                    preferred_equipment, is_exclusive, no_equipment_only = extract_equipment(query_text)
-        else:
-            # Fallback to normal extraction
-            preferred_equipment, is_exclusive, no_equipment_only = extract_equipment(query_text)
-        
-        # Log equipment detection results for debugging
-        print(f"Equipment detection: {preferred_equipment}, exclusive: {is_exclusive}, no_equipment: {no_equipment_only}")
-        if ai_intent:
-            print(f"AI intent detected: {ai_intent}")
-        
-        # Prepare search query
-        search_query = query_text
-        if preferred_body_parts:
-            search_query += " " + " ".join(preferred_body_parts)
-        
-        # CRUCIAL IMPROVEMENT: Use a more sophisticated Elasticsearch query
-        # Add specific queries for equipment to ensure we get relevant exercises
-        should_clauses = []
+            if detected_equipment:
+                preferred_equipment = detected_equipment
+                is_exclusive = "only" in equipment_constraints_text or "just" in equipment_constraints_text
+    
+    # Log equipment detection results for debugging
+    print(f"Equipment detection: {preferred_equipment}, exclusive: {is_exclusive}, no_equipment: {no_equipment_only}")
+    if ai_intent:
+        print(f"AI intent detected: {ai_intent}")
+    
+    return {
+        'fitness_level': fitness_level,
+        'days_per_week': days_per_week,
+        'time_available': time_available,
+        'preferred_body_parts': preferred_body_parts,
+        'preferred_equipment': preferred_equipment,
+        'is_exclusive': is_exclusive,
+        'no_equipment_only': no_equipment_only
+    }
+
+def run_workout_search(es, body, catalog=None):
+    """Run a workouts query against the in-memory catalog when available, otherwise Elasticsearch"""
+    if catalog is not None:
+        try:
+            return catalog.search(body)
+        except UnsupportedQuery as e:
+            print(f"Catalog can't serve query, using Elasticsearch: {str(e)}")
+    return es.search(index="workouts", body=body)
+
+def run_workout_msearch(es, bodies, catalog=None):
+    """
+    Run several workouts queries in a single Elasticsearch multi-search, or
+    against the in-memory catalog. Returns one result per body, in order.
+    A query that fails comes back with no hits.
+    """
+    results = [None] * len(bodies)
+    remote = list(range(len(bodies)))
+    if catalog is not None:
+        remote = []
+        for i, body in enumerate(bodies):
+            try:
+                results[i] = catalog.search(body)
+            except UnsupportedQuery as e:
+                print(f"Catalog can't serve query, using Elasticsearch: {str(e)}")
+                remote.append(i)
+    
+    if remote:
+        searches = []
+        for i in remote:
+            searches.extend([{"index": "workouts"}, bodies[i]])
+        responses = es.msearch(searches=searches)['responses']
+        for i, response in zip(remote, responses):
+            if 'error' in response:
+                print(f"Multi-search query failed: {response['error']}")
+                response = {'hits': {'hits': []}}
+            results[i] = response
+    
+    return results
+
+def search_workouts(es, query_text, params, catalog=None):
+    """
+    Retrieve and score candidate exercises from the exercise catalog (or
+    Elasticsearch), relaxing constraints when too few matches are found.
+    Returns a CandidatePool of the workouts keyed by document id.
+    """
+    days_per_week = params['days_per_week']
+    preferred_body_parts = params['preferred_body_parts']
+    preferred_equipment = params['preferred_equipment']
+    is_exclusive = params['is_exclusive']
+    no_equipment_only = params['no_equipment_only']
+    
+    # Prepare search query
+    search_query = query_text
+    if preferred_body_parts:
+        search_query += " " + " ".join(preferred_body_parts)
+    
+    # CRUCIAL IMPROVEMENT: Use a more sophisticated Elasticsearch query
+    # Add specific queries for equipment to ensure we get relevant exercises
+    should_clauses = []
+    
+    # Add title and description match
+    should_clauses.extend([
+        {"match": {"Title": {"query": search_query, "boost": 2}}},
+        {"match": {"Description": {"query": search_query, "boost": 1}}}
+    ])
+    
+    # Add equipment specific boosts
+    for equipment in preferred_equipment:
+        should_clauses.append({"match": {"Equipment": {"query": equipment, "boost": 3}}})
         
-        # Add title and description match
+    # For body-only/no equipment, specifically include exercises with no equipment
+    if no_equipment_only or 'Body Only' in preferred_equipment:
         should_clauses.extend([
-            {"match": {"Title": {"query": search_query, "boost": 2}}},
-            {"match": {"Description": {"query": search_query, "boost": 1}}}
+            {"match": {"Equipment": {"query": "Body Only", "boost": 3}}},
+            {"match": {"Equipment": {"query": "None", "boost": 3}}}
         ])
-        
-        # Add equipment specific boosts
-        for equipment in preferred_equipment:
-            should_clauses.append({"match": {"Equipment": {"query": equipment, "boost": 3}}})
-            
-        # For body-only/no equipment, specifically include exercises with no equipment
-        if no_equipment_only or 'Body Only' in preferred_equipment:
-            should_clauses.extend([
-                {"match": {"Equipment": {"query": "Body Only", "boost": 3}}},
-                {"match": {"Equipment": {"query": "None", "boost": 3}}}
-            ])
-        
-        # Construct final query
-        query = {
-            "size": 500,  # Get much more results to ensure we have enough
-            "query": {
-                "bool": {
-                    "should": should_clauses,
-                    "minimum_should_match": 1
-                }
+    
+    # Construct final query
+    query = {
+        "size": 500,  # Get much more results to ensure we have enough
+        "query": {
+            "bool": {
+                "should": should_clauses,
+                "minimum_should_match": 1
             }
         }
-        
-        # Execute the enhanced query
-        result = es.search(index="workouts", body=query)
-        
-        # Extract and format the workout plan
-        hits = result['hits']['hits']
-        
-        # IMPROVED: More intelligent filtering
-        filtered_hits = []
-        for hit in hits:
-            workout = hit['_source']
-            exercise_equipment = workout.get('Equipment', '')
-            
-            # We'll score each exercise to decide inclusion
-            # Base inclusion on compatibility BUT with intelligent scoring
-            inclusion_score = 0
-            
-            # Direct equipment match is best
-            if exercise_equipment in preferred_equipment:
-                inclusion_score += 10
-                
-            # For "no equipment" queries, bodyweight is perfect
-            if no_equipment_only and (exercise_equipment == 'Body Only' or exercise_equipment == 'None'):
-                inclusion_score += 15
-                
-            # For bodyweight filter, slightly broader match criteria
-            if 'Body Only' in preferred_equipment and exercise_equipment in ['None', 'Body Only', 'Bands', 'Medicine Ball']:
-                inclusion_score += 8
-            
-            # Check body part preferences
-            if preferred_body_parts:
-                body_part = workout.get('BodyPart', '')
-                if any(part.lower() in body_part.lower() for part in preferred_body_parts):
-                    inclusion_score += 5
-                    
-            # If exclusive mode is on, require minimum score with equipment contribution
-            if is_exclusive or no_equipment_only:
-                if inclusion_score < 5 or (inclusion_score <= 8 and not any(
-                    exercise_equipment in equip or equip in exercise_equipment for equip in preferred_equipment
-                )):
-                    continue
-            
-            # Always add items with decent score
-            if inclusion_score > 0:
-                # Add score to workout for sorting
-                workout['inclusion_score'] = inclusion_score
-                filtered_hits.append((workout, inclusion_score))
-        
-        # Sort by inclusion score
-        filtered_hits.sort(key=lambda x: x[1], reverse=True)
-        filtered_hits = [hit[0] for hit in filtered_hits]
-        
-        # IMPORTANT: Before falling back completely, make sure we have bodyweight alternatives
-        if len(filtered_hits) < days_per_week * 2 and ('Body Only' in preferred_equipment or no_equipment_only):
-            print(f"Not enough exercises found ({len(filtered_hits)}), using adaptive search...")
-            
-            # Use a dedicated bodyweight exercise search
-            bodyweight_query = {
-                "size": 200,
-                "query": {
-                    "bool": {
-                        "must": [
-                            {"match": {"Equipment": "Body Only"}}
-                        ]
-                    }
-                }
-            }
-            
-            # Add body parts if specified
-            if preferred_body_parts:
-                should_body_parts = []
-                for part in preferred_body_parts:
-                    should_body_parts.append({"match": {"BodyPart": part}})
-                
-                if should_body_parts:
-                    bodyweight_query["query"]["bool"]["should"] = should_body_parts
-            
-            bodyweight_result = es.search(index="workouts", body=bodyweight_query)
-            bodyweight_hits = bodyweight_result['hits']['hits']
-            
-            # Add bodyweight exercises to results
-            for hit in bodyweight_hits:
-                if hit['_source'] not in filtered_hits:
-                    hit['_source']['inclusion_score'] = 5  # Lower priority than direct matches
-                    filtered_hits.append(hit['_source'])
-                    
-            print(f"Added bodyweight exercises, new count: {len(filtered_hits)}")
-        
-        # MUST HAVE: Ensure we have enough exercises by intelligently relaxing constraints
-        if len(filtered_hits) < days_per_week * 2:
-            # Final fallback - search for common bodyweight exercises by name
-            basic_exercises = ["push up", "squat", "lunge", "plank", "crunch", "mountain climber", 
-                               "jumping jack", "burpee", "sit up", "pull up", "dip"]
-            
-            additional_hits = []
+    }
+    
+    # Execute the enhanced query
+    result = run_workout_search(es, query, catalog)
+    
+    # Extract and format the workout plan
+    hits = result['hits']['hits']
+    
+    # IMPROVED: More intelligent filtering
+    scored_hits = []
+    for hit in hits:
+        workout = hit['_source']
+        exercise_equipment = workout.get('Equipment', '')
+        
+        # We'll score each exercise to decide inclusion
+        # Base inclusion on compatibility BUT with intelligent scoring
+        inclusion_score = 0
+        
+        # Direct equipment match is best
+        if exercise_equipment in preferred_equipment:
+            inclusion_score += 10
             
-            for exercise_name in basic_exercises:
-                basic_query = {
-                    "size": 5,
-                    "query": {
-                        "bool": {
-                            "should": [
-                                {"match": {"Title": {"query": exercise_name, "boost": 3}}},
-                                {"match": {"Description": {"query": exercise_name, "boost": 1}}}
-                            ],
-                            "minimum_should_match": 1
-                        }
-                    }
-                }
-                
-                result = es.search(index="workouts", body=basic_query)
-                for hit in result['hits']['hits']:
-                    if hit['_source'] not in filtered_hits and hit['_source'] not in additional_hits:
-                        hit['_source']['inclusion_score'] = 3  # Even lower priority
-                        additional_hits.append(hit['_source'])
+        # For "no equipment" queries, bodyweight is perfect
+        if no_equipment_only and (exercise_equipment == 'Body Only' or exercise_equipment == 'None'):
+            inclusion_score += 15
             
-            filtered_hits.extend(additional_hits)
-            print(f"Added common exercises by name search, new count: {len(filtered_hits)}")
+        # For bodyweight filter, slightly broader match criteria
+        if 'Body Only' in preferred_equipment and exercise_equipment in ['None', 'Body Only', 'Bands', 'Medicine Ball']:
+            inclusion_score += 8
         
-        # Organize workouts by body part with strict equipment validation but ensuring good coverage
-        workouts_by_body_part = defaultdict(list)
-        
-        # Function to determine equipment compatibility with more flexibility
-        def is_compatible_for_organization(equipment, user_equipment, is_exclusive, no_equipment_only):
-            if not is_exclusive and not no_equipment_only:
-                return True
-                
-            if no_equipment_only:
-                return equipment == 'Body Only' or equipment == 'None'
+        # Check body part preferences
+        if preferred_body_parts:
+            body_part = workout.get('BodyPart', '')
+            if any(part.lower() in body_part.lower() for part in preferred_body_parts):
+                inclusion_score += 5
                 
-            if is_exclusive:
-                # Direct match
-                if equipment in user_equipment:
-                    return True
-                    
-                # None/Body Only equivalence
-                if equipment == 'None' and 'Body Only' in user_equipment:
-                    return True
-                if equipment == 'Body Only' and 'None' in user_equipment:
-                    return True
-                    
-                # Category match (e.g. Bands and Resistance Tube)
-                for category, equipments in EQUIPMENT_CATEGORIES.items():
-                    if equipment in equipments:
-                        for user_eq in user_equipment:
-                            if user_eq in equipments:
-                                return True
-                                
-            return False
-        
-        # First pass: strict filtering
-        for workout in filtered_hits:
-            equipment = workout.get('Equipment', '')
-            
-            if is_compatible_for_organization(equipment, preferred_equipment, is_exclusive, no_equipment_only):
-                body_part = workout.get('BodyPart', 'General')
-                workouts_by_body_part[body_part].append(workout)
-        
-        # Check if we have enough exercises after organization
-        total_organized = sum(len(workouts) for workouts in workouts_by_body_part.values())
-        
-        # If we don't have enough for a good split, add additional exercises
-        if total_organized < days_per_week * 3:
-            print(f"Not enough exercises after organization, adding more flexible matches...")
-            for workout in filtered_hits:
-                if workout not in [w for workouts in workouts_by_body_part.values() for w in workouts]:
-                    body_part = workout.get('BodyPart', 'General')
-                    workouts_by_body_part[body_part].append(workout)
-        
-        # Determine workout split based on days per week
-        if days_per_week <= 2:
-            # Full body workouts
-            split_type = "full body"
-            day_splits = ["Full Body"] * days_per_week
-        elif days_per_week == 3:
-            # Push/Pull/Legs split
-            split_type = "push/pull/legs"
-            day_splits = ["Push", "Pull", "Legs"]
-        elif days_per_week == 4:
-            # Upper/Lower split
-            split_type = "upper/lower"
-            day_splits = ["Upper", "Lower", "Upper", "Lower"]
-        else:
-            # Body part split
-            split_type = "body part"
-            day_splits = ["Chest", "Back", "Legs", "Shoulders", "Arms", "Core"][:days_per_week]
-        
-        # Create structured workout plan
-        workout_days = []
+        # If exclusive mode is on, require minimum score with equipment contribution
+        if is_exclusive or no_equipment_only:
+            if inclusion_score < 5 or (inclusion_score <= 8 and not any(
+                exercise_equipment in equip or equip in exercise_equipment for equip in preferred_equipment
+            )):
+                continue
+        
+        # Always add items with decent score
+        if inclusion_score > 0:
+            scored_hits.append((hit['_id'], workout, inclusion_score))
+    
+    # The pool keeps candidates sorted by inclusion score and deduplicated by id
+    pool = CandidatePool()
+    for doc_id, workout, inclusion_score in scored_hits:
+        pool.add(doc_id, workout, inclusion_score)
+    
+    # Not enough matches: plan every fallback query up front
+    if len(pool) < days_per_week * 2:
+        print(f"Not enough exercises found ({len(pool)}), using adaptive search...")
+        fallbacks = plan_fallback_queries(params)
+        bodies = [body for _, _, body in fallbacks]
         
-        # Final safety check - ensure we have SOMETHING for each day
-        all_workouts = [w for workouts in workouts_by_body_part.values() for w in workouts]
+        # Served from the pools precomputed from the catalog; search only if they can't be built
+        try:
+            results = get_fallback_pools(catalog).search_all(bodies)
+        except Exception as e:
+            print(f"Fallback pools unavailable, searching instead: {str(e)}")
+            results = run_workout_msearch(es, bodies, catalog)
+        
+        # Merge in priority order, stopping once there are enough exercises
+        for kind in ('bodyweight', 'basic'):
+            if len(pool) >= days_per_week * 2:
+                break
+            kind_results = [(score, result) for (query_kind, score, _), result in zip(fallbacks, results)
+                            if query_kind == kind]
+            if not kind_results:
+                continue
+            for score, result in kind_results:
+                for hit in result['hits']['hits']:
+                    pool.add(hit['_id'], hit['_source'], score)
+            
+            if kind == 'bodyweight':
+                print(f"Added bodyweight exercises, new count: {len(pool)}")
+            else:
+                print(f"Added common exercises by name search, new count: {len(pool)}")
+    
+    return pool
+
+def is_compatible_for_organization(equipment, user_equipment, is_exclusive, no_equipment_only):
+    """Determine equipment compatibility with more flexibility"""
+    if not is_exclusive and not no_equipment_only:
+        return True
         
-        # Debugging: Print number of available exercises
-        print(f"Total organized workouts: {len(all_workouts)}")
-        print(f"Key body parts: {list(workouts_by_body_part.keys())[:5]}")
+    if no_equipment_only:
+        return equipment == 'Body Only' or equipment == 'None'
         
-        for day_idx, focus in enumerate(day_splits):
-            day_number = day_idx + 1
-            exercises = []
+    if is_exclusive:
+        # Direct match
+        if equipment in user_equipment:
+            return True
             
-            # Intelligent exercise selection adjusted for each focus
-            # [Similar to existing selection logic but with better fallbacks]
-            # For brevity, I'll add a streamlined selection process that ensures we get exercises
+        # None/Body Only equivalence
+        if equipment == 'None' and 'Body Only' in user_equipment:
+            return True
+        if equipment == 'Body Only' and 'None' in user_equipment:
+            return True
             
+        # Category match (e.g. Bands and Resistance Tube)
+        for category, equipments in EQUIPMENT_CATEGORIES.items():
+            if equipment in equipments:
+                for user_eq in user_equipment:
+                    if user_eq in equipments:
+                        return True
+                        
+    return False
+
+def organize_workouts(pool, params):
+    """
+    Organize workouts by body part with strict equipment validation but ensuring good coverage.
+    Returns body part -> list of candidate ids.
+    """
+    # First pass: strict filtering
+    organized = []
+    for doc_id in pool.ordered_ids():
+        equipment = pool.get(doc_id).get('Equipment', '')
+        
+        if is_compatible_for_organization(equipment, params['preferred_equipment'],
+                                          params['is_exclusive'], params['no_equipment_only']):
+            organized.append(doc_id)
+    
+    # If we don't have enough for a good split, add additional exercises
+    if len(organized) < params['days_per_week'] * 3:
+        print(f"Not enough exercises after organization, adding more flexible matches...")
+        organized_ids = set(organized)
+        organized.extend(doc_id for doc_id in pool.ordered_ids() if doc_id not in organized_ids)
+    
+    return pool.by_body_part(organized)
+
+def focus_terms(focus):
+    return tuple(FOCUS_GROUPS.get(focus, [focus.lower()]))
+
+@lru_cache(maxsize=1024)
+def terms_match_body_part(terms, body_part):
+    """Whether a catalog body part contains any of the terms (static, so cached across requests)"""
+    return any(term in body_part.lower() for term in terms)
+
+class FocusBuckets:
+    """
+    Candidate ids for each day focus, gathered and sorted by inclusion score
+    once per request. Every focus keeps a cursor into its bucket, so repeated
+    days (Upper/Lower twice) continue down the list rather than rescanning it,
+    and exercises already used on another day (the pool's used set) are skipped.
+    """
+
+    def __init__(self, pool, workouts_by_body_part):
+        self.pool = pool
+        self.workouts_by_body_part = workouts_by_body_part
+        self.buckets = {}
+        self.cursors = defaultdict(int)
+        self._general = None
+
+    def bucket(self, terms):
+        if terms not in self.buckets:
+            candidates = []
+            for body_part, doc_ids in self.workouts_by_body_part.items():
+                if terms_match_body_part(terms, body_part):
+                    candidates.extend(doc_ids)
+            self.buckets[terms] = self.pool.ordered_ids(candidates)
+        return self.buckets[terms]
+
+    def take(self, terms, count):
+        """The next `count` best ids for a focus, repeating its best ones once it runs out of fresh ones"""
+        bucket = self.bucket(terms)
+        taken = []
+        cursor = self.cursors[terms]
+        while cursor < len(bucket) and len(taken) < count:
+            doc_id = bucket[cursor]
+            cursor += 1
+            if not self.pool.is_used(doc_id):
+                taken.append(doc_id)
+        self.cursors[terms] = cursor
+
+        taken_ids = set(taken)
+        for doc_id in bucket:
+            if len(taken) >= count:
+                break
+            if doc_id not in taken_ids:
+                taken.append(doc_id)
+                taken_ids.add(doc_id)
+
+        self.pool.mark_used(taken)
+        return taken
+
+    def take_general(self, count, exclude=()):
+        """Top ids from the whole pool, for days whose focus has too few"""
+        if self._general is None:
+            self._general = self.pool.ordered_ids(
+                doc_id for doc_ids in self.workouts_by_body_part.values() for doc_id in doc_ids)
+        excluded = set(exclude)
+        taken = [doc_id for doc_id in self._general if doc_id not in excluded][:count]
+        self.pool.mark_used(taken)
+        return taken
+
+def select_workout_days(pool, workouts_by_body_part, params):
+    """Pick exercises for each day of the split from the candidate pool. Returns (split_type, workout_days)."""
+    days_per_week = params['days_per_week']
+    time_available = params['time_available']
+    
+    # Determine workout split based on days per week
+    if days_per_week <= 2:
+        # Full body workouts
+        split_type = "full body"
+        day_splits = ["Full Body"] * days_per_week
+    elif days_per_week == 3:
+        # Push/Pull/Legs split
+        split_type = "push/pull/legs"
+        day_splits = ["Push", "Pull", "Legs"]
+    elif days_per_week == 4:
+        # Upper/Lower split
+        split_type = "upper/lower"
+        day_splits = ["Upper", "Lower", "Upper", "Lower"]
+    else:
+        # Body part split
+        split_type = "body part"
+        day_splits = ["Chest", "Back", "Legs", "Shoulders", "Arms", "Core"][:days_per_week]
+    
+    # Create structured workout plan
+    workout_days = []
+    
+    # Final safety check - ensure we have SOMETHING for each day
+    total_workouts = sum(len(doc_ids) for doc_ids in workouts_by_body_part.values())
+    
+    # Debugging: Print number of available exercises
+    print(f"Total organized workouts: {total_workouts}")
+    print(f"Key body parts: {list(workouts_by_body_part.keys())[:5]}")
+    
+    buckets = FocusBuckets(pool, workouts_by_body_part)
+    
+    for day_idx, focus in enumerate(day_splits):
+        day_number = day_idx + 1
+        exercises = []
+        
+        # Each focus is a slice of its pre-sorted bucket, skipping exercises used on earlier days
+        if focus == "Full Body":
+            # Get a mix of exercises for different body parts
             selected_exercises = []
-            
-            # First try exact focus matches
-            if focus == "Full Body":
-                # Get a mix of exercises for different body parts
-                body_parts = ["Chest", "Back", "Legs", "Shoulders", "Arms", "Core"]
-                for part in body_parts:
-                    part_exercises = []
-                    for body_part, workouts in workouts_by_body_part.items():
-                        if part.lower() in body_part.lower():
-                            part_exercises.extend(workouts)
-                    
-                    # Take top scored exercises by part
-                    part_exercises.sort(key=lambda x: x.get('inclusion_score', 0), reverse=True)
-                    selected_exercises.extend(part_exercises[:max(1, min(2, time_available // 15))])
-            
-            elif focus == "Push":
-                push_exercises = []
-                for body_part, workouts in workouts_by_body_part.items():
-                    if any(part in body_part.lower() for part in ["chest", "shoulder", "tricep"]):
-                        push_exercises.extend(workouts)
-                
-                push_exercises.sort(key=lambda x: x.get('inclusion_score', 0), reverse=True)
-                selected_exercises.extend(push_exercises[:time_available // 5])
-            
-            elif focus == "Pull":
-                pull_exercises = []
-                for body_part, workouts in workouts_by_body_part.items():
-                    if any(part in body_part.lower() for part in ["back", "bicep"]):
-                        pull_exercises.extend(workouts)
-                
-                pull_exercises.sort(key=lambda x: x.get('inclusion_score', 0), reverse=True)
-                selected_exercises.extend(pull_exercises[:time_available // 5])
-            
-            elif focus == "Legs":
-                leg_exercises = []
-                for body_part, workouts in workouts_by_body_part.items():
-                    if any(part in body_part.lower() for part in ["leg", "quad", "hamstring", "glute", "calf"]):
-                        leg_exercises.extend(workouts)
-                
-                leg_exercises.sort(key=lambda x: x.get('inclusion_score', 0), reverse=True)
-                selected_exercises.extend(leg_exercises[:time_available // 5])
-            
-            elif focus == "Upper":
-                upper_exercises = []
-                for body_part, workouts in workouts_by_body_part.items():
-                    if any(part in body_part.lower() for part in ["chest", "back", "shoulder", "arm", "bicep", "tricep"]):
-                        upper_exercises.extend(workouts)
-                
-                upper_exercises.sort(key=lambda x: x.get('inclusion_score', 0), reverse=True)
-                selected_exercises.extend(upper_exercises[:time_available // 5])
-            
-            elif focus == "Lower":
-                lower_exercises = []
-                for body_part, workouts in workouts_by_body_part.items():
-                    if any(part in body_part.lower() for part in ["leg", "quad", "hamstring", "glute", "calf"]):
-                        lower_exercises.extend(workouts)
-                
-                lower_exercises.sort(key=lambda x: x.get('inclusion_score', 0), reverse=True)
-                selected_exercises.extend(lower_exercises[:time_available // 5])
-            
-            else:
-                # Specific body part
-                specific_exercises = []
-                for body_part, workouts in workouts_by_body_part.items():
-                    if focus.lower() in body_part.lower():
-                        specific_exercises.extend(workouts)
-                
-                specific_exercises.sort(key=lambda x: x.get('inclusion_score', 0), reverse=True)
-                selected_exercises.extend(specific_exercises[:time_available // 5])
-            
-            # CRITICAL: If we still don't have enough exercises for this day, take some from the general pool
-            if len(selected_exercises) < 3:
-                print(f"Not enough exercises for day {day_number}, using general pool")
-                remaining_exercises = [w for w in all_workouts if w not in selected_exercises]
-                remaining_exercises.sort(key=lambda x: x.get('inclusion_score', 0), reverse=True)
-                selected_exercises.extend(remaining_exercises[:3])
-            
-            # Format the final exercises for this day
-            for workout in selected_exercises[:time_available // 5]:  # Limit to reasonable number
-                exercises.append({
-                    'Title': workout.get('Title', ''),
-                    'Description': workout.get('Description', ''),
-                    'Type': workout.get('Type', ''),
-                    'Equipment': workout.get('Equipment', ''),
-                    'BodyPart': workout.get('BodyPart', ''),
-                    'Level': workout.get('Level', ''),
-                    'AI_Recommendations': generate_ai_tip(workout)
-                })
-            
-            # Only add day if we have exercises
-            if exercises:
-                body_parts = set([ex.get('BodyPart', '') for ex in exercises])
-                day_overview = f"Day {day_number}: {focus} Day - Focus on {', '.join(list(body_parts)[:3])}"
-                
-                workout_days.append({
-                    'day_number': day_number,
-                    'overview': day_overview,
-                    'exercises': exercises
-                })
-        
-        # ABSOLUTE LAST RESORT - Create basic workout if everything else failed
-        if not workout_days:
-            print("WARNING: All intelligent fallbacks failed. Using hardcoded basic workout.")
-            
-            bodyweight_exercises = [
-                {
-                    'Title': 'Push-ups',
-                    'Description': 'Basic bodyweight exercise for chest, shoulders, and triceps.',
-                    'Type': 'Strength',
-                    'Equipment': 'Body Only',
-                    'BodyPart': 'Chest',
-                    'Level': fitness_level,
-                    'AI_Recommendations': 'Keep your core tight and body in a straight line. Lower until elbows reach 90 degrees.'
-                },
-                {
-                    'Title': 'Squats',
-                    'Description': 'Fundamental lower body exercise targeting quadriceps, hamstrings, and glutes.',
-                    'Type': 'Strength',
-                    'Equipment': 'Body Only',
-                    'BodyPart': 'Quadriceps',
-                    'Level': fitness_level,
-                    'AI_Recommendations': 'Keep weight in your heels and knees tracking over toes. Descend until thighs are parallel to ground.'
-                },
-                {
-                    'Title': 'Planks',
-                    'Description': 'Core stabilization exercise engaging the entire midsection.',
-                    'Type': 'Strength',
-                    'Equipment': 'Body Only',
-                    'BodyPart': 'Abdominals',
-                    'Level': fitness_level,
-                    'AI_Recommendations': 'Maintain a straight line from head to heels. Engage your core and breathe normally.'
-                }
-            ]
+            for part in FULL_BODY_PARTS:
+                selected_exercises.extend(buckets.take((part.lower(),), max(1, min(2, time_available // 15))))
+        else:
+            selected_exercises = buckets.take(focus_terms(focus), time_available // 5)
+        
+        # CRITICAL: If we still don't have enough exercises for this day, take some from the general pool
+        if len(selected_exercises) < 3:
+            print(f"Not enough exercises for day {day_number}, using general pool")
+            selected_exercises.extend(buckets.take_general(3, exclude=selected_exercises))
+        
+        # Format the final exercises for this day (tips are filled in once all days are selected)
+        for doc_id in selected_exercises[:time_available // 5]:  # Limit to reasonable number
+            workout = pool.get(doc_id)
+            exercises.append({
+                'Title': workout.get('Title', ''),
+                'Description': workout.get('Description', ''),
+                'Type': workout.get('Type', ''),
+                'Equipment': workout.get('Equipment', ''),
+                'BodyPart': workout.get('BodyPart', ''),
+                'Level': workout.get('Level', ''),
+                'AI_Recommendations': None
+            })
+        
+        # Only add day if we have exercises
+        if exercises:
+            body_parts = set([ex.get('BodyPart', '') for ex in exercises])
+            day_overview = f"Day {day_number}: {focus} Day - Focus on {', '.join(list(body_parts)[:3])}"
             
             workout_days.append({
-                'day_number': 1,
-                'overview': 'Full Body Workout (FALLBACK - No matches found)',
-                'exercises': bodyweight_exercises
+                'day_number': day_number,
+                'overview': day_overview,
+                'exercises': exercises
             })
-            
-            # Ensure this is clearly marked as a fallback
-            days_per_week = 1
-            equipment_description = " (basic fallback workout)"
+    
+    return split_type, workout_days
+
+def build_draft_plan(params, split_type, workout_days):
+    """Assemble the draft plan, using a hardcoded basic workout if selection found nothing"""
+    fitness_level = params['fitness_level']
+    time_available = params['time_available']
+    preferred_body_parts = params['preferred_body_parts']
+    preferred_equipment = params['preferred_equipment']
+    is_exclusive = params['is_exclusive']
+    no_equipment_only = params['no_equipment_only']
+    
+    # ABSOLUTE LAST RESORT - Create basic workout if everything else failed
+    if not workout_days:
+        print("WARNING: All intelligent fallbacks failed. Using hardcoded basic workout.")
+        
+        bodyweight_exercises = [
+            {
+                'Title': 'Push-ups',
+                'Description': 'Basic bodyweight exercise for chest, shoulders, and triceps.',
+                'Type': 'Strength',
+                'Equipment': 'Body Only',
+                'BodyPart': 'Chest',
+                'Level': fitness_level,
+                'AI_Recommendations': 'Keep your core tight and body in a straight line. Lower until elbows reach 90 degrees.'
+            },
+            {
+                'Title': 'Squats',
+                'Description': 'Fundamental lower body exercise targeting quadriceps, hamstrings, and glutes.',
+                'Type': 'Strength',
+                'Equipment': 'Body Only',
+                'BodyPart': 'Quadriceps',
+                'Level': fitness_level,
+                'AI_Recommendations': 'Keep weight in your heels and knees tracking over toes. Descend until thighs are parallel to ground.'
+            },
+            {
+                'Title': 'Planks',
+                'Description': 'Core stabilization exercise engaging the entire midsection.',
+                'Type': 'Strength',
+                'Equipment': 'Body Only',
+                'BodyPart': 'Abdominals',
+                'Level': fitness_level,
+                'AI_Recommendations': 'Maintain a straight line from head to heels. Engage your core and breathe normally.'
+            }
+        ]
+        
+        workout_days = [{
+            'day_number': 1,
+            'overview': 'Full Body Workout (FALLBACK - No matches found)',
+            'exercises': bodyweight_exercises
+        }]
+        
+        # Ensure this is clearly marked as a fallback
+        equipment_description = " (basic fallback workout)"
+    else:
+        # Create equipment description for overview
+        if no_equipment_only:
+            equipment_description = " using only bodyweight exercises"
+        elif is_exclusive and preferred_equipment:
+            equipment_description = f" using only {', '.join(preferred_equipment)}"
+        elif preferred_equipment:
+            equipment_description = f" using {', '.join(preferred_equipment)}"
         else:
-            # Create equipment description for overview
-            if no_equipment_only:
-                equipment_description = " using only bodyweight exercises"
-            elif is_exclusive and preferred_equipment:
-                equipment_description = f" using only {', '.join(preferred_equipment)}"
-            elif preferred_equipment:
-                equipment_description = f" using {', '.join(preferred_equipment)}"
-            else:
-                equipment_description = ""
-        
-        # Create the draft response
-        draft_plan = {
-            'level': fitness_level,
-            'days_per_week': str(len(workout_days)),
-            'minutes_per_session': str(time_available),
-            'plan_overview': f"This {fitness_level} level workout plan follows a {split_type} split, designed for {len(workout_days)} days per week, with approximately {time_available} minutes per session{equipment_description}.{' Focus on ' + ', '.join(preferred_body_parts) + '.' if preferred_body_parts else ''}",
-            'workout_days': workout_days
-        }
+            equipment_description = ""
+    
+    # Create the draft response
+    return {
+        'level': fitness_level,
+        'days_per_week': str(len(workout_days)),
+        'minutes_per_session': str(time_available),
+        'plan_overview': f"This {fitness_level} level workout plan follows a {split_type} split, designed for {len(workout_days)} days per week, with approximately {time_available} minutes per session{equipment_description}.{' Focus on ' + ', '.join(preferred_body_parts) + '.' if preferred_body_parts else ''}",
+        'workout_days': workout_days
+    }
+
+def generate_tips_for_plan(plan, deadline=None, on_tip=None):
+    """
+    Fill in coach tips for every exercise in the plan that doesn't have one yet.
+    on_tip(day_number, exercise_index, tip) is called as each tip arrives.
+    """
+    positions = {}
+    exercises = []
+    for day in plan['workout_days']:
+        for exercise_index, exercise in enumerate(day['exercises']):
+            if not exercise.get('AI_Recommendations'):
+                positions[id(exercise)] = (day['day_number'], exercise_index)
+                exercises.append(exercise)
+    
+    def tip_ready(exercise, tip):
+        if on_tip:
+            on_tip(*positions[id(exercise)], tip)
+    
+    group_of = (lambda exercise: positions[id(exercise)][0]) if AI_TIP_BATCH_SCOPE == 'day' else None
+    generate_ai_tips(exercises, deadline=deadline, on_tip=tip_ready, group_of=group_of)
+    return plan
+
+def finalize_workout_plan(draft_plan, enhancements, customization_text, customizations, degraded_stages=None):
+    """Merge the enhancements and customization into the plan once everything is ready"""
+    plan = apply_workout_enhancement(draft_plan, enhancements)
+    if customization_text:
+        print(f"Detected customization request: {customization_text}")
+        plan = merge_workout_customization(plan, customization_text, customizations)
+    if degraded_stages is not None:
+        plan['degraded_stages'] = list(degraded_stages)
+    return plan
+
+def llm_timeout(budget):
+    """HTTP timeout for an LLM call with `budget` seconds, in whole seconds"""
+    return max(1, math.ceil(budget))
+
+plan_flight = SingleFlight('workout_plan')
+
+def generate_workout_plan(query_text, deadline=None, on_event=None):
+    """
+    Generate a workout plan for the user's query (see build_workout_plan). Identical
+    concurrent requests with the same whole-second deadline are coalesced: the first
+    one builds the plan within that deadline and the others wait for it and get a copy.
+    A duplicate still waiting when its own deadline is about to run out builds a
+    rule-based plan with the time it has left instead. Streaming requests (with
+    on_event) always build their own.
+    """
+    if on_event is not None:
+        return build_workout_plan(query_text, deadline, on_event)
+    
+    seconds = deadline or PLAN_DEADLINE_SECONDS
+    started = time.monotonic()
+    # Every caller sharing a key has at least the leader's deadline, so the leader never outlasts them
+    bucket = math.floor(seconds) if seconds >= 1 else seconds
+    try:
+        return plan_flight.do(f"{canonicalize_query(query_text)}|{bucket:g}",
+                              lambda: build_workout_plan(query_text, bucket),
+                              timeout=max(0.0, seconds - PLAN_DEADLINE_RESERVE_SECONDS))
+    except (SingleFlightTimeout, SingleFlightError) as e:
+        print(f"Coalesced workout plan unavailable, building one with the remaining budget: {str(e)}")
+        # With this little time left the AI stages are skipped and the plan is rule-based
+        return build_workout_plan(query_text, max(0.01, seconds - (time.monotonic() - started)))
+
+def build_workout_plan(query_text, deadline=None, on_event=None):
+    """
+    Generate a workout plan based on the user's query using Elasticsearch and AI enhancements.
+    
+    The work is expressed as a graph of stages so independent steps overlap: the two
+    intent LLM calls run side by side, and tips, enhancement and the customization
+    request all run once the draft plan exists. Once the intent is resolved, a plan
+    cached for the same intent and catalog generation is returned instead, so
+    retrieval only runs on a cache miss.
+    
+    `deadline` is the time budget in seconds (PLAN_DEADLINE_SECONDS by default). AI
+    stages that would overrun it fall back to the rule-based path or are skipped, and
+    the plan lists them under 'degraded_stages'.
+    
+    `on_event(event, data)` is called as results become available, for streaming:
+    'intent' (resolved parameters), 'overview' and one 'day' per workout day once the
+    draft exists, 'tip' as each coach tip arrives, then 'enhancement' and 'customization'.
+    """
+    try:
+        deadline = Deadline(deadline) if deadline else Deadline()
         
-        # Try to enhance the workout plan with AI recommendations
-        enhanced_plan = ai_enhance_workout_plan(draft_plan, query_text)
+        # Initialize Elasticsearch client
+        es = Elasticsearch("http://elasticsearch:9200")
         
-        # Apply customization if specified
-        if customization_text:
-            final_plan = apply_workout_customization(enhanced_plan, customization_text, query_text)
-            return final_plan
-        else:
-            return enhanced_plan
+        # Retrieval runs against the in-memory catalog; ES is only queried if it's unavailable
+        catalog = None
+        if CATALOG_BACKEND == 'memory':
+            try:
+                catalog = get_catalog()
+            except Exception as e:
+                print(f"Exercise catalog unavailable, using Elasticsearch: {str(e)}")
+        
+        def budgeted(stage, func, fallback, share=1.0):
+            # Run an optional AI stage within its slice of the remaining budget
+            budget = deadline.budget(share=share, reserve=PLAN_DEADLINE_RESERVE_SECONDS)
+            return run_within(deadline, stage, budget, lambda: func(llm_timeout(budget)), fallback)
+        
+        # Streaming: report results to on_event as the stages produce them
+        def emit(event, data):
+            if on_event is None or data is None:
+                return
+            try:
+                on_event(event, data)
+            except Exception as e:
+                print(f"Error emitting {event} event: {str(e)}")
+        
+        def emit_draft(draft):
+            emit('overview', {key: value for key, value in draft.items() if key != 'workout_days'})
+            for day in draft['workout_days']:
+                emit('day', day)
+            return draft
+        
+        def emitted(event, data):
+            emit(event, data)
+            return data
+        
+        def emit_cached_plan(plan):
+            emit_draft(plan)
+            emit('enhancement', plan.get('ai_enhancements'))
+            emit('customization', plan.get('customization'))
+        
+        def tips(draft):
+            return generate_tips_for_plan(draft, deadline, lambda day_number, exercise_index, tip: emit(
+                'tip', {'day_number': day_number, 'exercise_index': exercise_index, 'tip': tip}))
+        
+        def customization_request(draft, customization_text):
+            if not customization_text:
+                return None
+            customizations = budgeted(
+                'customization_request',
+                lambda timeout: request_workout_customization(draft, customization_text, query_text, timeout=timeout,
+                                                              deadline=deadline),
+                lambda: None)
+            if customizations:
+                emit('customization', {'request': customization_text, 'modifications': customizations})
+            return customizations
+        
+        # First the query is understood, so a cached plan for the same intent can be served
+        intent_stages = [
+            Stage('customization', lambda: budgeted(
+                'customization', lambda timeout: extract_customization_intent(query_text, timeout=timeout, deadline=deadline),
+                lambda: None, PLAN_INTENT_BUDGET_SHARE)),
+            Stage('ai_intent', lambda: budgeted(
+                'ai_intent', lambda timeout: generate_ai_workout_intent(query_text, timeout=timeout, deadline=deadline),
+                lambda: None, PLAN_INTENT_BUDGET_SHARE)),
+            Stage('rule_params', lambda: extract_rule_based_params(query_text)),
+            Stage('params', lambda ai_intent, rule_params: emitted('intent', resolve_workout_params(ai_intent, rule_params)),
+                  deps=['ai_intent', 'rule_params'])
+        ]
+        
+        plan_stages = [
+            Stage('retrieval', lambda params: search_workouts(es, query_text, params, catalog), deps=['params']),
+            Stage('selection',
+                  lambda pool, params: select_workout_days(pool, organize_workouts(pool, params), params),
+                  deps=['retrieval', 'params']),
+            Stage('draft',
+                  lambda params, selection: emit_draft(build_draft_plan(params, *selection)),
+                  deps=['params', 'selection']),
+            Stage('tips', tips, deps=['draft']),
+            Stage('enhancement', lambda draft: emitted('enhancement', budgeted(
+                'enhancement', lambda timeout: request_workout_enhancement(draft, query_text, timeout=timeout, deadline=deadline),
+                lambda: None)), deps=['draft']),
+            Stage('customization_request', customization_request, deps=['draft', 'customization']),
+            Stage('final', lambda draft, enhancements, customization_text, customizations, _tips:
+                  finalize_workout_plan(draft, enhancements, customization_text, customizations, deadline.degraded),
+                  deps=['draft', 'enhancement', 'customization', 'customization_request', 'tips'])
+        ]
+        
+        results, timings = run_stages(intent_stages)
+        
+        cache_key = None
+        try:
+            generation = (catalog or get_catalog()).generation
+            cache_key = plan_cache_key(results['params'], results['customization'], generation,
+                                       get_gateway().is_available())
+        except Exception as e:
+            print(f"Plan cache unavailable: {str(e)}")
+        
+        cached_plan = plan_cache.get(cache_key) if cache_key else None
+        if cached_plan is not None:
+            print(f"Workout plan served from cache ({plan_cache.stats()})")
+            emit_cached_plan(cached_plan)
+            print(f"Workout plan stage timings: {format_timings(timings)}")
+            return cached_plan
+        
+        results, plan_timings = run_stages(plan_stages, results=results)
+        plan_timings['total'] += timings['total']
+        timings.update(plan_timings)
+        print(f"Workout plan stage timings: {format_timings(timings)}")
+        
+        # Plans with a degraded stage (out of time, or an AI call that failed) aren't cached,
+        # so the next request gets another chance at the full plan
+        plan = results['final']
+        if cache_key and not deadline.degraded:
+            plan_cache.set(cache_key, plan)
+        return plan
         
     except Exception as e:
         print(f"Error generating workout plan: {str(e)}")
         import traceback
         traceback.print_exc()
-        # Return a basic fallback plan
-        return {
-            'level': 'beginner',
-            'days_per_week': '3',
-            'minutes_per_session': '30',
-            'plan_overview': "Error generating custom plan. Here's a basic fallback plan.",
-            'workout_days': [{
-                'day_number': 1,
-                'overview': "Full Body Workout",
-                'exercises': [{
-                    'Title': "Basic Workout",
-                    'Description': "Simple exercises to get you moving",
-                    'Type': "Strength",
-                    'Equipment': "Body Only",
-                    'BodyPart': "Full Body",
-                    'Level': "Beginner",
-                    'AI_Recommendations': "Start slow and focus on proper form."
-                }]
+        return fallback_workout_plan()
+
+def fallback_workout_plan():
+    """A basic plan returned when generation fails"""
+    return {
+        'level': 'beginner',
+        'days_per_week': '3',
+        'minutes_per_session': '30',
+        'plan_overview': "Error generating custom plan. Here's a basic fallback plan.",
+        'workout_days': [{
+            'day_number': 1,
+            'overview': "Full Body Workout",
+            'exercises': [{
+                'Title': "Basic Workout",
+                'Description': "Simple exercises to get you moving",
+                'Type': "Strength",
+                'Equipment': "Body Only",
+                'BodyPart': "Full Body",
+                'Level': "Beginner",
+                'AI_Recommendations': "Start slow and focus on proper form."
             }]
-        } 
\ No newline at end of file
+        }]
+    } 
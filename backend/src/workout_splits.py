@@ -0,0 +1,175 @@
+import os
+import time
+import threading
+from fuzzywuzzy import process
+
+RAG_INDEX = 'workouts_rag'
+SPLIT_RESULTS_INDEX = 'workouts_rag_splits'  # Precomputed per-muscle results, rebuilt with the RAG index
+SPLIT_DOCUMENTS_PER_MUSCLE = 20
+SPLIT_NUM_CANDIDATES = 50  # kNN candidates per muscle, the same as similarity_search's default fetch_k
+SPLIT_RESULTS_CHECK_INTERVAL = float(os.getenv("SPLIT_RESULTS_CHECK_INTERVAL", "60"))  # Seconds between generation checks
+
+WORKOUT_SPLITS = {
+    "arnold": {
+        "name": "Arnold Split",
+        "days": {
+            "Day 1": ["Chest", "Back"],
+            "Day 2": ["Shoulders", "Bicep","Tricep"],
+            "Day 3": ["Legs"],
+            "Day 4": ["Chest", "Back"],
+            "Day 5": ["Shoulders","Bicep","Tricep"],
+            "Day 6": ["Legs"]
+        }
+    },
+    "push pull legs": {
+        "name": "Push Pull Legs",
+        "days": {
+            "Day 1": ["Chest", "Shoulders", "Triceps"],
+            "Day 2": ["Back", "Biceps"],
+            "Day 3": ["Legs"],
+            "Day 4": ["Chest", "Shoulders", "Triceps"],
+            "Day 5": ["Back", "Biceps"],
+            "Day 6": ["Legs"]
+        }
+    },
+    "upper lower": {
+        "name": "Upper Lower Split",
+        "days": {
+            "Day 1": ["Chest","Shoulders","Bicep","Tricep","Back"],
+            "Day 2": ["Legs","Hips"],
+            "Day 3": ["Chest","Shoulders","Bicep","Tricep","Back"],
+            "Day 4": ["Legs","Hips"]
+        }
+    },
+    "full body": {
+        "name": "Full Body",
+        "days": {
+            "Day 1": ["Chest","Shoulders","Bicep","Tricep","Back","Legs"],
+            "Day 2": ["Chest","Shoulders","Bicep","Tricep","Back","Legs"],
+            "Day 3": ["Chest","Shoulders","Bicep","Tricep","Back","Legs"]
+        }
+    },
+    "bro":{
+        "name": "Bro Split",
+        "days": {
+            "Day 1": ["Chest"],
+            "Day 2:": ["Back"],
+            "Day 3:": ["Shoulders"],
+            "Day 4:": ["Arms"],
+            "Day 5:": ["Legs"]
+        }
+    }
+}
+
+SPLIT_NAMES = list(WORKOUT_SPLITS.keys())
+
+def split_muscles(split_days):
+    """Distinct muscles trained in a split, in order of first appearance"""
+    return list(dict.fromkeys(muscle for muscle_groups in split_days.values() for muscle in muscle_groups))
+
+# Every muscle any built-in split trains
+SPLIT_MUSCLES = list(dict.fromkeys(muscle for split in WORKOUT_SPLITS.values() for muscle in split_muscles(split["days"])))
+
+def get_workout_split(question:str)->dict:
+    '''Gets the muscle groups trained each day in a named workout split'''
+    match,score = process.extractOne(question,SPLIT_NAMES)
+
+    if score > 80:
+        return WORKOUT_SPLITS[match]
+    else:
+        return None
+
+def search_muscles(es, embedding, muscles):
+    """
+    Top documents for each muscle in the RAG index, as {muscle: [{'text', 'metadata'}]}
+    by rank. The muscles are embedded in one batch and searched in one multi-search.
+    """
+    vectors = embedding.embed_documents(muscles)
+    searches = []
+    for vector in vectors:
+        searches.append({'index': RAG_INDEX})
+        searches.append({
+            'knn': {'field': 'vector', 'query_vector': list(vector), 'k': SPLIT_DOCUMENTS_PER_MUSCLE,
+                    'num_candidates': SPLIT_NUM_CANDIDATES},
+            'size': SPLIT_DOCUMENTS_PER_MUSCLE,
+            '_source': ['text', 'metadata']
+        })
+    responses = es.msearch(searches=searches)['responses']
+
+    results = {}
+    for muscle, response in zip(muscles, responses):
+        if 'error' in response:
+            print(f"Split search for {muscle} failed: {response['error']}")
+            results[muscle] = []
+            continue
+        results[muscle] = [{'text': hit['_source']['text'], 'metadata': hit['_source'].get('metadata', {})}
+                           for hit in response['hits']['hits']]
+    return results
+
+def get_rag_generation(es):
+    """Generation stamp that new_rag_index writes into the RAG index mapping's _meta (None if missing)"""
+    mapping = es.indices.get_mapping(index=RAG_INDEX)
+    return mapping[RAG_INDEX]['mappings'].get('_meta', {}).get('generation')
+
+def materialize_split_results(es, embedding, generation):
+    """Store the results for every split muscle in the sidecar index, stamped with the RAG index generation"""
+    es.indices.refresh(index=RAG_INDEX)
+    results = search_muscles(es, embedding, SPLIT_MUSCLES)
+
+    es.indices.delete(index=SPLIT_RESULTS_INDEX, ignore_unavailable=True)
+    es.indices.create(index=SPLIT_RESULTS_INDEX, mappings={
+        "_meta": {"generation": generation},
+        "properties": {
+            "muscle": {"type": "keyword"},
+            "generation": {"type": "long"},
+            "documents": {"type": "object", "enabled": False}
+        }
+    })
+    for muscle, documents in results.items():
+        es.index(index=SPLIT_RESULTS_INDEX, id=muscle,
+                 document={'muscle': muscle, 'generation': generation, 'documents': documents})
+    es.indices.refresh(index=SPLIT_RESULTS_INDEX)
+    print(f"Materialized split results for {len(results)} muscles")
+
+class SplitResults:
+    """
+    In-memory copy of the precomputed per-muscle results. They are used only
+    while their generation matches the RAG index, which is checked at most
+    every SPLIT_RESULTS_CHECK_INTERVAL seconds; a reindex triggers a reload.
+    """
+
+    def __init__(self, es):
+        self.es = es
+        self.generation = None
+        self.results = {}
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if self._last_check and time.monotonic() - self._last_check < SPLIT_RESULTS_CHECK_INTERVAL:
+            return
+        with self._lock:
+            if self._last_check and time.monotonic() - self._last_check < SPLIT_RESULTS_CHECK_INTERVAL:
+                return
+            self._last_check = time.monotonic()
+            try:
+                generation = get_rag_generation(self.es)
+                if generation is None:
+                    self.results = {}
+                elif generation != self.generation:
+                    hits = self.es.search(index=SPLIT_RESULTS_INDEX, query={'term': {'generation': generation}},
+                                          size=len(SPLIT_MUSCLES) * 2)['hits']['hits']
+                    self.results = {hit['_source']['muscle']: hit['_source']['documents'] for hit in hits}
+                    print(f"Loaded precomputed split results for {len(self.results)} muscles")
+                self.generation = generation
+            except Exception as e:
+                print(f"Precomputed split results unavailable: {str(e)}")
+                self.results = {}
+                self.generation = None
+
+    def get(self, muscles):
+        """{muscle: [{'text', 'metadata'}]} if every muscle is precomputed for the current index, else None"""
+        self._refresh()
+        if all(muscle in self.results for muscle in muscles):
+            return {muscle: self.results[muscle] for muscle in muscles}
+        return None
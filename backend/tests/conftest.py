@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Keep the caches the modules open at import time out of the working tree
+os.environ.setdefault("CACHE_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="fitgpt-tests-"), "cache.sqlite3"))
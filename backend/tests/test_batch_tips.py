@@ -0,0 +1,48 @@
+import pytest
+from src.workout_generator import parse_batch_tips
+
+def test_entries_are_mapped_by_index():
+    content = '[{"index": 1, "tip": "Keep your back flat."}, {"index": 0, "tip": "Brace your core."}]'
+    assert parse_batch_tips(content, 2) == ["Brace your core.", "Keep your back flat."]
+
+def test_text_around_the_array_is_ignored():
+    content = 'Here are your tips:\n```json\n[{"index": 0, "tip": "Slow the descent."}]\n```'
+    assert parse_batch_tips(content, 1) == ["Slow the descent."]
+
+@pytest.mark.parametrize('content', [
+    'Sorry, I can not help with that.',
+    '[{"index": 0, "tip": "unterminated',
+    '[not json]',
+    '] backwards [',
+    ''
+])
+def test_unparseable_responses_give_no_tips(content):
+    assert parse_batch_tips(content, 3) == [None, None, None]
+
+def test_malformed_entries_are_skipped():
+    content = '''[
+        "just a string",
+        {"index": 0},
+        {"index": 1, "tip": ""},
+        {"index": 2, "tip": 42},
+        {"index": 7, "tip": "Out of range."},
+        {"index": -1, "tip": "Negative."},
+        {"index": true, "tip": "Boolean index."},
+        {"index": "3", "tip": "String index."},
+        {"tip": "No index."}
+    ]'''
+    assert parse_batch_tips(content, 4) == [None, None, None, "String index."]
+
+def test_first_tip_for_an_index_wins():
+    content = '[{"index": 0, "tip": "First."}, {"index": 0, "tip": "Second."}]'
+    assert parse_batch_tips(content, 1) == ["First."]
+
+def test_json_that_is_not_a_list_gives_no_tips():
+    assert parse_batch_tips('[1, 2][', 2) == [None, None]
+    assert parse_batch_tips('{"tips": []}', 1) == [None]
+
+def test_long_tips_are_trimmed():
+    long_tip = "Keep your elbows tucked. Drive through your heels. " + "Stay tight " * 40
+    tip = parse_batch_tips(f'[{{"index": 0, "tip": "{long_tip}"}}]', 1)[0]
+    assert tip.startswith("Keep your elbows tucked.") and "Drive through your heels." in tip
+    assert "Stay tight" not in tip
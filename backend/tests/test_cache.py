@@ -0,0 +1,63 @@
+import time
+from src.cache import TieredCache
+from src.plan_cache import PlanCache
+
+def test_memory_entries_expire_after_ttl(tmp_path):
+    cache = TieredCache('ttl', ttl=0.1, persist=False)
+    cache.set('key', 'value')
+    assert cache.get('key') == 'value'
+    time.sleep(0.15)
+    assert cache.get('key') is None
+
+def test_disk_entries_expire_after_ttl(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    TieredCache('ttl', ttl=0.1, path=path).set('key', 'value')
+    # A fresh instance has an empty memory tier, like another worker
+    assert TieredCache('ttl', ttl=0.1, path=path).get('key') == 'value'
+    time.sleep(0.15)
+    assert TieredCache('ttl', ttl=0.1, path=path).get('key') is None
+
+def test_per_entry_ttl_overrides_default(tmp_path):
+    cache = TieredCache('ttl', ttl=60, path=str(tmp_path / 'cache.sqlite3'))
+    cache.set('short', 'value', ttl=0.1)
+    cache.set('long', 'value')
+    time.sleep(0.15)
+    assert cache.get('short') is None
+    assert cache.get('long') == 'value'
+
+def test_disk_hits_are_promoted_to_memory(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    TieredCache('promote', path=path).set('key', {'a': 1})
+    cache = TieredCache('promote', path=path)
+    assert cache.get('key') == {'a': 1}
+    assert cache.get('key') == {'a': 1}
+    stats = cache.stats()
+    assert stats['disk_hits'] == 1 and stats['memory_hits'] == 1
+
+def test_disk_tier_stores_a_snapshot(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    value = {'exercises': ['squat']}
+    TieredCache('copies', path=path).set('key', value)
+    value['exercises'].append('lunge')
+
+    first = TieredCache('copies', path=path).get('key')
+    assert first == {'exercises': ['squat']}
+    first['exercises'].append('row')
+    assert TieredCache('copies', path=path).get('key') == {'exercises': ['squat']}
+
+def test_plan_cache_returns_independent_copies(tmp_path):
+    plans = PlanCache(persist=False)
+    plan = {'workout_days': [{'day_number': 1, 'exercises': []}]}
+    plans.set('key', plan)
+    plan['workout_days'].clear()
+
+    first = plans.get('key')
+    first['workout_days'][0]['exercises'].append({'Title': 'Squat'})
+    assert plans.get('key') == {'workout_days': [{'day_number': 1, 'exercises': []}]}
+
+def test_namespaces_share_a_file_without_colliding(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    TieredCache('one', path=path).set('key', 1)
+    TieredCache('two', path=path).set('key', 2)
+    assert TieredCache('one', path=path).get('key') == 1
+    assert TieredCache('two', path=path).get('key') == 2
@@ -0,0 +1,55 @@
+import pytest
+import src.catalog as catalog
+
+class FakeIndices:
+    def __init__(self, es):
+        self.es = es
+
+    def get_mapping(self, index):
+        meta = {'_meta': {'generation': self.es.generation}} if self.es.generation else {}
+        return {index: {'mappings': meta}}
+
+class FakeElasticsearch:
+    def __init__(self, generation, count):
+        self.generation = generation
+        self.count = count
+        self.indices = FakeIndices(self)
+
+    def search(self, **kwargs):
+        return {'hits': {'hits': [
+            {'_id': str(index), '_source': {'Title': f"Exercise {index}", 'Description': '', 'Type': 'Strength',
+                                            'Equipment': 'Dumbbell', 'Level': 'Beginner', 'BodyPart': 'Chest'}}
+            for index in range(self.count)
+        ]}}
+
+@pytest.fixture
+def es(monkeypatch):
+    state = {}
+    monkeypatch.setattr(catalog, '_es_client', lambda: state['es'])
+    monkeypatch.setattr(catalog, '_catalog', None)
+    monkeypatch.setattr(catalog, '_reload_listeners', [])
+
+    def use(generation, count):
+        state['es'] = FakeElasticsearch(generation, count)
+    return use
+
+@pytest.mark.parametrize('generation, count', [(None, 5), (2, 0)])
+def test_unfinished_index_keeps_the_previous_catalog(es, generation, count):
+    es(1, 5)
+    loaded = catalog.reload_catalog()
+    reloads = []
+    catalog.add_reload_listener(reloads.append)
+
+    es(generation, count)
+    assert catalog.reload_catalog() is loaded
+    assert reloads == []
+
+def test_file_catalog_ignores_an_unstamped_index(es):
+    es(None, 5)
+    file_catalog = catalog.reload_catalog()
+    assert file_catalog.source == 'file'
+    assert not catalog._catalog_changed(file_catalog)
+
+    es(3, 5)
+    assert catalog._catalog_changed(file_catalog)
+    assert catalog.reload_catalog().source == 'elasticsearch'
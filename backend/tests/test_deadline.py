@@ -0,0 +1,60 @@
+import time
+import pytest
+from src.deadline import Deadline, parse_deadline_header, run_within
+from src.pipeline import Stage, run_stages
+
+def test_slow_stage_degrades_to_its_fallback():
+    deadline = Deadline(5)
+    results, timings = run_stages([
+        Stage('slow', lambda: run_within(deadline, 'slow', 0.6, lambda: time.sleep(2) or 'ai', lambda: 'rule')),
+        Stage('fast', lambda: run_within(deadline, 'fast', 1, lambda: 'ai', lambda: 'rule')),
+        Stage('final', lambda slow, fast: (slow, fast), deps=['slow', 'fast'])
+    ])
+    assert results['final'] == ('rule', 'ai')
+    assert deadline.degraded == ['slow']
+    assert timings['total'] < 1.5
+
+def test_stage_without_budget_is_skipped():
+    deadline = Deadline(0.2)
+    calls = []
+    results, _ = run_stages([
+        Stage('ai', lambda: run_within(deadline, 'ai', deadline.budget(reserve=0.5),
+                                       lambda: calls.append(1) or 'ai', lambda: None))
+    ])
+    assert results['ai'] is None
+    assert calls == []
+    assert deadline.degraded == ['ai']
+
+def test_budget_shrinks_as_the_deadline_passes():
+    deadline = Deadline(1)
+    time.sleep(0.3)
+    assert 0.1 < deadline.budget(share=0.5, reserve=0.2) < 0.3
+    time.sleep(0.8)
+    assert deadline.budget() == 0
+
+def test_errors_inside_the_budget_are_not_fallbacks():
+    def fail():
+        raise ValueError("bad request")
+    deadline = Deadline(5)
+    with pytest.raises(ValueError):
+        run_within(deadline, 'ai', 1, fail, lambda: 'rule')
+    assert deadline.degraded == []
+
+def test_degrade_records_each_stage_once():
+    deadline = Deadline(5)
+    deadline.degrade('tips', "ran out of time")
+    deadline.degrade('tips', "ran out of time again")
+    deadline.degrade('enhancement', "skipped")
+    assert deadline.degraded == ['tips', 'enhancement']
+
+@pytest.mark.parametrize('value, expected', [
+    ('1500', 1.5),
+    ('250.5', 0.2505),
+    (None, 25),
+    ('', 25),
+    ('soon', 25),
+    ('0', 25),
+    ('-100', 25)
+])
+def test_deadline_header_is_read_in_milliseconds(value, expected):
+    assert parse_deadline_header(value, default=25) == pytest.approx(expected)
@@ -0,0 +1,12 @@
+from src.intent_cache import IntentCache, canonicalize_query
+
+def test_canonical_query_only_folds_case_punctuation_and_whitespace():
+    assert canonicalize_query("3 Days per week,  dumbbells ONLY!") == "3 days per week dumbbells only"
+    assert canonicalize_query("a few sets, once a week") == "a few sets once a week"
+    assert canonicalize_query("three days") != canonicalize_query("3 days")
+
+def test_intent_key_normalizes_spelled_numbers():
+    cache = IntentCache(persist=False)
+    cache.set('intent', "Three days per week", {'days_per_week': 3})
+    assert cache.get('intent', "3 days per week!") == (True, {'days_per_week': 3})
+    assert cache.get('intent', "a few days per week") == (False, None)
@@ -0,0 +1,30 @@
+import pytest
+from src.pipeline import Stage, run_stages, validate_stages
+
+def test_stages_receive_their_dependencies():
+    results, timings = run_stages([
+        Stage('a', lambda: 1),
+        Stage('b', lambda: 2),
+        Stage('sum', lambda a, b: a + b, deps=['a', 'b'])
+    ])
+    assert results['sum'] == 3
+    assert set(timings) == {'a', 'b', 'sum', 'total'}
+
+def test_seeded_results_satisfy_dependencies():
+    results, _ = run_stages([Stage('double', lambda value: value * 2, deps=['value'])], results={'value': 4})
+    assert results['double'] == 8
+
+def test_stage_errors_are_raised():
+    def fail():
+        raise ValueError("retrieval failed")
+    with pytest.raises(ValueError):
+        run_stages([Stage('retrieval', fail), Stage('draft', lambda retrieval: retrieval, deps=['retrieval'])])
+
+@pytest.mark.parametrize('stages', [
+    [Stage('a', lambda: 1), Stage('a', lambda: 2)],
+    [Stage('a', lambda b: b, deps=['b'])],
+    [Stage('a', lambda b: b, deps=['b']), Stage('b', lambda a: a, deps=['a'])]
+])
+def test_invalid_graphs_are_rejected(stages):
+    with pytest.raises(ValueError):
+        validate_stages(stages)
@@ -0,0 +1,20 @@
+import src.catalog as catalog
+import src.workout_generator as workout_generator
+from src.plan_cache import PlanCache
+from tests.test_plan_deadline import FakeGateway
+
+def test_cached_plan_skips_retrieval(monkeypatch):
+    monkeypatch.setattr(workout_generator, 'get_gateway', lambda: FakeGateway())
+    monkeypatch.setattr(catalog, 'load_catalog', lambda previous=None: catalog.load_catalog_from_file())
+    monkeypatch.setattr(workout_generator, 'plan_cache', PlanCache(persist=False, enabled=True))
+    searches = []
+    search_workouts = workout_generator.search_workouts
+    monkeypatch.setattr(workout_generator, 'search_workouts',
+                        lambda *args, **kwargs: searches.append(args) or search_workouts(*args, **kwargs))
+
+    first = workout_generator.build_workout_plan("3 day dumbbell plan for beginners", deadline=10)
+    assert len(searches) == 1
+
+    second = workout_generator.build_workout_plan("3 day dumbbell plan for beginners", deadline=10)
+    assert len(searches) == 1
+    assert second == first
@@ -0,0 +1,99 @@
+import json
+import time
+import uuid
+import pytest
+import src.catalog as catalog
+import src.workout_generator as workout_generator
+from src.deadline import Deadline
+
+class FakeGateway:
+    """Answers each kind of LLM call instantly, except the purposes listed in `slow`"""
+
+    def __init__(self, slow=(), delay=3):
+        self.slow = slow
+        self.delay = delay
+        self.calls = []
+
+    def is_available(self):
+        return True
+
+    def model_for(self, purpose):
+        return 'fake-model'
+
+    def complete(self, purpose, messages, timeout=None, **kwargs):
+        self.calls.append(purpose)
+        if purpose in self.slow:
+            time.sleep(self.delay)
+        prompt = messages[-1].content
+        if purpose == 'intent':
+            return '{"fitness_level": "beginner"}'
+        if purpose == 'customization_intent':
+            return 'None'
+        if purpose == 'tips':
+            if 'JSON array' in prompt:
+                return json.dumps([{"index": index, "tip": "Brace your core."} for index in range(100)])
+            return "Brace your core."
+        return '{"training_tips": ["Sleep well."]}'
+
+@pytest.fixture
+def gateway(monkeypatch):
+    def use(**kwargs):
+        fake = FakeGateway(**kwargs)
+        monkeypatch.setattr(workout_generator, 'get_gateway', lambda: fake)
+        return fake
+    return use
+
+@pytest.fixture
+def no_plan_cache(monkeypatch):
+    monkeypatch.setattr(catalog, 'load_catalog', lambda previous=None: catalog.load_catalog_from_file())
+    monkeypatch.setattr(workout_generator.plan_cache, 'enabled', False)
+
+def exercises(count):
+    # Unique titles, so no tip is served from the tip cache or the precomputed file
+    run = uuid.uuid4().hex
+    return [{'Title': f"Test press {run} {index}", 'Equipment': 'Dumbbell', 'BodyPart': 'Chest', 'Level': 'Beginner'}
+            for index in range(count)]
+
+def test_plan_lists_the_stage_that_overran(gateway, no_plan_cache):
+    gateway(slow=('enhancement',))
+    started = time.monotonic()
+    plan = workout_generator.build_workout_plan("3 day dumbbell plan for beginners", deadline=3)
+
+    assert time.monotonic() - started < 3.5
+    assert plan['degraded_stages'] == ['enhancement']
+    assert 'ai_enhancements' not in plan
+    assert plan['workout_days']
+
+def test_plan_within_budget_has_no_degraded_stages(gateway, no_plan_cache):
+    gateway()
+    plan = workout_generator.build_workout_plan("3 day dumbbell plan for beginners", deadline=10)
+    assert plan['degraded_stages'] == []
+    assert plan['ai_enhancements'] == {'training_tips': ['Sleep well.']}
+
+def test_tips_without_budget_are_rule_based(gateway):
+    fake = gateway()
+    deadline = Deadline(0.3)
+    batch = exercises(3)
+    workout_generator.generate_ai_tips(batch, deadline=deadline, mode='individual')
+
+    assert fake.calls == []
+    assert deadline.degraded == ['tips']
+    assert all(exercise['AI_Recommendations'] == workout_generator.generate_ai_tip_rule_based(exercise)
+               for exercise in batch)
+
+def test_tips_stop_waiting_at_the_budget(gateway):
+    fake = gateway(slow=('tips',))
+    deadline = Deadline(1.5)
+    batch = exercises(6)
+    started = time.monotonic()
+    workout_generator.generate_ai_tips(batch, deadline=deadline, mode='individual', max_concurrency=2)
+    elapsed = time.monotonic() - started
+
+    # The executor is shut down without waiting: the two calls in flight are abandoned
+    # and the four queued behind them never start
+    assert elapsed < 1.5
+    assert fake.calls == ['tips', 'tips']
+    assert deadline.degraded == ['tips']
+    assert all(exercise['AI_Recommendations'] for exercise in batch)
+    time.sleep(0.1)
+    assert fake.calls == ['tips', 'tips']
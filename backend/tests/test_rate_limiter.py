@@ -0,0 +1,76 @@
+import time
+import threading
+from types import SimpleNamespace
+from src.rate_limiter import RateLimiter, estimate_tokens, retry_delay
+
+def take_concurrently(limiters, attempts_each):
+    """Each limiter tries try_acquire attempts_each times from its own thread; returns the grants"""
+    granted = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(limiters))
+
+    def worker(limiter):
+        barrier.wait()
+        for _ in range(attempts_each):
+            if limiter.try_acquire(0) == 0:
+                with lock:
+                    granted.append(1)
+
+    threads = [threading.Thread(target=worker, args=(limiter,)) for limiter in limiters]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return len(granted)
+
+def shared_limiters(path, count, rps, burst):
+    # Separate instances on one file stand in for separate worker processes
+    return [RateLimiter(rps=rps, burst=burst, tpm=0, shared=True, path=path) for _ in range(count)]
+
+def test_shared_bucket_never_over_grants(tmp_path):
+    limiters = shared_limiters(str(tmp_path / 'limits.sqlite3'), 4, rps=0.5, burst=5)
+    assert all(limiter.path is not None for limiter in limiters)
+    assert take_concurrently(limiters, 5) == 5
+
+def test_shared_bucket_refills_at_its_rate(tmp_path):
+    limiters = shared_limiters(str(tmp_path / 'limits.sqlite3'), 4, rps=4, burst=4)
+    assert take_concurrently(limiters, 4) == 4
+    time.sleep(0.55)
+    # ~2.2 requests refilled; concurrent transactions must not hand out more than that
+    assert take_concurrently(limiters, 4) == 2
+
+def test_refill_is_capped_at_capacity(tmp_path):
+    limiters = shared_limiters(str(tmp_path / 'limits.sqlite3'), 2, rps=20, burst=3)
+    assert take_concurrently(limiters, 3) == 3
+    time.sleep(0.5)  # Enough for 10 requests, but the bucket holds 3
+    assert take_concurrently(limiters, 5) == 3
+
+def test_background_calls_leave_the_reserve_free():
+    limiter = RateLimiter(rps=0.01, burst=4, tpm=0, background_reserve=0.5, shared=False)
+    assert limiter.try_acquire(0, 'background') == 0
+    assert limiter.try_acquire(0, 'background') == 0
+    assert limiter.try_acquire(0, 'background') > 0
+    assert limiter.try_acquire(0, 'interactive') == 0
+    assert limiter.try_acquire(0, 'interactive') == 0
+
+def test_cooldown_holds_back_every_call():
+    limiter = RateLimiter(rps=100, tpm=0, shared=False)
+    limiter.cooldown(5)
+    assert 4 < limiter.try_acquire(0) <= 5
+
+def test_token_usage_corrects_the_estimate():
+    limiter = RateLimiter(rps=0, tpm=600, shared=False)
+    assert limiter.try_acquire(100) == 0
+    limiter.record_usage(100, 550)  # The call really used 550 of the 600 tokens
+    assert limiter.try_acquire(100) > 0
+
+def test_retry_delay_honors_retry_after():
+    error = SimpleNamespace(headers={'Retry-After': '2'})
+    assert 2 <= retry_delay(error, 1) <= 2.2
+    error = SimpleNamespace(headers={'retry-after-ms': '500'})
+    assert 0.5 <= retry_delay(error, 1) <= 0.55
+    assert 0 <= retry_delay(SimpleNamespace(headers=None), 3) <= 4
+
+def test_estimate_tokens_counts_prompt_and_completion():
+    messages = [SimpleNamespace(content='x' * 400)]
+    assert estimate_tokens(messages, max_tokens=50) == 150
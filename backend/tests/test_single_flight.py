@@ -0,0 +1,110 @@
+import time
+import threading
+import pytest
+from src.single_flight import SingleFlight, SingleFlightTimeout
+
+def wait_until(condition, timeout=2):
+    expires_at = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < expires_at, "condition not met in time"
+        time.sleep(0.01)
+
+def start_leader(flight, key, func):
+    """Run flight.do(key, func) in a thread and wait until it is in flight"""
+    started = threading.Event()
+    outcome = {}
+
+    def leader():
+        def run():
+            started.set()
+            return func()
+        try:
+            outcome['result'] = flight.do(key, run)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    assert started.wait(2)
+    return thread, outcome
+
+def test_duplicates_share_one_call():
+    flight = SingleFlight('test', shared=False)
+    release = threading.Event()
+    calls = []
+
+    def build():
+        calls.append(1)
+        release.wait(2)
+        return {'plan': [1, 2]}
+
+    thread, outcome = start_leader(flight, 'key', build)
+    results = []
+    waiters = [threading.Thread(target=lambda: results.append(flight.do('key', build))) for _ in range(3)]
+    for waiter in waiters:
+        waiter.start()
+    wait_until(lambda: flight.stats()['coalesced'] == 3)
+    release.set()
+    for waiter in waiters + [thread]:
+        waiter.join(2)
+
+    assert len(calls) == 1
+    assert results == [{'plan': [1, 2]}] * 3
+    # Every waiter gets its own copy
+    results[0]['plan'].append(3)
+    assert results[1] == {'plan': [1, 2]} and outcome['result'] == {'plan': [1, 2]}
+
+def test_waiter_times_out_while_leader_continues():
+    flight = SingleFlight('test', shared=False)
+    release = threading.Event()
+    thread, outcome = start_leader(flight, 'key', lambda: release.wait(2) and 'done')
+
+    with pytest.raises(SingleFlightTimeout):
+        flight.do('key', lambda: 'duplicate', timeout=0.1)
+
+    release.set()
+    thread.join(2)
+    assert outcome['result'] == 'done'
+    assert flight.stats()['in_flight'] == 0
+
+def test_leader_exception_reaches_waiters_and_clears_the_key():
+    flight = SingleFlight('test', shared=False)
+    release = threading.Event()
+
+    def fail():
+        release.wait(2)
+        raise ValueError("LLM unavailable")
+
+    thread, outcome = start_leader(flight, 'key', fail)
+    errors = []
+
+    def waiter():
+        try:
+            flight.do('key', lambda: 'unused')
+        except ValueError as e:
+            errors.append(e)
+
+    waiter_thread = threading.Thread(target=waiter)
+    waiter_thread.start()
+    wait_until(lambda: flight.stats()['coalesced'] == 1)
+    release.set()
+    waiter_thread.join(2)
+    thread.join(2)
+
+    assert isinstance(outcome['error'], ValueError)
+    assert len(errors) == 1 and str(errors[0]) == "LLM unavailable"
+    # The failure isn't remembered: the next call runs again
+    assert flight.do('key', lambda: 'recovered') == 'recovered'
+
+def test_different_keys_run_separately():
+    flight = SingleFlight('test', shared=False)
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.do('b', lambda: 2) == 2
+    assert flight.stats()['leaders'] == 2 and flight.stats()['coalesced'] == 0
+
+def test_disabled_runs_every_call():
+    flight = SingleFlight('test', enabled=False)
+    calls = []
+    flight.do('key', lambda: calls.append(1))
+    flight.do('key', lambda: calls.append(1))
+    assert len(calls) == 2
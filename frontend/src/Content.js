@@ -5,6 +5,7 @@ import WorkoutHistory from './components/WorkoutHistory'
 import TimeoutWarning from './components/TimeoutWarning'
 import './Content.css'
 import { auth } from './firebase'
+import { readEventStream } from './eventStream'
 
 const WorkoutCard = ({ workout }) => {
     return (
@@ -177,7 +178,7 @@ const Content = () => {
                 ? `${prompt} And please: ${aiCustomization}`
                 : prompt;
 
-            const response = await fetch('http://localhost:5001/query', {
+            const response = await fetch('http://localhost:5001/query/stream', {
                 method: 'POST',
                 headers: { 
                     "Content-Type": "application/json",
@@ -188,8 +189,32 @@ const Content = () => {
             });
 
             if (!response.ok) throw new Error('Network response was not ok');
-            const data = await response.json();
-            setResponse(data.workout_plan);
+
+            // Show the plan as it is generated: overview and days first, then tips, then the final plan
+            setResponse(null);
+            const handleEvent = (event, data) => {
+                if (event === 'overview') {
+                    setResponse({ ...data, workout_days: [] });
+                } else if (event === 'day') {
+                    setResponse(prev => ({ ...(prev || {}), workout_days: [...((prev && prev.workout_days) || []), data] }));
+                } else if (event === 'tip') {
+                    setResponse(prev => prev && ({
+                        ...prev,
+                        workout_days: prev.workout_days.map(day => day.day_number !== data.day_number ? day : {
+                            ...day,
+                            exercises: day.exercises.map((exercise, index) => index !== data.exercise_index
+                                ? exercise : { ...exercise, AI_Recommendations: data.tip })
+                        })
+                    }));
+                } else if (event === 'complete') {
+                    setResponse(data.workout_plan);
+                    setLoading(false);
+                } else if (event === 'error') {
+                    throw new Error(data.message);
+                }
+            };
+
+            await readEventStream(response, handleEvent);
             setLoading(false);
         } catch (error) {
             console.error('Error:', error);
@@ -1,6 +1,7 @@
-import { useState } from "react"
+import { useState, useRef, useEffect } from "react"
 import '../Content.css'
 import './Chat.css'
+import { readEventStream } from '../eventStream'
 
 
 
@@ -8,16 +9,40 @@ const Chat = () => {
     const [query,setQuery] = useState('')
     const [answer,setAnswer] = useState('')
     const [loading,setLoading] = useState(false)
+    const controller = useRef(null)
 
-    const answerQuestion = () => {
-        fetch('/chat',{method:'POST',headers: {"Content-Type": "application/json"},credentials:'include',body:JSON.stringify({query:query,session_id:0})})
-        .then(response => response.json())
-        .then(data => {
-            console.log(data.response)
-            setAnswer(data.response) 
+    // Leaving the page drops the connection, which cancels the answer on the server
+    useEffect(() => () => controller.current && controller.current.abort(), [])
+
+    const handleEvent = (event, data) => {
+        if (event === 'token') {
+            setAnswer(previous => previous + data.text)
+            setLoading(false)
+        } else if (event === 'complete') {
+            setAnswer(data.response)
+            setLoading(false)
+        } else if (event === 'error') {
+            console.error('Chat error:', data.message)
+            setLoading(false)
+        }
+    }
+
+    const answerQuestion = async () => {
+        if (controller.current) {
+            controller.current.abort()
+        }
+        controller.current = new AbortController()
+        setAnswer('')
+        try {
+            const response = await fetch('/chat/stream',{method:'POST',headers: {"Content-Type": "application/json"},credentials:'include',body:JSON.stringify({query:query,session_id:0}),signal:controller.current.signal})
+            await readEventStream(response, handleEvent)
             setLoading(false)
-        })
-        .catch(() => setLoading(false))
+        } catch (error) {
+            if (error.name !== 'AbortError') {
+                console.error('Error:', error)
+                setLoading(false)
+            }
+        }
     }
 
     const handleLoading = () => {
@@ -0,0 +1,21 @@
+// Read a Server-Sent Events response body, calling onEvent(event, data) with the
+// JSON payload of each message as it arrives. Resolves when the stream ends.
+export const readEventStream = async (response, onEvent) => {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const messages = buffer.split('\n\n');
+        buffer = messages.pop();
+        for (const message of messages) {
+            const eventLine = message.split('\n').find(line => line.startsWith('event: '));
+            const dataLine = message.split('\n').find(line => line.startsWith('data: '));
+            if (eventLine && dataLine) {
+                onEvent(eventLine.slice(7), JSON.parse(dataLine.slice(6)));
+            }
+        }
+    }
+};